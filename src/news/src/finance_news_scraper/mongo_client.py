@@ -1,15 +1,17 @@
 import pymongo
 import os
 from finance_news_scraper.news_sources import News_Item
-from newspaper import Article
 import numpy as np
 from pymongo import ASCENDING, DESCENDING
 from pymongo.typings import _CollationIn, _DocumentIn, _DocumentType, _Pipeline
 from pymongo.cursor import Cursor
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 from datetime import datetime
 import pandas as pd
 
+if TYPE_CHECKING:
+    from newspaper import Article
+
 HOST = os.getenv('NEWSSCRAPER_MONGODB_HOST',"localhost")
 PORT = int(os.getenv('NEWSSCRAPER_MONGODB_PORT',"27017"))
 USERNAME = os.getenv('NEWSSCRAPER_MONGODB_USERNAME',"admin")
@@ -61,7 +63,7 @@ class MongoDBClient(object):
         }
         self.sentiment_collection.insert_one(data)
         
-    def build_document(self,item:News_Item,article:Article)->dict:
+    def build_document(self,item:News_Item,article:"Article")->dict:
         return {
                 'url': item.link,
                 'hash': item.hash,
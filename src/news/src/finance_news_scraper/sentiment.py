@@ -1,9 +1,12 @@
 import logging
-import torch 
-from torch.nn import functional as f
-from transformers import BertForSequenceClassification, BertTokenizer
 import numpy as np
 import os 
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    #torch and transformers take seconds to import, they are only loaded once a model is needed
+    import torch
+    from transformers import BertTokenizer
 
 MAX_LENGTH = 512
 START_TOKEN = 101
@@ -18,8 +21,8 @@ MODEL_DIR = os.path.abspath(os.getenv('NEWSSCRAPER_MODEL_DIR',"../../../sentimen
 
 
 class  SentimentProvider(object):
-    tokenizer: BertTokenizer
-    model: torch.jit._script.RecursiveScriptModule
+    tokenizer: "BertTokenizer"
+    model: "torch.jit._script.RecursiveScriptModule"
     def __init__(self) -> None:
         self.tokenizer = None
         self.model = None
@@ -30,6 +33,8 @@ class  SentimentProvider(object):
         return self.model is not None and self.tokenizer is not None
     
     def load_model(self)->None:
+        import torch
+        from transformers import BertForSequenceClassification, BertTokenizer
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.tokenizer = BertTokenizer.from_pretrained(TOKENIZER_MODEL)
         os.makedirs(MODEL_DIR,exist_ok=True)
@@ -59,6 +64,8 @@ class  SentimentProvider(object):
         """
         Computes the class and the probability of the logits for the given text.
         """
+        import torch
+        from torch.nn import functional as f
         if not self.is_model_loaded:
             self.load_model()
             
@@ -73,6 +80,7 @@ class  SentimentProvider(object):
         """
         Uses the tokenizer to build MAX_LENGTH long slices of the text. 
         """
+        import torch
         with torch.no_grad():
             tokenized = self.tokenizer.encode_plus(text,add_special_tokens=False,return_tensors="pt")
             #to support longer texts we split the sequence and pad it manually => then we pass it to the model 
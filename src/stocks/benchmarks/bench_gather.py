@@ -0,0 +1,299 @@
+"""
+Offline end-to-end benchmark of a `Scheduler` run (the path of the Single and Scheduled modes). Everything is injected through the ExecutionContext:
+Yahoo Finance is replaced by a provider that replays synthetic (or recorded) frames, QuestDB by a local fake /exec endpoint and a local ILP sink that only counts what it receives.
+Reports rows/sec, peak RSS and the time spent downloading, transforming and flushing.
+
+Usage: python benchmarks/bench_gather.py [--tickers 200] [--intervals 5m,1d] [--workers 4] [--existing-days 0] [--latency 0] [--recording frames.pkl] [--min-rows-per-sec 0]
+A recording is a pickled frame in the yfinance layout (columns (ticker, field)), e.g. `yf.download(..., group_by="ticker").to_pickle("frames.pkl")`.
+With --min-rows-per-sec the script exits with 1 if the throughput is below the threshold, the benchmark workflow uses it to catch regressions.
+"""
+import re
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import resource
+import threading
+import warnings
+import numpy as np
+import pandas as pd
+import pytz
+from datetime import datetime,timedelta
+from urllib.parse import urlparse,parse_qs
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from finance_stock_scraper import workflow
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from finance_stock_scraper.QuestClient import QuestClient
+from finance_stock_scraper.Scheduler import Scheduler
+from finance_stock_scraper.TickerRepository import TickerRepository
+from finance_stock_scraper.YFDataProvider import YFDataProvider
+from finance_stock_scraper.model.Intervals import IntervalTypes
+from finance_stock_scraper.model.Ticker import Ticker
+
+FIELDS = ["Open","High","Low","Close","Adj Close","Volume"]
+
+class ReplayDataProvider(YFDataProvider):
+    """
+    Stand-in for the YFDataProvider that replays a recorded frame or synthesizes regular sessions (13:30-20:00 UTC on business days)
+    """
+    def __init__(self,recording:pd.DataFrame|None=None,history_days:int=365,latency:float=0,**kwargs) -> None:
+        super().__init__(**kwargs)
+        self.recording = recording
+        self.history_days = history_days
+        self.latency = latency
+        self.download_time = 0.0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _index(self,start:datetime,end:datetime,interval:str)->pd.DatetimeIndex:
+        days = pd.bdate_range(start.date(),end.date(),tz=pytz.UTC)
+        if workflow.get_interval(interval) == IntervalTypes.Daily:
+            index = days
+        else:
+            offsets = pd.timedelta_range(timedelta(0),timedelta(hours=6,minutes=30),freq=workflow.interval_to_timedelta(interval),closed="left")
+            index = pd.DatetimeIndex((days.asi8[:,None]+pd.Timedelta(hours=13,minutes=30).value+offsets.asi8[None,:]).ravel(),tz=pytz.UTC)
+        return index[(index >= start) & (index < end)]
+
+    def _synthesize(self,tickers:list[str],start:datetime,end:datetime,interval:str)->pd.DataFrame:
+        index = self._index(start,end,interval)
+        rng = np.random.default_rng(len(index))
+        columns = pd.MultiIndex.from_product([tickers,FIELDS])
+        values = rng.random((len(index),len(columns)))*100
+        values[:,len(FIELDS)-1::len(FIELDS)] = rng.integers(0,1_000_000,(len(index),len(tickers)))
+        return pd.DataFrame(values,index=index,columns=columns)
+
+    def _replay(self,tickers:list[str],start:datetime,end:datetime)->tuple[pd.DataFrame,dict]:
+        recorded = [ticker for ticker in tickers if ticker in self.recording.columns.get_level_values(0)]
+        index = pd.DatetimeIndex(self.recording.index)
+        index = index.tz_convert(pytz.UTC) if index.tz is not None else index.tz_localize(pytz.UTC)
+        data = self.recording.loc[(index >= start) & (index < end),recorded]
+        errors = {ticker:"No data found, symbol may be delisted" for ticker in tickers if ticker not in recorded}
+        return data,errors
+
+    def _download(self,tickers:list[str],**kwargs)->tuple[pd.DataFrame,dict]:
+        start_time = time.perf_counter()
+        time.sleep(self.latency)
+        end = workflow.make_datetime_tz_aware(kwargs.get("end",datetime.now(pytz.UTC)))
+        start = workflow.make_datetime_tz_aware(kwargs.get("start",end-timedelta(days=self.history_days)))
+        if self.recording is not None:
+            data,errors = self._replay(tickers,start,end)
+        else:
+            data,errors = self._synthesize(tickers,start,end,kwargs["interval"]),{}
+        with self._lock:
+            self.download_time += time.perf_counter()-start_time
+            self.requests += 1
+        return data,errors
+
+class IlpSink(object):
+    """
+    Local ILP endpoint that only counts the received rows and bytes
+    """
+    def __init__(self) -> None:
+        self.server = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1",0))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+        self.rows = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self._accept,daemon=True).start()
+
+    def _accept(self)->None:
+        while True:
+            try:
+                connection,_ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._read,args=(connection,),daemon=True).start()
+
+    def _read(self,connection:socket.socket)->None:
+        with connection:
+            while chunk := connection.recv(1024*1024):
+                with self.lock:
+                    self.rows += chunk.count(b"\n")
+                    self.bytes += len(chunk)
+
+    def wait_idle(self,idle:float=0.05,timeout:float=5)->None:
+        """
+        Waits until nothing was received for `idle` seconds (the last flush may still be in the socket)
+        """
+        deadline = time.monotonic()+timeout
+        received = -1
+        while received != self.bytes and time.monotonic() < deadline:
+            received = self.bytes
+            time.sleep(idle)
+
+    def close(self)->None:
+        self.server.close()
+
+class FakeExecServer(object):
+    """
+    Local /exec endpoint that answers the queries of the workflow. With `existing_days` > 0 every ticker already has data up to that many days ago.
+    """
+    def __init__(self,exchanges:dict[str,list[str]],existing_days:int,now:datetime) -> None:
+        self.exchanges = exchanges
+        self.last_entry = (now-timedelta(days=existing_days)).strftime("%Y-%m-%dT%H:%M:%S.%fZ") if existing_days > 0 else None
+        self.queries = 0
+        self.query_time = 0.0
+        self.server = ThreadingHTTPServer(("127.0.0.1",0),self._handler())
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever,daemon=True).start()
+
+    def answer(self,query:str)->dict:
+        if "LATEST ON" in query:
+            if self.last_entry is None:
+                return {"dataset":[]}
+            exchange = re.search(r"exchange = '([^']+)'",query)
+            exchanges = [exchange.group(1)] if exchange else list(self.exchanges)
+            return {"dataset":[[ticker,self.last_entry] for exchange in exchanges for ticker in self.exchanges.get(exchange,[])]}
+        if "max(timestamp)" in query:
+            return {"dataset":[[self.last_entry]]}
+        return {"ddl":"OK"}
+
+    def _handler(self):
+        fake = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                start = time.perf_counter()
+                query = parse_qs(urlparse(self.path).query).get("query",[""])[0]
+                body = json.dumps(fake.answer(query)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type","application/json")
+                self.send_header("Content-Length",str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                fake.queries += 1
+                fake.query_time += time.perf_counter()-start
+
+            def log_message(self,format,*args):
+                pass
+        return Handler
+
+    def close(self)->None:
+        self.server.shutdown()
+
+class BenchQuestClient(QuestClient):
+    """
+    QuestClient that measures the time spent handing points to the ingestion channel and waiting for the flushes
+    """
+    def __init__(self,*args,**kwargs) -> None:
+        super().__init__(*args,**kwargs)
+        self.flush_time = 0.0
+        self._lock = threading.Lock()
+
+    def submit_points(self,buffer,rows:int=0)->None:
+        start = time.perf_counter()
+        super().submit_points(buffer,rows)
+        with self._lock:
+            self.flush_time += time.perf_counter()-start
+
+    def flush_points(self)->int:
+        start = time.perf_counter()
+        try:
+            return super().flush_points()
+        finally:
+            with self._lock:
+                self.flush_time += time.perf_counter()-start
+
+class TimedWriteSlots(object):
+    """
+    Write slots of the ExecutionContext that measure how long they are held (transforming and submitting points)
+    """
+    def __init__(self,slots:threading.BoundedSemaphore) -> None:
+        self.slots = slots
+        self.held_time = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __enter__(self):
+        self.slots.acquire()
+        self._local.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc_info)->None:
+        with self._lock:
+            self.held_time += time.perf_counter()-self._local.start
+        self.slots.release()
+
+class BenchExecutionContext(ExecutionContext):
+    def __init__(self,*args,**kwargs) -> None:
+        super().__init__(*args,**kwargs)
+        self.write_slots = TimedWriteSlots(self.write_slots)
+
+def run(args:argparse.Namespace)->dict:
+    now = datetime.now(pytz.UTC)
+    exchanges = {exchange:[f"T{i}" for i in range(args.tickers)] for exchange in args.exchanges.split(",")}
+    recording = pd.read_pickle(args.recording) if args.recording else None
+    if recording is not None:
+        names = list(dict.fromkeys(recording.columns.get_level_values(0)))
+        exchanges = {exchange:names for exchange in exchanges}
+
+    sink = IlpSink()
+    exec_server = FakeExecServer(exchanges,args.existing_days,now)
+    questClient = BenchQuestClient("127.0.0.1",exec_server.port,sink.port)
+    repository = TickerRepository(questClient)
+    for exchange,names in exchanges.items():
+        for name in names:
+            repository.add_ticker(Ticker(name,exchange))
+    provider = ReplayDataProvider(recording,history_days=args.history_days,latency=args.latency)
+    executionContext = BenchExecutionContext(repository,provider,questClient)
+    scheduler = Scheduler(executionContext,args.workers,args.intervals.split(","))
+
+    start = time.perf_counter()
+    try:
+        results = scheduler.run(list(exchanges),now)
+    finally:
+        elapsed = time.perf_counter()-start
+        questClient.close()
+        sink.wait_idle()
+        exec_server.close()
+        sink.close()
+
+    return {
+        "failed_jobs":[f"{result.exchange}-{result.interval}: {result.error}" for result in results if not result.succeeded],
+        "rows":sink.rows,
+        "bytes":sink.bytes,
+        "elapsed":elapsed,
+        "rows_per_sec":sink.rows/elapsed if elapsed > 0 else 0,
+        "peak_rss_mb":resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,
+        "download":provider.download_time,
+        "download_requests":provider.requests,
+        #submitting blocks while the ingestion channel is busy => it is counted as flush time
+        "transform":max(0.0,executionContext.write_slots.held_time-questClient.flush_time),
+        "flush":questClient.flush_time,
+        "queries":exec_server.queries,
+        "query_time":exec_server.query_time,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of a Scheduler run")
+    parser.add_argument("--tickers",type=int,default=200,help="Tickers per exchange (ignored with a recording)")
+    parser.add_argument("--exchanges",default="NASDAQ")
+    parser.add_argument("--intervals",default="5m,1d")
+    parser.add_argument("--workers",type=int,default=4,help="(exchange, interval) jobs running at the same time")
+    parser.add_argument("--existing-days",type=int,default=0,help="Days since the last entry of every ticker, 0 => empty database")
+    parser.add_argument("--history-days",type=int,default=365,help="Days returned for period downloads of new tickers")
+    parser.add_argument("--latency",type=float,default=0,help="Simulated seconds per Yahoo request")
+    parser.add_argument("--recording",default=None,help="Pickled yfinance frame to replay instead of synthetic data")
+    parser.add_argument("--min-rows-per-sec",type=float,default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    warnings.filterwarnings("ignore",category=FutureWarning)
+    result = run(args)
+    print(f"rows:          {result['rows']:,} ({result['bytes']/1024/1024:.1f} MB ILP)")
+    print(f"elapsed:       {result['elapsed']:.2f}s => {result['rows_per_sec']:,.0f} rows/sec")
+    print(f"peak rss:      {result['peak_rss_mb']:.0f} MB")
+    print(f"download:      {result['download']:.2f}s in {result['download_requests']} requests")
+    print(f"transform:     {result['transform']:.2f}s")
+    print(f"flush:         {result['flush']:.2f}s")
+    print(f"queries:       {result['queries']} in {result['query_time']:.2f}s")
+    for job in result["failed_jobs"]:
+        print(f"FAILED job {job}")
+    if len(result["failed_jobs"]) > 0:
+        sys.exit(1)
+    if result["rows_per_sec"] < args.min_rows_per_sec:
+        print(f"FAILED: {result['rows_per_sec']:,.0f} rows/sec is below {args.min_rows_per_sec:,.0f}")
+        sys.exit(1)
@@ -0,0 +1,62 @@
+"""
+Compares the peak memory of reading many tickers as a dict of frames + pd.concat with the panel mode of the TickerRepository.
+Usage: python benchmarks/bench_panel.py [tickers] [rows per ticker]
+"""
+import io
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from finance_stock_scraper.QuestClient import QuestClient
+from finance_stock_scraper.TickerRepository import TickerRepository
+from finance_stock_scraper.model.Ticker import Ticker
+
+VALUES = ["open","high","low","close","volume"]
+
+class ReplayResponse(object):
+    def __init__(self,body:bytes) -> None:
+        self.status_code = 200
+        self.raw = io.BytesIO(body)
+
+    def close(self)->None:
+        pass
+
+class ReplayQuestClient(QuestClient):
+    def __init__(self,csv_body:bytes) -> None:
+        super().__init__("localhost")
+        self.csv_body = csv_body
+
+    def raw_export(self,query:str):
+        return ReplayResponse(self.csv_body)
+
+def build_body(tickers:list[str],rows:int)->bytes:
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range("2015-01-01",periods=rows,freq="min")
+    df = pd.DataFrame({
+        "ticker":np.repeat(tickers,rows),
+        "timestamp":np.tile(timestamps.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),len(tickers)),
+        **{value:np.round(rng.random(rows*len(tickers))*100,4) for value in VALUES[:-1]},
+        "volume":rng.integers(0,1_000_000,rows*len(tickers)),
+    })
+    return df.to_csv(index=False).encode()
+
+def measure(name:str,function)->None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter()-start
+    _,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>12}: {elapsed:.2f}s, peak {peak/1024/1024:,.0f} MB, result {result.memory_usage(deep=True).sum()/1024/1024:,.0f} MB")
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    symbols = [f"T{i}" for i in range(count)]
+    tickers = [Ticker(symbol,"NASDAQ") for symbol in symbols]
+    repo = TickerRepository(ReplayQuestClient(build_body(symbols,rows)),read_mode="CSV")
+
+    measure("dict+concat",lambda:pd.concat(repo.get_values(tickers,"1m",values=VALUES),axis=1))
+    measure("panel wide",lambda:repo.get_panel(tickers,"1m",values=VALUES))
+    measure("panel long",lambda:repo.get_panel(tickers,"1m",values=VALUES,layout="long"))
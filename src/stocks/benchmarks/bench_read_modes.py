@@ -0,0 +1,61 @@
+"""
+Compares decoding a large result via the json (/exec) and the csv (/exp) read mode of the TickerRepository.
+Usage: python benchmarks/bench_read_modes.py [rows]
+"""
+import io
+import sys
+import json
+import time
+import numpy as np
+import pandas as pd
+from finance_stock_scraper.QuestClient import QuestClient
+from finance_stock_scraper.TickerRepository import TickerRepository
+from finance_stock_scraper.model.Ticker import Ticker
+
+VALUES = ["open","high","low","close","volume"]
+
+class ReplayResponse(object):
+    def __init__(self,body:bytes) -> None:
+        self.body = body
+        self.status_code = 200
+        self.raw = io.BytesIO(body)
+
+    def close(self)->None:
+        pass
+
+    def json(self)->dict:
+        return json.loads(self.body)
+
+class ReplayQuestClient(QuestClient):
+    def __init__(self,json_body:bytes,csv_body:bytes) -> None:
+        super().__init__("localhost")
+        self.json_body = json_body
+        self.csv_body = csv_body
+
+    def raw_query(self,query:str):
+        return ReplayResponse(self.json_body)
+
+    def raw_export(self,query:str):
+        return ReplayResponse(self.csv_body)
+
+def build_bodies(rows:int)->tuple[bytes,bytes]:
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range("2015-01-01",periods=rows,freq="min").strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    prices = np.round(rng.random((rows,4))*100,4)
+    volumes = rng.integers(0,1_000_000,rows)
+    dataset = [[timestamp,*price,int(volume)] for timestamp,price,volume in zip(timestamps,prices.tolist(),volumes)]
+    json_body = json.dumps({"dataset":dataset}).encode()
+    df = pd.DataFrame(dataset,columns=["timestamp"]+VALUES)
+    csv_body = df.to_csv(index=False).encode()
+    return json_body,csv_body
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    questClient = ReplayQuestClient(*build_bodies(rows))
+    ticker = Ticker("GOOGL","NASDAQ")
+    for mode in ["JSON","CSV"]:
+        repo = TickerRepository(questClient,read_mode=mode)
+        start = time.perf_counter()
+        df = repo.get_values(ticker,"1m",values=VALUES)
+        elapsed = time.perf_counter()-start
+        print(f"{mode:>4}: {len(df)} rows in {elapsed:.2f}s => {len(df)/elapsed:,.0f} rows/sec")
@@ -0,0 +1,66 @@
+"""
+Measures the import time of the public modules in a fresh interpreter and checks them against a budget.
+Heavy dependencies (yfinance, pandas_market_calendars, questdb, torch, transformers) have to stay unloaded until first use.
+Usage: python benchmarks/bench_startup.py [--repeat 5] [--scale 1.0]
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+HEAVY_MODULES = ["yfinance","pandas_market_calendars","questdb.ingress","torch","transformers","newspaper"]
+# module => budget in seconds, pandas alone takes ~0.3s on a laptop
+BUDGETS = {
+    "finance_stock_scraper.model.Ticker":0.1,
+    "finance_stock_scraper.TickerRepository":1.0,
+    "finance_stock_scraper.QuestClient":1.0,
+    "finance_stock_scraper.YFDataProvider":1.0,
+    "finance_stock_scraper.workflow":1.5,
+    "finance_stock_scraper.__main__":1.5,
+    "finance_news_scraper.sentiment":0.5,
+    "finance_news_scraper.mongo_client":1.5,
+    "finance_news_scraper.__main__":2.0,
+}
+
+PROBE = """
+import sys,time,json
+start = time.perf_counter()
+try:
+    __import__(sys.argv[1])
+except ImportError as e:
+    print(json.dumps({"error":str(e)}))
+    sys.exit(0)
+elapsed = time.perf_counter()-start
+print(json.dumps({"elapsed":elapsed,"heavy":[name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+def measure(module:str,repeat:int)->dict:
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable,"-c",PROBE,module]+HEAVY_MODULES,capture_output=True,text=True,check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if "error" in result:
+            return result
+        if best is None or result["elapsed"] < best["elapsed"]:
+            best = result
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time of the public modules")
+    parser.add_argument("--repeat",type=int,default=5,help="Fresh interpreters per module, the fastest run counts")
+    parser.add_argument("--scale",type=float,default=1.0,help="Multiplier for the budgets on slow machines")
+    args = parser.parse_args()
+
+    failed = False
+    for module,budget in BUDGETS.items():
+        result = measure(module,args.repeat)
+        if "error" in result:
+            print(f"{module:<45} skipped ({result['error']})")
+            continue
+        over_budget = result["elapsed"] > budget*args.scale
+        status = "FAILED" if over_budget or result["heavy"] else "ok"
+        heavy = f" loaded {','.join(result['heavy'])}" if result["heavy"] else ""
+        print(f"{module:<45} {result['elapsed']*1000:7.0f} ms (budget {budget*args.scale*1000:.0f} ms) {status}{heavy}")
+        failed = failed or status == "FAILED"
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,44 @@
+"""
+Compares the rows/sec of the row based and the columnar ingestion in `workflow.store_points`.
+Usage: python benchmarks/bench_store_points.py [tickers] [periods]
+"""
+import sys
+import time
+import logging
+import numpy as np
+import pandas as pd
+from finance_stock_scraper import workflow
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from finance_stock_scraper.model.Ticker import Ticker
+
+class NullQuestClient(object):
+    def __init__(self) -> None:
+        self.bytes = 0
+
+    def submit_points(self,buffer,rows:int=0)->None:
+        self.bytes += len(buffer)
+
+def build_frame(tickers:list[str],periods:int)->pd.DataFrame:
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2022-08-01 09:30",periods=periods,freq="5min",tz="America/New_York")
+    columns = pd.MultiIndex.from_product([tickers,["Open","High","Low","Close","Adj Close","Volume"]])
+    return pd.DataFrame(rng.random((periods,len(columns)))*100,index=index,columns=columns)
+
+def run(mode:str,data:pd.DataFrame,tickers:list[Ticker])->tuple[float,int]:
+    questClient = NullQuestClient()
+    workflow.INGESTION_MODE = mode
+    start = time.perf_counter()
+    workflow.store_points(data,tickers,"Benchmark",ExecutionContext(None,None,questClient),"5m","NASDAQ")
+    return time.perf_counter()-start,questClient.bytes
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    ticker_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    periods = int(sys.argv[2]) if len(sys.argv) > 2 else 78*6
+    names = [f"T{i}" for i in range(ticker_count)]
+    tickers = [Ticker(name,"NASDAQ") for name in names]
+    data = build_frame(names,periods)
+    rows = ticker_count*periods
+    for mode in ["ROW","COLUMNAR"]:
+        elapsed,size = run(mode,data,tickers)
+        print(f"{mode:>8}: {rows} rows in {elapsed:.2f}s => {rows/elapsed:,.0f} rows/sec ({size} bytes)")
@@ -0,0 +1,32 @@
+import pytz
+import pandas as pd
+from datetime import datetime
+from typing import Iterator
+from finance_stock_scraper.workflow import interval_to_timedelta
+
+class CompleteBarsDataProvider(object):
+    """
+    Wraps a data provider and drops the bars that are still in progress (bar start + interval after the end of the request).
+    Otherwise a partial bar would become the last entry and its final values would never be stored.
+    """
+    def __init__(self,provider) -> None:
+        self.provider = provider
+
+    def _complete(self,batches:Iterator[tuple[pd.DataFrame,dict]],interval:str,end:datetime)->Iterator[tuple[pd.DataFrame,dict]]:
+        delta = pd.Timedelta(interval_to_timedelta(interval))
+        end = pd.Timestamp(end)
+        for data,errors in batches:
+            if data is not None and len(data) > 0:
+                index = data.index if data.index.tz is not None else data.index.tz_localize(pytz.UTC)
+                limit = end if end.tzinfo is not None else end.tz_localize(pytz.UTC)
+                data = data[index+delta <= limit]
+            yield data,errors
+
+    def get_data(self,tickers:list[str],start_date:datetime,end_date:datetime,interval:str)->Iterator[tuple[pd.DataFrame,dict]]:
+        return self._complete(self.provider.get_data(tickers,start_date,end_date,interval),interval,end_date)
+
+    def get_data_from_period(self,tickers:list[str],interval:str,period:str="max")->Iterator[tuple[pd.DataFrame,dict]]:
+        return self._complete(self.provider.get_data_from_period(tickers,interval,period),interval,datetime.now(pytz.UTC))
+
+    def __getattr__(self,name:str):
+        return getattr(self.provider,name)
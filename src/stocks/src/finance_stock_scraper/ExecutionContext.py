@@ -1,9 +1,18 @@
+import os
+import threading
 from finance_stock_scraper.TickerRepository import TickerRepository
 from finance_stock_scraper.YFDataProvider import YFDataProvider
 from finance_stock_scraper.QuestClient import QuestClient
+from finance_stock_scraper.WatermarkStore import WatermarkStore
+from finance_stock_scraper.FailureRegistry import FailureRegistry
+
+MAX_CONCURRENT_WRITES = int(os.getenv('STOCKSCRAPER_MAX_CONCURRENT_WRITES',2)) # Jobs that transform and write points at the same time
 
 class ExecutionContext(object):
-    def __init__(self,tickerRepository:TickerRepository,yfDataProcider:YFDataProvider,questClient:QuestClient) -> None:
+    def __init__(self,tickerRepository:TickerRepository,yfDataProcider:YFDataProvider,questClient:QuestClient,max_concurrent_writes:int=MAX_CONCURRENT_WRITES,watermarkStore:WatermarkStore|None=None,failureRegistry:FailureRegistry|None=None) -> None:
         self.tickerRepository = tickerRepository
         self.yfDataProcider = yfDataProcider
-        self.questClient = questClient
\ No newline at end of file
+        self.questClient = questClient
+        self.write_slots = threading.BoundedSemaphore(max_concurrent_writes)
+        self.watermarkStore = watermarkStore
+        self.failureRegistry = failureRegistry
\ No newline at end of file
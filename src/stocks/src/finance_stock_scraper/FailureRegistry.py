@@ -0,0 +1,145 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+from typing import Iterable
+from finance_stock_scraper.model.Ticker import Ticker
+from finance_stock_scraper.Metrics import TICKERS_SKIPPED
+
+FAILURE_DB = os.getenv('STOCKSCRAPER_FAILURE_DB',None) # SQLite file of the failure registry (defaults to the data directory)
+FAILURE_MAX_BACKOFF = float(os.getenv('STOCKSCRAPER_FAILURE_MAX_BACKOFF',30*24*60*60)) # Seconds, failing tickers are re-probed at least this often
+RATE_LIMIT_MAX_PAUSE = float(os.getenv('STOCKSCRAPER_RATE_LIMIT_MAX_PAUSE',60*60)) # Seconds, longest pause of all downloads while Yahoo Finance rate limits the scraper
+
+DELISTED = "delisted"
+NO_DATA = "no_data"
+RATE_LIMITED = "rate_limited"
+OTHER = "other"
+#first backoff of each kind in seconds, doubled for every further failure (rate limits pause all downloads instead)
+BACKOFF_BASE = {
+    DELISTED:24*60*60,
+    NO_DATA:60*60,
+    RATE_LIMITED:5*60,
+    OTHER:60*60,
+}
+
+def classify(error:str)->str:
+    """
+    Kind of a yfinance error message
+    """
+    error = str(error).lower()
+    if "delisted" in error or "no timezone found" in error:
+        return DELISTED
+    if "too many requests" in error or "rate limit" in error or "error 429" in error:
+        return RATE_LIMITED
+    if "no data found" in error or "no price data found" in error:
+        return NO_DATA
+    return OTHER
+
+class FailureRegistry(object):
+    """
+    Persistent registry of failing tickers. Every failure pushes the next attempt of a ticker back exponentially (per error kind),
+    a ticker whose backoff expired is probed again and removed from the registry once a download succeeds.
+    Rate limits aren't caused by the tickers => they pause all downloads (doubled for every rate limited batch until a download succeeds).
+    """
+    def __init__(self,path:str=FAILURE_DB,max_backoff:float=FAILURE_MAX_BACKOFF,max_pause:float=RATE_LIMIT_MAX_PAUSE) -> None:
+        self.path = path
+        self.max_backoff = max_backoff
+        self.max_pause = max_pause
+        self._rate_limits = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self._connection = sqlite3.connect(path,check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS failures (ticker TEXT PRIMARY KEY, kind TEXT, failures INTEGER, retry_at REAL, error TEXT, skipped INTEGER)")
+        #the registry is consulted for every download => keep the blocked tickers in memory
+        self._retry_at:dict[str,tuple[float,str]] = {ticker:(retry_at,kind) for ticker,retry_at,kind in self._connection.execute("SELECT ticker, retry_at, kind FROM failures")}
+
+    def backoff(self,kind:str,failures:int)->float:
+        return min(self.max_backoff,BACKOFF_BASE.get(kind,BACKOFF_BASE[OTHER])*2**(failures-1))
+
+    def record_failures(self,errors:dict[str,str],now:float|None=None)->None:
+        now = now if now is not None else time.time()
+        with self._lock, self._connection:
+            if any(classify(error) == RATE_LIMITED for error in errors.values()):
+                self._rate_limits += 1
+                pause = min(self.max_pause,BACKOFF_BASE[RATE_LIMITED]*2**(self._rate_limits-1))
+                self._paused_until = max(self._paused_until,now+pause)
+                logging.warning(f"Rate limited by Yahoo Finance, pausing all downloads for {pause:.0f}s")
+            for ticker,error in errors.items():
+                ticker = ticker.upper()
+                kind = classify(error)
+                if kind == RATE_LIMITED:
+                    continue
+                row = self._connection.execute("SELECT failures FROM failures WHERE ticker = ?",(ticker,)).fetchone()
+                failures = row[0]+1 if row is not None else 1
+                retry_at = now+self.backoff(kind,failures)
+                self._connection.execute("INSERT INTO failures VALUES (?, ?, ?, ?, ?, 0) ON CONFLICT(ticker) DO UPDATE SET kind = excluded.kind, failures = excluded.failures, retry_at = excluded.retry_at, error = excluded.error",
+                                         (ticker,kind,failures,retry_at,str(error)))
+                self._retry_at[ticker] = (retry_at,kind)
+                logging.debug(f"{ticker} failed {failures} times ({kind}), next attempt in {retry_at-now:.0f}s")
+
+    def record_successes(self,tickers:Iterable[str])->None:
+        tickers = list(tickers)
+        with self._lock:
+            if len(tickers) > 0:
+                self._rate_limits = 0
+            recovered = [ticker for ticker in tickers if ticker in self._retry_at]
+            if len(recovered) == 0:
+                return
+            with self._connection:
+                self._connection.executemany("DELETE FROM failures WHERE ticker = ?",[(ticker,) for ticker in recovered])
+            for ticker in recovered:
+                del self._retry_at[ticker]
+        logging.info(f"{','.join(recovered)} recovered and will be downloaded again")
+
+    def paused_for(self,now:float|None=None)->float:
+        """
+        Seconds until downloads may continue after a rate limit
+        """
+        return max(0.0,self._paused_until-(now if now is not None else time.time()))
+
+    def wait_for_rate_limit(self)->None:
+        pause = self.paused_for()
+        if pause > 0:
+            logging.info(f"Waiting {pause:.0f}s for the Yahoo Finance rate limit")
+            time.sleep(pause)
+
+    def is_blocked(self,ticker:str,now:float|None=None)->bool:
+        entry = self._retry_at.get(ticker)
+        return entry is not None and entry[0] > (now if now is not None else time.time())
+
+    def filter(self,tickers:list[Ticker],now:float|None=None)->list[Ticker]:
+        """
+        Tickers that may be downloaded, the skipped ones are counted for the report
+        """
+        now = now if now is not None else time.time()
+        allowed = []
+        skipped:dict[str,list[str]] = {}
+        for ticker in tickers:
+            entry = self._retry_at.get(ticker.ticker)
+            if entry is not None and entry[0] > now:
+                skipped.setdefault(entry[1],[]).append(ticker.ticker)
+            else:
+                allowed.append(ticker)
+        if len(skipped) > 0:
+            with self._lock, self._connection:
+                self._connection.executemany("UPDATE failures SET skipped = skipped + 1 WHERE ticker = ?",[(ticker,) for names in skipped.values() for ticker in names])
+            for kind,names in skipped.items():
+                TICKERS_SKIPPED.inc(len(names),reason=kind)
+            logging.info(f"Skipping {sum(len(names) for names in skipped.values())} failing tickers ({', '.join(f'{kind}: {len(names)}' for kind,names in skipped.items())})")
+        return allowed
+
+    def report(self)->dict[str,dict[str,int]]:
+        """
+        Failing tickers and skipped downloads per error kind
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT kind, count(*), sum(skipped) FROM failures GROUP BY kind").fetchall()
+        return {kind:{"tickers":count,"skipped":int(skipped or 0)} for kind,count,skipped in rows}
+
+    def close(self)->None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,276 @@
+import os
+import time
+import queue
+import logging
+import socket
+import threading
+from typing import TYPE_CHECKING
+from finance_stock_scraper.IngestionSpool import IngestionSpool
+from finance_stock_scraper.Metrics import ILP_BYTES, ILP_FLUSH_SECONDS, ILP_SPOOLED_BYTES, ILP_SPOOL_PENDING
+from finance_stock_scraper.lazy import LazyModule
+
+if TYPE_CHECKING:
+    from questdb.ingress import Sender, Buffer
+
+ingress = LazyModule("questdb.ingress")
+
+MAX_ROWS = int(os.getenv('STOCKSCRAPER_ILP_MAX_ROWS',75_000)) # Rows collected before a flush is triggered
+MAX_BYTES = int(os.getenv('STOCKSCRAPER_ILP_MAX_BYTES',8*1024*1024)) # Bytes collected before a flush is triggered
+FLUSH_INTERVAL = float(os.getenv('STOCKSCRAPER_ILP_FLUSH_INTERVAL',1.0)) # Seconds after which collected rows are flushed anyway
+MAX_PENDING = int(os.getenv('STOCKSCRAPER_ILP_MAX_PENDING',4)) # Batches waiting for the socket before submit blocks (caps memory)
+RETRIES = int(os.getenv('STOCKSCRAPER_ILP_RETRIES',3))
+RETRY_BACKOFF = float(os.getenv('STOCKSCRAPER_ILP_RETRY_BACKOFF',0.5))
+SPOOL_RETRY_INTERVAL = float(os.getenv('STOCKSCRAPER_ILP_SPOOL_RETRY_INTERVAL',30)) # Seconds between replays of the spool while QuestDB is unreachable
+
+_STOP = object()
+_REPLAY = object()
+
+class IngestionChannel(object):
+    """
+    Long-lived ILP connection to QuestDB. Submitted buffers are collected until a row, byte or time threshold is reached
+    and are then written to the socket by a background thread. The connection is (re)opened on demand.
+    With a spool, batches that can't be written (or don't fit into the queue) are spilled to disk instead and replayed in order
+    once the writer is idle. Every queued batch is older than the spooled ones: while the spool isn't empty new batches are spilled as well.
+    Buffers can be tagged with a job, a flush of the job only raises the errors of its own buffers.
+    """
+    def __init__(self,host:str,port:int,max_rows:int=MAX_ROWS,max_bytes:int=MAX_BYTES,flush_interval:float=FLUSH_INTERVAL,
+                 max_pending:int=MAX_PENDING,retries:int=RETRIES,retry_backoff:float=RETRY_BACKOFF,spool:IngestionSpool|None=None,
+                 spool_retry_interval:float=SPOOL_RETRY_INTERVAL) -> None:
+        self.host = host
+        self.port = port
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.spool = spool
+        self.spool_retry_interval = spool_retry_interval
+        self.stats = {"rows":0,"bytes":0,"flushes":0,"connections":0,"spooled":0,"replayed":0}
+
+        self._sender:"Sender|None" = None
+        self._lock = threading.Lock()
+        self._writing = threading.Lock()
+        self._pending:list[tuple["Buffer",int,object]] = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._pending_since = 0.0
+        self._errors:dict[object,list[Exception]] = {}
+        self._next_replay = 0.0
+        self._stopping = False
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run,name="ilp-writer",daemon=True)
+        self._thread.start()
+
+    @property
+    def closed(self)->bool:
+        return not self._thread.is_alive()
+
+    def submit(self,buffer:"Buffer",rows:int=0,job:object=None)->None:
+        """
+        Hands the buffer over to the channel. The buffer must not be used by the caller afterwards.
+        Only blocks if the writer is more than `max_pending` batches behind.
+        """
+        if len(buffer) == 0:
+            return
+        if self.closed:
+            raise Exception("The ingestion channel is closed!")
+
+        batch = None
+        with self._lock:
+            if len(self._pending) == 0:
+                self._pending_since = time.monotonic()
+            self._pending.append((buffer,rows,job))
+            self._pending_rows += rows
+            self._pending_bytes += len(buffer)
+            if self._pending_rows >= self.max_rows or self._pending_bytes >= self.max_bytes:
+                batch = self._take_pending()
+        if batch:
+            self._enqueue(batch)
+
+    def flush(self,job:object=None)->None:
+        """
+        Blocks until all submitted buffers are written or spooled and tries to replay the spool.
+        Raises the first error of the job's buffers (of all buffers without a job) that occurred since its last flush.
+        """
+        with self._lock:
+            batch = self._take_pending()
+        if batch:
+            self._enqueue(batch)
+        if self.spool is not None:
+            self._queue.put(_REPLAY)
+        self._queue.join()
+        #wait for a running time based flush
+        with self._writing:
+            pass
+
+        with self._lock:
+            if job is None:
+                errors = [error for job_errors in self._errors.values() for error in job_errors]
+                self._errors = {}
+            else:
+                errors = self._errors.pop(job,[])
+        if len(errors) > 0:
+            raise errors[0]
+
+    def discard_errors(self,job:object)->None:
+        """
+        Drops the errors of a job that ends without a flush
+        """
+        with self._lock:
+            self._errors.pop(job,None)
+
+    def close(self)->None:
+        """
+        Flushes all submitted buffers, stops the background thread and closes the connection.
+        """
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _enqueue(self,batch:list[tuple["Buffer",int,object]])->None:
+        if self.spool is not None:
+            with self._lock:
+                if self.spool.empty:
+                    try:
+                        self._queue.put_nowait(batch)
+                        return
+                    except queue.Full:
+                        logging.debug("The ILP writer is behind, spilling the batch to the spool")
+                self._spill(batch)
+                return
+        self._queue.put(batch)
+
+    def _spill(self,batch:list[tuple["Buffer",int,object]])->None:
+        """
+        Appends the buffers to the spool, buffers that don't fit anymore are reported as errors
+        """
+        for buffer,rows,job in batch:
+            try:
+                payload = str(buffer).encode()
+                self.spool.append(payload)
+                self.stats["spooled"] += len(payload)
+                ILP_SPOOLED_BYTES.inc(len(payload))
+            except Exception as e:
+                logging.error(f"Could not spool {len(buffer)} bytes: {e}")
+                self._errors.setdefault(job,[]).append(e)
+        ILP_SPOOL_PENDING.set(self.spool.pending)
+
+    def _take_pending(self)->list[tuple["Buffer",int,object]]:
+        batch = self._pending
+        self._pending = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        return batch
+
+    def _run(self)->None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                #time based auto flush
+                with self._writing:
+                    with self._lock:
+                        batch = self._take_pending() if len(self._pending) > 0 and time.monotonic()-self._pending_since >= self.flush_interval else None
+                        if batch and self.spool is not None and not self.spool.empty:
+                            self._spill(batch)
+                            batch = None
+                    if batch:
+                        self._write(batch)
+                    if self.spool is not None and time.monotonic() >= self._next_replay:
+                        self._replay()
+                continue
+
+            try:
+                if item is _STOP:
+                    self._disconnect()
+                    return
+                with self._writing:
+                    if item is _REPLAY:
+                        self._replay()
+                    else:
+                        self._write(item)
+            finally:
+                self._queue.task_done()
+            if self._stopping:
+                self._disconnect()
+                return
+
+    def _write(self,batch:list[tuple["Buffer",int,object]])->None:
+        start = time.perf_counter()
+        for i,(buffer,rows,job) in enumerate(batch):
+            size = len(buffer)
+            try:
+                self._send(buffer)
+                self.stats["rows"] += rows
+                self.stats["bytes"] += size
+                ILP_BYTES.inc(size)
+            except Exception as e:
+                if self.spool is None:
+                    logging.error(f"Could not write {size} bytes to QuestDB: {e}")
+                    with self._lock:
+                        self._errors.setdefault(job,[]).append(e)
+                    continue
+                logging.warning(f"Could not write {size} bytes to QuestDB ({e}), spooling the queued batches")
+                with self._lock:
+                    #the queued batches are newer => they follow the failed one into the spool
+                    self._spill(batch[i:])
+                    while True:
+                        try:
+                            item = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if item is _STOP:
+                            self._stopping = True
+                        elif item is not _REPLAY:
+                            self._spill(item)
+                        self._queue.task_done()
+                self._next_replay = time.monotonic()+self.spool_retry_interval
+                break
+        self.stats["flushes"] += 1
+        ILP_FLUSH_SECONDS.observe(time.perf_counter()-start)
+
+    def _replay(self)->None:
+        """
+        Sends the spooled records over a plain socket (ILP is line based, the Sender only writes its own buffers)
+        """
+        if self.spool.empty:
+            return
+        try:
+            with socket.create_connection((self.host,self.port),timeout=max(1.0,self.retry_backoff)) as connection:
+                replayed = self.spool.replay(connection.sendall)
+            self.stats["replayed"] += replayed
+            ILP_BYTES.inc(replayed)
+            logging.info(f"Replayed {replayed} spooled bytes to QuestDB")
+        except Exception as e:
+            self._next_replay = time.monotonic()+self.spool_retry_interval
+            logging.warning(f"Could not replay the spool to QuestDB ({e}), {self.spool.pending} bytes are waiting")
+        ILP_SPOOL_PENDING.set(self.spool.pending)
+
+    def _send(self,buffer:"Buffer")->None:
+        for attempt in range(self.retries+1):
+            try:
+                if self._sender is None:
+                    sender = ingress.Sender(self.host,self.port)
+                    sender.connect()
+                    self._sender = sender
+                    self.stats["connections"] += 1
+                self._sender.flush(buffer,clear=False)
+                return
+            except Exception as e:
+                self._disconnect()
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Lost connection to QuestDB ({e}), reconnecting ...")
+                time.sleep(self.retry_backoff*2**attempt)
+
+    def _disconnect(self)->None:
+        if self._sender is not None:
+            try:
+                self._sender.close()
+            except Exception:
+                pass
+            self._sender = None
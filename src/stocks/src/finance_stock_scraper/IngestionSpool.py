@@ -0,0 +1,166 @@
+import os
+import mmap
+import struct
+import logging
+import threading
+from typing import Callable
+
+SPOOL_DIR = os.getenv('STOCKSCRAPER_ILP_SPOOL_DIR',None) # Directory of the ILP spool (defaults to the data directory)
+SPOOL_MAX_BYTES = int(os.getenv('STOCKSCRAPER_ILP_SPOOL_MAX_BYTES',2*1024*1024*1024)) # Disk usage of the spool, points that don't fit anymore are reported as failed
+SPOOL_SEGMENT_BYTES = int(os.getenv('STOCKSCRAPER_ILP_SPOOL_SEGMENT_BYTES',64*1024*1024)) # Size of a segment file, replayed segments are deleted
+
+#every record is the length of the ILP payload followed by the payload
+_HEADER = struct.Struct("<I")
+_SUFFIX = ".spool"
+_POSITION = "replay.position"
+
+class IngestionSpool(object):
+    """
+    Append-only spool of ILP payloads on disk, split into segment files. Records are replayed in the order they were appended,
+    the replay position is persisted after every record and fully replayed segments are deleted.
+    Only the newest segment is appended to, it becomes immutable once the replay reaches it.
+    """
+    def __init__(self,directory:str,max_bytes:int=SPOOL_MAX_BYTES,segment_bytes:int=SPOOL_SEGMENT_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._replaying = threading.Lock()
+        self._active = None
+        os.makedirs(directory,exist_ok=True)
+        self._segments = sorted(int(name[:-len(_SUFFIX)]) for name in os.listdir(directory) if name.endswith(_SUFFIX))
+        self._sizes = {segment:self._recover(segment) for segment in self._segments}
+        self.size = sum(self._sizes.values())
+        position = self._read_position()
+        #segment numbers keep increasing => a persisted position never points into a newer segment
+        self._next_segment = max([segment+1 for segment in self._segments]+[position[0]+1])
+        self._position = position if position[0] in self._sizes else (-1,0)
+        if self.pending > 0:
+            logging.info(f"Found {self.pending} spooled ILP bytes in {directory}, they are replayed once QuestDB is reachable")
+
+    def _path(self,segment:int)->str:
+        return os.path.join(self.directory,f"{segment:012d}{_SUFFIX}")
+
+    def _recover(self,segment:int)->int:
+        """
+        Size of the complete records of the segment, a record that was torn by a crash is cut off
+        """
+        path = self._path(segment)
+        size = os.path.getsize(path)
+        offset = 0
+        with open(path,"rb") as file:
+            while offset+_HEADER.size <= size:
+                file.seek(offset)
+                length, = _HEADER.unpack(file.read(_HEADER.size))
+                if offset+_HEADER.size+length > size:
+                    break
+                offset += _HEADER.size+length
+        if offset < size:
+            logging.warning(f"Cutting off {size-offset} bytes of an incomplete record in {path}")
+            os.truncate(path,offset)
+        return offset
+
+    def _read_position(self)->tuple[int,int]:
+        try:
+            with open(os.path.join(self.directory,_POSITION),"r") as file:
+                segment,offset = [int(value) for value in file.read().split()]
+        except (OSError,ValueError):
+            return (-1,0)
+        return (segment,offset)
+
+    def _write_position(self,segment:int,offset:int)->None:
+        path = os.path.join(self.directory,_POSITION)
+        with open(path+".tmp","w") as file:
+            file.write(f"{segment} {offset}")
+        os.replace(path+".tmp",path)
+
+    def _reset_position(self)->None:
+        self._position = (-1,0)
+        try:
+            os.remove(os.path.join(self.directory,_POSITION))
+        except FileNotFoundError:
+            pass
+
+    def _head_offset(self)->int:
+        return self._position[1] if len(self._segments) > 0 and self._position[0] == self._segments[0] else 0
+
+    @property
+    def pending(self)->int:
+        """
+        Spooled bytes that were not replayed yet
+        """
+        with self._lock:
+            return self.size-self._head_offset()
+
+    @property
+    def empty(self)->bool:
+        return self.pending == 0
+
+    def append(self,payload:bytes)->None:
+        """
+        Appends the payload as one record, raises if the spool is full
+        """
+        record = _HEADER.size+len(payload)
+        with self._lock:
+            if self.size+record > self.max_bytes:
+                raise Exception(f"The ILP spool is full ({self.size} of {self.max_bytes} bytes used)!")
+            if self._active is None or (self._sizes[self._segments[-1]] > 0 and self._sizes[self._segments[-1]]+record > self.segment_bytes):
+                self._roll()
+            self._active.write(_HEADER.pack(len(payload)))
+            self._active.write(payload)
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._sizes[self._segments[-1]] += record
+            self.size += record
+
+    def _roll(self)->None:
+        self._close_active()
+        segment = self._next_segment
+        self._next_segment += 1
+        self._active = open(self._path(segment),"ab")
+        self._segments.append(segment)
+        self._sizes[segment] = 0
+
+    def _close_active(self)->None:
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+
+    def replay(self,send:Callable[[bytes],None])->int:
+        """
+        Passes the spooled records in order to `send`. Stops at the first exception (which is raised), the records sent before are not replayed again.
+        Returns the replayed payload bytes.
+        """
+        replayed = 0
+        with self._replaying:
+            while True:
+                with self._lock:
+                    if len(self._segments) == 0:
+                        return replayed
+                    segment = self._segments[0]
+                    if self._active is not None and self._segments[-1] == segment:
+                        #later records go to a new segment
+                        self._close_active()
+                    offset = self._head_offset()
+                    size = self._sizes[segment]
+                if offset < size:
+                    with open(self._path(segment),"rb") as file, mmap.mmap(file.fileno(),size,access=mmap.ACCESS_READ) as view:
+                        while offset < size:
+                            length, = _HEADER.unpack_from(view,offset)
+                            start = offset+_HEADER.size
+                            send(view[start:start+length])
+                            offset = start+length
+                            replayed += length
+                            with self._lock:
+                                self._position = (segment,offset)
+                            self._write_position(segment,offset)
+                with self._lock:
+                    self._segments.pop(0)
+                    self.size -= self._sizes.pop(segment)
+                    os.remove(self._path(segment))
+                    if len(self._segments) == 0:
+                        self._reset_position()
+
+    def close(self)->None:
+        with self._lock:
+            self._close_active()
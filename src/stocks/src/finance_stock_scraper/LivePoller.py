@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+import traceback
+import pytz
+from datetime import datetime, timedelta
+from typing import Callable
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from finance_stock_scraper.CompleteBarsDataProvider import CompleteBarsDataProvider
+from finance_stock_scraper.Scheduler import Scheduler, JobResult, WORKERS
+from finance_stock_scraper.model.Intervals import IntervalTypes
+from finance_stock_scraper.model.MarketSchedule import SCHEDULE_CACHE
+from finance_stock_scraper.workflow import CONFIGURED_INTERVALS, get_interval, interval_to_timedelta, prepare_interval
+
+LIVE_INTERVALS = [interval for interval in os.getenv('STOCKSCRAPER_LIVE_INTERVALS',",".join(CONFIGURED_INTERVALS)).split(",") if interval] # Only the intraday ones are polled
+LIVE_DELAY = float(os.getenv('STOCKSCRAPER_LIVE_DELAY',10)) # Seconds after a bar closed until Yahoo Finance is asked for it
+LIVE_IDLE_SLEEP = float(os.getenv('STOCKSCRAPER_LIVE_IDLE_SLEEP',300)) # Maximal sleep while no exchange has an open session
+
+class LivePoller(object):
+    """
+    Polls the intraday intervals of exchanges with an open session at the bar cadence (aligned to the session open).
+    Every poll runs the regular flow, so only the bars after the watermarks are downloaded and stored. Closed exchanges cost nothing.
+    """
+    def __init__(self,executionContext:ExecutionContext,intervals:list[str]=LIVE_INTERVALS,delay:float=LIVE_DELAY,idle_sleep:float=LIVE_IDLE_SLEEP,workers:int=WORKERS) -> None:
+        self.intervals = [interval for interval in intervals if get_interval(interval) == IntervalTypes.Intraday]
+        if len(self.intervals) == 0:
+            raise ValueError(f"The live mode needs intraday intervals, got {','.join(intervals)}")
+        self.delay = timedelta(seconds=delay)
+        self.idle_sleep = idle_sleep
+        self.executionContext = ExecutionContext(executionContext.tickerRepository,CompleteBarsDataProvider(executionContext.yfDataProcider),
+                                                 executionContext.questClient,watermarkStore=executionContext.watermarkStore,failureRegistry=executionContext.failureRegistry)
+        self.scheduler = Scheduler(self.executionContext,workers,self.intervals)
+        #(exchange, interval) => (close of the session, next poll or None once the last bar of the session is stored)
+        self._state:dict[tuple[str,str],tuple[datetime,datetime|None]] = {}
+
+    def _session(self,exchange:str,now:datetime)->tuple[datetime,datetime]|None:
+        """
+        Session that is open at `now`, otherwise the session of the (UTC) day.
+        Sessions are keyed by the local date of the exchange => the open session can be the one of the next or the previous UTC day (e.g. the ASX opens at 23:00 UTC).
+        """
+        sessions = {}
+        for day in [now.date(),now.date()+timedelta(days=1),now.date()-timedelta(days=1)]:
+            session = SCHEDULE_CACHE.get(exchange,day).session(day)
+            if session is not None:
+                session = session[0].to_pydatetime(),session[1].to_pydatetime()
+                if session[0] <= now < session[1]:
+                    return session
+                sessions[day] = session
+        return sessions.get(now.date())
+
+    def _next_poll(self,market_open:datetime,market_close:datetime,interval:str,now:datetime)->datetime|None:
+        """
+        Close of the next bar that is not complete yet (plus the delay) or None if the last bar of the session is complete
+        """
+        delta = interval_to_timedelta(interval)
+        bars = (now-self.delay-market_open)//delta+1
+        bar_close = market_open+bars*delta
+        if bar_close-delta >= market_close:
+            return None
+        return bar_close+self.delay
+
+    def due_jobs(self,exchanges:list[str],now:datetime)->list[tuple[str,str]]:
+        """
+        Jobs that have a new complete bar, the next poll of each returned job is scheduled
+        """
+        jobs = []
+        for exchange in exchanges:
+            session = self._session(exchange,now)
+            if session is None or now < session[0]:
+                continue
+            market_open,market_close = session
+            for interval in self.intervals:
+                key = (exchange,interval)
+                state = self._state.get(key)
+                if state is not None and state[0] == market_close and (state[1] is None or now < state[1]):
+                    continue
+                jobs.append(key)
+                self._state[key] = (market_close,self._next_poll(market_open,market_close,interval,now))
+        return jobs
+
+    def seconds_until_next_poll(self,now:datetime)->float:
+        pending = [state[1] for state in self._state.values() if state[1] is not None and state[1] > now]
+        if len(pending) == 0:
+            return self.idle_sleep
+        return min(self.idle_sleep,max(1.0,(min(pending)-now).total_seconds()))
+
+    def poll(self,exchanges:list[str],now:datetime)->list[JobResult]:
+        jobs = self.due_jobs(exchanges,now)
+        if len(jobs) == 0:
+            return []
+        results = self.scheduler.run_jobs(jobs,now)
+        lag = (datetime.now(pytz.UTC)-now).total_seconds()
+        logging.info(f"Polled {len(jobs)} live jobs ({','.join(f'{exchange}-{interval}' for exchange,interval in jobs)}) in {lag:.1f}s")
+        return results
+
+    def run_forever(self,get_exchanges:Callable[[],list[str]])->None:
+        for interval in self.intervals:
+            prepare_interval(interval,self.executionContext)
+        try:
+            while True:
+                now = datetime.now(pytz.UTC)
+                try:
+                    self.poll(get_exchanges(),now)
+                except Exception as e:
+                    logging.error(e)
+                    logging.debug(traceback.format_exc())
+                time.sleep(self.seconds_until_next_poll(datetime.now(pytz.UTC)))
+        finally:
+            self.executionContext.questClient.close_ingestion()
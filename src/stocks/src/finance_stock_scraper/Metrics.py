@@ -0,0 +1,198 @@
+import os
+import math
+import logging
+import threading
+from abc import ABC, abstractmethod
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+METRICS_PORT = int(os.getenv('STOCKSCRAPER_METRICS_PORT',0)) # Port of the /metrics endpoint, 0 disables it
+METRICS_HOST = os.getenv('STOCKSCRAPER_METRICS_HOST','0.0.0.0')
+DEFAULT_BUCKETS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120,300,600,1800,3600)
+
+def _escape(value:str)->str:
+    return str(value).replace("\\","\\\\").replace("\"","\\\"").replace("\n","\\n")
+
+def _format_labels(names:list[str],values:tuple,extra:str="")->str:
+    labels = [f'{name}="{_escape(value)}"' for name,value in zip(names,values)]
+    if extra:
+        labels.append(extra)
+    return "{"+",".join(labels)+"}" if len(labels) > 0 else ""
+
+def _format_value(value:float)->str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric(ABC):
+    """
+    Base of all metrics, the subclasses render their samples
+    """
+    type = "untyped"
+
+    def __init__(self,name:str,help:str,labels:list[str]=[]) -> None:
+        self.name = name
+        self.help = help
+        self.labels = list(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self,labels:dict)->tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects the labels {','.join(self.labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    @abstractmethod
+    def _samples(self)->list[str]:
+        pass
+
+    def render(self)->str:
+        with self._lock:
+            samples = self._samples()
+        return "\n".join([f"# HELP {self.name} {self.help}",f"# TYPE {self.name} {self.type}"]+samples)
+
+class _SingleValueMetric(Metric):
+    """
+    Metric with one value per label combination
+    """
+    def _add(self,amount:float,labels:dict)->None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key,0)+amount
+
+    def value(self,**labels)->float:
+        with self._lock:
+            return self._values.get(self._key(labels),0)
+
+    def _samples(self)->list[str]:
+        return [f"{self.name}{_format_labels(self.labels,key)} {_format_value(value)}" for key,value in self._values.items()]
+
+class Counter(_SingleValueMetric):
+    type = "counter"
+
+    def inc(self,amount:float=1,**labels)->None:
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        self._add(amount,labels)
+
+class Gauge(_SingleValueMetric):
+    type = "gauge"
+
+    def set(self,value:float,**labels)->None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self,amount:float=1,**labels)->None:
+        self._add(amount,labels)
+
+    def dec(self,amount:float=1,**labels)->None:
+        self._add(-amount,labels)
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self,name:str,help:str,labels:list[str]=[],buckets:tuple[float]=DEFAULT_BUCKETS) -> None:
+        super().__init__(name,help,labels)
+        self.buckets = tuple(sorted(buckets))+(math.inf,)
+
+    def observe(self,value:float,**labels)->None:
+        key = self._key(labels)
+        with self._lock:
+            counts,total = self._values.get(key,([0]*len(self.buckets),0.0))
+            for i,bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts,total+value)
+
+    def count(self,**labels)->int:
+        with self._lock:
+            counts,_ = self._values.get(self._key(labels),([0]*len(self.buckets),0.0))
+            return counts[-1]
+
+    def _samples(self)->list[str]:
+        samples = []
+        for key,(counts,total) in self._values.items():
+            for bound,count in zip(self.buckets,counts):
+                le = f'le="{_format_value(bound)}"'
+                samples.append(f"{self.name}_bucket{_format_labels(self.labels,key,le)} {count}")
+            samples.append(f"{self.name}_sum{_format_labels(self.labels,key)} {_format_value(total)}")
+            samples.append(f"{self.name}_count{_format_labels(self.labels,key)} {counts[-1]}")
+        return samples
+
+class MetricsRegistry(object):
+    """
+    Collection of metrics that is rendered in the Prometheus text format
+    """
+    def __init__(self) -> None:
+        self._metrics:dict[str,Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self,metric:Metric)->Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self,name:str,help:str,labels:list[str]=[])->Counter:
+        return self._register(Counter(name,help,labels))
+
+    def gauge(self,name:str,help:str,labels:list[str]=[])->Gauge:
+        return self._register(Gauge(name,help,labels))
+
+    def histogram(self,name:str,help:str,labels:list[str]=[],buckets:tuple[float]=DEFAULT_BUCKETS)->Histogram:
+        return self._register(Histogram(name,help,labels,buckets))
+
+    def render(self)->str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics)+"\n"
+
+class MetricsServer(object):
+    """
+    Serves the metrics of a registry on http://host:port/metrics from a background thread
+    """
+    def __init__(self,registry:MetricsRegistry,host:str=METRICS_HOST,port:int=METRICS_PORT) -> None:
+        self.registry = registry
+        self._server = ThreadingHTTPServer((host,port),self._handler())
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,name="metrics",daemon=True)
+
+    def _handler(self):
+        registry = self.registry
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type","text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length",str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self,format,*args):
+                pass
+        return Handler
+
+    def start(self)->"MetricsServer":
+        self._thread.start()
+        logging.info(f"Serving metrics on port {self.port}")
+        return self
+
+    def stop(self)->None:
+        self._server.shutdown()
+        self._server.server_close()
+
+METRICS = MetricsRegistry()
+ROWS_INGESTED = METRICS.counter("stockscraper_rows_ingested_total","Rows handed to the ingestion channel",["interval"])
+ILP_BYTES = METRICS.counter("stockscraper_ilp_bytes_total","Bytes written to the QuestDB ILP socket")
+ILP_FLUSH_SECONDS = METRICS.histogram("stockscraper_ilp_flush_seconds","Duration of writing a batch to the QuestDB ILP socket")
+ILP_SPOOLED_BYTES = METRICS.counter("stockscraper_ilp_spooled_bytes_total","ILP bytes spilled to the spool because QuestDB was unreachable or behind")
+ILP_SPOOL_PENDING = METRICS.gauge("stockscraper_ilp_spool_pending_bytes","ILP bytes in the spool that wait to be replayed")
+DOWNLOAD_SECONDS = METRICS.histogram("stockscraper_download_seconds","Duration of a Yahoo Finance batch download",["interval"])
+QUERY_SECONDS = METRICS.histogram("stockscraper_query_seconds","Duration of a QuestDB REST request",["endpoint"])
+JOB_SECONDS = METRICS.histogram("stockscraper_job_seconds","Duration of an (exchange, interval) job",["exchange","interval","status"])
+TICKERS_SKIPPED = METRICS.counter("stockscraper_tickers_skipped_total","Ticker downloads skipped because the ticker is in a failure backoff",["reason"])
+LAST_SUCCESS = METRICS.gauge("stockscraper_last_success_timestamp_seconds","Unix time of the last successful (exchange, interval) job",["exchange","interval"])
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import threading
+import logging
+import pandas as pd
+from datetime import datetime
+
+CACHE_DIR = os.getenv('STOCKSCRAPER_CACHE_DIR',None) # Enables the local read cache of the TickerRepository
+CACHE_SIZE_MB = int(os.getenv('STOCKSCRAPER_CACHE_SIZE_MB',1024))
+#The cache always stores all columns of the interval tables
+CACHED_COLUMNS = ["open","high","low","close","adj_close","volume"]
+
+Range = tuple[datetime,datetime]
+
+class ParquetCache(object):
+    """
+    Read-through cache that stores the data of each (interval, ticker) as a Parquet file and tracks which (closed) time ranges it covers.
+    All times are naive UTC datetimes. Least recently used entries are evicted to stay below the size budget.
+    """
+    def __init__(self,directory:str=CACHE_DIR,max_size_mb:int=CACHE_SIZE_MB) -> None:
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size_mb*1024*1024
+        self._lock = threading.RLock()
+        os.makedirs(self.directory,exist_ok=True)
+        self._manifest_file = os.path.join(self.directory,"manifest.json")
+        self._manifest = {"tables":{},"entries":{}}
+        if os.path.isfile(self._manifest_file):
+            try:
+                with open(self._manifest_file) as f:
+                    self._manifest = json.load(f)
+            except Exception as e:
+                logging.warning(f"Could not read cache manifest, starting with an empty cache: {e}")
+
+    def _key(self,interval:str,exchange:str,ticker:str)->str:
+        return f"{interval}/{exchange}/{ticker}"
+
+    def _path(self,key:str)->str:
+        return os.path.join(self.directory,*key.split("/"))+".parquet"
+
+    def _save_manifest(self)->None:
+        tmp_file = self._manifest_file+".tmp"
+        with open(tmp_file,"w") as f:
+            json.dump(self._manifest,f)
+        os.replace(tmp_file,self._manifest_file)
+
+    def ranges(self,interval:str,exchange:str,ticker:str)->list[Range]:
+        with self._lock:
+            entry = self._manifest["entries"].get(self._key(interval,exchange,ticker))
+            if entry is None:
+                return []
+            return [(datetime.fromisoformat(start),datetime.fromisoformat(end)) for start,end in entry["ranges"]]
+
+    def missing(self,interval:str,exchange:str,ticker:str,start:datetime,end:datetime)->list[Range]:
+        """
+        Parts of [start,end] that are not covered by the cache
+        """
+        missing = []
+        cursor = start
+        covered = False
+        for covered_start,covered_end in self.ranges(interval,exchange,ticker):
+            if covered_end < cursor or covered_start > end:
+                continue
+            if covered_start > cursor:
+                missing.append((cursor,covered_start))
+            cursor = max(cursor,covered_end)
+            covered = True
+        if cursor < end or not covered:
+            missing.append((cursor,end))
+        return missing
+
+    def validate(self,interval:str,latest:datetime|None)->None:
+        """
+        Drops all entries of the interval if the table was emptied or rebuilt (its latest timestamp went backwards)
+        """
+        with self._lock:
+            known = self._manifest["tables"].get(interval)
+            if known is not None and (latest is None or latest < datetime.fromisoformat(known)):
+                logging.info(f"Table interval_{interval} changed, invalidating the cache")
+                for key in [key for key in self._manifest["entries"] if key.startswith(f"{interval}/")]:
+                    self._remove(key)
+            self._manifest["tables"][interval] = latest.isoformat() if latest is not None else None
+            self._save_manifest()
+
+    def store(self,interval:str,exchange:str,ticker:str,df:pd.DataFrame,start:datetime,end:datetime)->None:
+        """
+        Merges the rows fetched for [start,end] into the cached data of the ticker and marks the range as covered
+        """
+        with self._lock:
+            key = self._key(interval,exchange,ticker)
+            path = self._path(key)
+            entry = self._manifest["entries"].get(key)
+            if entry is not None and os.path.isfile(path):
+                if len(df) > 0:
+                    existing = pd.read_parquet(path)
+                    df = pd.concat([existing,df]) if len(existing) > 0 else df
+                    df = df[~df.index.duplicated(keep="last")].sort_index()
+                    df.to_parquet(path)
+            else:
+                if len(df) == 0:
+                    df = pd.DataFrame({column:pd.Series(dtype="float64") for column in df.columns},index=pd.DatetimeIndex([]))
+                os.makedirs(os.path.dirname(path),exist_ok=True)
+                df.to_parquet(path)
+
+            ranges = sorted(self.ranges(interval,exchange,ticker)+[(start,end)])
+            merged = [ranges[0]]
+            for range_start,range_end in ranges[1:]:
+                if range_start <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0],max(merged[-1][1],range_end))
+                else:
+                    merged.append((range_start,range_end))
+            self._manifest["entries"][key] = {
+                "ranges":[[range_start.isoformat(),range_end.isoformat()] for range_start,range_end in merged],
+                "size":os.path.getsize(path),
+                "accessed":time.time(),
+            }
+            self._save_manifest()
+
+    def load(self,interval:str,exchange:str,ticker:str,start:datetime,end:datetime,values:list[str])->pd.DataFrame:
+        with self._lock:
+            key = self._key(interval,exchange,ticker)
+            entry = self._manifest["entries"].get(key)
+            path = self._path(key)
+            if entry is None or not os.path.isfile(path):
+                return pd.DataFrame(columns=values)
+            entry["accessed"] = time.time()
+            df = pd.read_parquet(path,columns=values)
+        return df.loc[(df.index >= start) & (df.index <= end)]
+
+    @property
+    def size(self)->int:
+        with self._lock:
+            return sum(entry["size"] for entry in self._manifest["entries"].values())
+
+    def _remove(self,key:str)->None:
+        self._manifest["entries"].pop(key,None)
+        path = self._path(key)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def evict(self)->None:
+        """
+        Removes the least recently used entries until the cache is below its size budget.
+        Called once a read is complete, so the entries of the running read are never evicted.
+        """
+        with self._lock:
+            size = self.size
+            for key,entry in sorted(self._manifest["entries"].items(),key=lambda item:item[1]["accessed"]):
+                if size <= self.max_size:
+                    break
+                size -= entry["size"]
+                self._remove(key)
+            self._save_manifest()
+
+    def clear(self)->None:
+        with self._lock:
+            for key in list(self._manifest["entries"]):
+                self._remove(key)
+            self._manifest = {"tables":{},"entries":{}}
+            self._save_manifest()
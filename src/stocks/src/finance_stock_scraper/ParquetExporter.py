@@ -0,0 +1,163 @@
+import os
+import glob
+import json
+import logging
+import argparse
+import pandas as pd
+from datetime import datetime, timedelta
+from typing import Iterator
+from finance_stock_scraper.QuestClient import QuestClient
+from finance_stock_scraper.workflow import interval_to_timedelta
+from finance_stock_scraper.lazy import LazyModule
+
+pa = LazyModule("pyarrow")
+pq = LazyModule("pyarrow.parquet")
+
+EXPORT_DIR = os.getenv('STOCKSCRAPER_EXPORT_DIR',"../../../export")
+EXPORT_CHUNK_BARS = int(os.getenv('STOCKSCRAPER_EXPORT_CHUNK_BARS',300)) # Bars per ticker that are fetched with one query (caps memory)
+EXPORTED_COLUMNS = ["ticker","timestamp","open","high","low","close","adj_close","volume"]
+
+def month_windows(start:datetime,end:datetime)->Iterator[tuple[datetime,datetime]]:
+    """
+    Calendar months [month_start,next_month_start) that overlap [start,end)
+    """
+    month = datetime(start.year,start.month,1)
+    while month < end:
+        next_month = datetime(month.year+month.month//12,month.month%12+1,1)
+        yield month,next_month
+        month = next_month
+
+def _naive_utc(time:datetime)->datetime:
+    return pd.Timestamp(time).tz_convert("UTC").tz_localize(None).to_pydatetime() if time.tzinfo else time
+
+class ParquetExporter(object):
+    """
+    Copies interval tables into Hive-partitioned Parquet files (interval_X/exchange=E/year=Y/month=M/part-0.parquet).
+    Every month is paged through in chunks of `chunk_bars` bars and streamed into one writer per exchange.
+    Finished months are recorded in a state file, an interrupted export continues with the first unfinished month.
+    """
+    def __init__(self,questClient:QuestClient,directory:str=EXPORT_DIR,chunk_bars:int=EXPORT_CHUNK_BARS) -> None:
+        self.questClient = questClient
+        self.directory = os.path.abspath(directory)
+        self.chunk_bars = chunk_bars
+
+    def _table_dir(self,interval:str)->str:
+        return os.path.join(self.directory,f"interval_{interval}")
+
+    def _partition_dir(self,interval:str,exchange:str,month:datetime)->str:
+        return os.path.join(self._table_dir(interval),f"exchange={exchange}",f"year={month.year}",f"month={month.month:02d}")
+
+    def _state_file(self,interval:str)->str:
+        return os.path.join(self._table_dir(interval),"_export_state.json")
+
+    def completed_months(self,interval:str)->set[str]:
+        if not os.path.isfile(self._state_file(interval)):
+            return set()
+        with open(self._state_file(interval)) as f:
+            return set(json.load(f)["completed"])
+
+    def _save_completed_months(self,interval:str,completed:set[str])->None:
+        tmp_file = self._state_file(interval)+".tmp"
+        with open(tmp_file,"w") as f:
+            json.dump({"completed":sorted(completed)},f)
+        os.replace(tmp_file,self._state_file(interval))
+
+    def _schema(self):
+        return pa.schema([
+            ("ticker",pa.string()),
+            ("timestamp",pa.timestamp("ns")),
+            ("open",pa.float64()),
+            ("high",pa.float64()),
+            ("low",pa.float64()),
+            ("close",pa.float64()),
+            ("adj_close",pa.float64()),
+            ("volume",pa.int64()),
+        ])
+
+    def _chunks(self,interval:str,start:datetime,end:datetime)->Iterator[pd.DataFrame]:
+        step = interval_to_timedelta(interval)*self.chunk_bars
+        cursor = start
+        while cursor < end:
+            chunk_end = min(cursor+step,end)
+            query = f"SELECT exchange,{','.join(EXPORTED_COLUMNS)} FROM 'interval_{interval}' "\
+                    f"WHERE timestamp >= '{self.questClient._format_time(cursor)}' AND timestamp < '{self.questClient._format_time(chunk_end)}';"
+            df = self.questClient.query_frame(query)
+            if df is None:
+                raise Exception(f"Export query for interval_{interval} failed at {cursor}")
+            if len(df) > 0:
+                yield df
+            cursor = chunk_end
+
+    def _export_month(self,interval:str,start:datetime,end:datetime,month:datetime)->int:
+        #a previous attempt may have left (partial) files of this month behind
+        for file in glob.glob(os.path.join(self._table_dir(interval),"exchange=*",f"year={month.year}",f"month={month.month:02d}","part-0.parquet*")):
+            os.remove(file)
+
+        schema = self._schema()
+        writers = {}
+        rows = 0
+        try:
+            for df in self._chunks(interval,start,end):
+                df["ticker"] = df["ticker"].astype(str)
+                for exchange,group in df.groupby(df["exchange"].astype(str),sort=False):
+                    writer = writers.get(exchange)
+                    if writer is None:
+                        directory = self._partition_dir(interval,exchange,month)
+                        os.makedirs(directory,exist_ok=True)
+                        writer = pq.ParquetWriter(os.path.join(directory,"part-0.parquet.tmp"),schema)
+                        writers[exchange] = writer
+                    writer.write_table(pa.Table.from_pandas(group[EXPORTED_COLUMNS],schema=schema,preserve_index=False))
+                    rows += len(group)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        #only finished files get their final name
+        for exchange in writers:
+            path = os.path.join(self._partition_dir(interval,exchange,month),"part-0.parquet")
+            os.replace(path+".tmp",path)
+        return rows
+
+    def export(self,interval:str,start:datetime|None=None,end:datetime|None=None)->int:
+        """
+        Exports [start,end) of the interval table (default: the whole table) and returns the number of exported rows.
+        Months that were finished by an earlier export are skipped.
+        """
+        earliest = self.questClient.get_earliest_timestamp(interval)
+        latest = self.questClient.get_latest_timestamp(interval)
+        if earliest is None or latest is None:
+            logging.info(f"interval_{interval} is empty, nothing to export")
+            return 0
+        #months before the requested start are only complete if there is no requested start
+        lower = _naive_utc(start) if start else datetime.min
+        start = max(lower,_naive_utc(earliest))
+        end = min(_naive_utc(end),_naive_utc(latest)+timedelta(microseconds=1)) if end else _naive_utc(latest)+timedelta(microseconds=1)
+
+        os.makedirs(self._table_dir(interval),exist_ok=True)
+        completed = self.completed_months(interval)
+        rows = 0
+        for month_start,month_end in month_windows(start,end):
+            key = month_start.strftime("%Y-%m")
+            if key in completed:
+                continue
+            month_rows = self._export_month(interval,max(start,month_start),min(end,month_end),month_start)
+            rows += month_rows
+            logging.info(f"Exported {month_rows} rows of interval_{interval} for {key}")
+            #a month that is only partially covered (e.g. the current one) is exported again next time
+            if lower <= month_start and month_end <= end:
+                completed.add(key)
+                self._save_completed_months(interval,completed)
+        return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export interval tables to Hive-partitioned Parquet")
+    parser.add_argument("intervals",nargs="+",help="e.g. 5m 1d")
+    parser.add_argument("--directory",default=EXPORT_DIR)
+    parser.add_argument("--start",type=datetime.fromisoformat,default=None,help="UTC, e.g. 2022-01-01")
+    parser.add_argument("--end",type=datetime.fromisoformat,default=None,help="UTC, exclusive")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s - %(message)s',level=logging.INFO)
+    exporter = ParquetExporter(QuestClient(),args.directory)
+    for interval in args.intervals:
+        rows = exporter.export(interval,args.start,args.end)
+        logging.info(f"Exported {rows} rows of interval_{interval} to {exporter._table_dir(interval)}")
@@ -1,28 +1,120 @@
 from datetime import datetime,date
+from typing import Iterator, TYPE_CHECKING
+from contextlib import contextmanager
 import os
-from questdb.ingress import Sender, TimestampNanos, Buffer
+import time
+import re
+import threading
+import pandas as pd
 import requests 
 from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pytz
 from finance_stock_scraper.model.Ticker import Ticker
+from finance_stock_scraper.IngestionChannel import IngestionChannel
+from finance_stock_scraper.IngestionSpool import IngestionSpool
+from finance_stock_scraper.Metrics import QUERY_SECONDS
 from finance_stock_scraper.model.Intervals import INTERVALS, IntervalTypes
 
+if TYPE_CHECKING:
+    from questdb.ingress import Buffer
+
 
 HOST = os.getenv('STOCKSCRAPER_QUESTDB_HOST','localhost')
 INFLUX_LINE_PROTOCOL_PORT = os.getenv('STOCKSCRAPER_QUESTDB_ILP_PORT',9009) 
 REST_PORT = os.getenv('STOCKSCRAPER_QUESTDB_PORT',9000) 
 MONITORING_PORT = os.getenv('STOCKSCRAPER_QUESTDB_MONITORING_PORT',9003)
+MAX_URL_LENGTH = int(os.getenv('STOCKSCRAPER_QUESTDB_MAX_URL_LENGTH',8000)) # Keep the /exec urls below common server/proxy limits
+POOL_SIZE = int(os.getenv('STOCKSCRAPER_QUESTDB_POOL_SIZE',10)) # Keep-alive connections per host
+CONNECT_TIMEOUT = float(os.getenv('STOCKSCRAPER_QUESTDB_CONNECT_TIMEOUT',5))
+READ_TIMEOUT = float(os.getenv('STOCKSCRAPER_QUESTDB_READ_TIMEOUT',300))
+RETRIES = int(os.getenv('STOCKSCRAPER_QUESTDB_RETRIES',3))
+RETRY_BACKOFF = float(os.getenv('STOCKSCRAPER_QUESTDB_RETRY_BACKOFF',0.5)) # Seconds, doubled for every retry
+PAGE_SIZE = int(os.getenv('STOCKSCRAPER_QUESTDB_PAGE_SIZE',100_000)) # Rows per request of the paged queries
+#dtypes of the columns of the interval tables when reading csv exports
+COLUMN_DTYPES = {
+    "exchange":"category",
+    "ticker":"category",
+    "open":"float64",
+    "high":"float64",
+    "low":"float64",
+    "close":"float64",
+    "adj_close":"float64",
+    "volume":"int64",
+}
+#the prices are stored as (32 bit) float => panels keep them as float32
+PANEL_DTYPES = {**COLUMN_DTYPES,"open":"float32","high":"float32","low":"float32","close":"float32","adj_close":"float32"}
+#aggregations that can be pushed to SAMPLE BY, the columns are the numeric columns of the interval tables
+AGGREGATION_FUNCTIONS = ["first","last","min","max","sum","avg"]
+AGGREGATION_COLUMNS = ["open","high","low","close","adj_close","volume"]
+OHLCV_AGGREGATIONS = {"open":"first(open)","high":"max(high)","low":"min(low)","close":"last(close)","volume":"sum(volume)"}
+FILL_MODES = ["NONE","NULL","PREV","LINEAR"]
 
 class QuestClient(object):
-    def __init__(self,host:str=HOST,port:int=REST_PORT,ilp_port:int=INFLUX_LINE_PROTOCOL_PORT,monitoring_port:int=MONITORING_PORT)-> None:
+    def __init__(self,host:str=HOST,port:int=REST_PORT,ilp_port:int=INFLUX_LINE_PROTOCOL_PORT,monitoring_port:int=MONITORING_PORT,
+                 pool_size:int=POOL_SIZE,timeout:tuple[float,float]=(CONNECT_TIMEOUT,READ_TIMEOUT),retries:int=RETRIES,retry_backoff:float=RETRY_BACKOFF,
+                 spool_dir:str|None=None)-> None:
         self.host = host
         self.ilp_port = ilp_port
         self.port = port
         self.monitoring_port = monitoring_port
+        self.timeout = timeout
+        #The adapter holds the (thread safe) connection pools and is shared by the sessions of all threads
+        retry = Retry(total=retries,backoff_factor=retry_backoff,status_forcelist=[502,503,504],allowed_methods=["GET"],raise_on_status=False)
+        self._adapter = HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size,max_retries=retry)
+        self._local = threading.local()
+        self._ingestion:IngestionChannel|None = None
+        self._ingestion_lock = threading.Lock()
+        #points are spilled to the spool while QuestDB is unreachable (no spool => they are lost)
+        self._spool = IngestionSpool(spool_dir) if spool_dir is not None else None
+        
+    @property
+    def session(self)-> requests.Session:
+        """
+        Keep-alive session of the current thread, backed by the shared connection pool
+        """
+        session = getattr(self._local,"session",None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://",self._adapter)
+            session.mount("https://",self._adapter)
+            self._local.session = session
+        return session
+    
+    def connection_stats(self)-> dict[str,int]:
+        """
+        Counters of the connection pools: performed requests, opened connections and requests that reused an open connection
+        """
+        requests_count = 0
+        connections = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_count += pool.num_requests
+                connections += pool.num_connections
+        return {"requests":requests_count,"connections":connections,"reused":requests_count-connections}
+    
+    @property
+    def ingestion(self)-> IngestionChannel:
+        """
+        Long-lived ILP channel, (re)created on first use
+        """
+        with self._ingestion_lock:
+            if self._ingestion is None or self._ingestion.closed:
+                self._ingestion = IngestionChannel(self.host,self.ilp_port,spool=self._spool)
+            return self._ingestion
+    
+    def close(self)-> None:
+        self.close_ingestion()
+        if self._spool is not None:
+            self._spool.close()
+        self._adapter.close()
     
     def health_check(self)-> bool:
         try:
-            return requests.get(f"http://{self.host}:{self.monitoring_port}/status").status_code == 200
+            return self.session.get(f"http://{self.host}:{self.monitoring_port}/status",timeout=self.timeout).status_code == 200
         except:
             return False
             
@@ -65,48 +157,308 @@ class QuestClient(object):
             return []
         
         
-    def get_last_entry_dates(self,interval:str)-> dict[str,datetime]:
-        query = f"SELECT ticker, timestamp FROM 'interval_{interval}'"\
+    def get_last_entry_dates(self,interval:str,exchange:str|None=None)-> dict[str,datetime]:
+        """
+        Last timestamp of each ticker (UTC), raises if the query failed (an empty result means the tickers have no rows)
+        """
+        where = f" WHERE exchange = '{exchange}'" if exchange is not None else ""
+        query = f"SELECT ticker, timestamp FROM 'interval_{interval}'{where} "\
                 "LATEST ON timestamp PARTITION BY ticker;"
                 
         response = self.raw_query(query)
+        if response.status_code != 200:
+            raise Exception(f"Query of the last entries of interval_{interval} failed with status {response.status_code}")
         last_entries = {}
-        if response.status_code == 200:
-            for ticker,time in response.json()['dataset']:
-                last_entries[ticker] = datetime.strptime(time,"%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=pytz.UTC)
-            return last_entries
-        else:
-            return last_entries
+        for ticker,time in response.json()['dataset']:
+            last_entries[ticker] = datetime.strptime(time,"%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=pytz.UTC)
+        return last_entries
+    
+    def get_latest_timestamp(self,interval:str)-> datetime|None:
+        """
+        Latest timestamp of the interval table (UTC) or None if the table is empty, raises if the query failed
+        """
+        response = self.raw_query(f"SELECT max(timestamp) FROM 'interval_{interval}';")
+        if response.status_code != 200:
+            raise Exception(f"Query of the latest timestamp of interval_{interval} failed with status {response.status_code}")
+        dataset = response.json()['dataset']
+        if len(dataset) > 0 and dataset[0][0] is not None:
+            return datetime.strptime(dataset[0][0],"%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=pytz.UTC)
+        return None
+    
+    def get_earliest_timestamp(self,interval:str)-> datetime|None:
+        """
+        Earliest timestamp of the interval table (UTC) or None if the table is empty, raises if the query failed
+        """
+        response = self.raw_query(f"SELECT min(timestamp) FROM 'interval_{interval}';")
+        if response.status_code != 200:
+            raise Exception(f"Query of the earliest timestamp of interval_{interval} failed with status {response.status_code}")
+        dataset = response.json()['dataset']
+        if len(dataset) > 0 and dataset[0][0] is not None:
+            return datetime.strptime(dataset[0][0],"%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=pytz.UTC)
+        return None
     
-    def store_points(self,buffer:Buffer)-> None:
+    def store_points(self,buffer:"Buffer")-> None:
+        """
+        Writes the buffer synchronously over the ingestion channel
+        """
         if len(buffer) > 0:
-            with Sender(self.host, self.ilp_port) as sender:
-                sender.flush(buffer)
-              
-    def get_data(self,ticker:Ticker,interval:str,values:list[str]=["close"],start_date:datetime|None=None,end_date:datetime|None=None)-> None|dict:
+            self.ingestion.submit(buffer)
+            self.ingestion.flush()
+            
+    def submit_points(self,buffer:"Buffer",rows:int=0)-> None:
         """
-        Querry data for the given ticker and interval
+        Hands the buffer to the ingestion channel, which flushes it in the background. The buffer must not be reused.
+        """
+        self.ingestion.submit(buffer,rows,getattr(self._local,"job",None))
+        
+    @property
+    def spooled_bytes(self)-> int:
+        """
+        Bytes of points that are spooled on disk and were not replayed to QuestDB yet
+        """
+        return self._spool.pending if self._spool is not None else 0
+        
+    def flush_points(self)-> int:
+        """
+        Blocks until all submitted points are written or spooled and replays the spool. Returns the bytes that are still spooled.
+        """
+        if (self._ingestion is not None and not self._ingestion.closed) or self.spooled_bytes > 0:
+            self.ingestion.flush(getattr(self._local,"job",None))
+        return self.spooled_bytes
+            
+    @contextmanager
+    def job(self)-> Iterator[None]:
+        """
+        Scopes the points submitted by the current thread to a job: `flush_points` of the job only raises the errors of its own points
+        """
+        job = object()
+        previous = getattr(self._local,"job",None)
+        self._local.job = job
+        try:
+            yield
+        finally:
+            self._local.job = previous
+            if self._ingestion is not None:
+                self._ingestion.discard_errors(job)
+            
+    def close_ingestion(self)-> None:
+        """
+        Flushes all submitted points and closes the ILP connection
         """
+        with self._ingestion_lock:
+            ingestion = self._ingestion
+            self._ingestion = None
+        if ingestion is not None:
+            ingestion.close()
+              
+    def _time_filter(self,start_date:datetime|None=None,end_date:datetime|None=None)-> str:
+        if end_date and start_date:
+            return f"timestamp BETWEEN '{self._format_time(start_date)}' AND '{self._format_time(end_date)}' AND "
+        elif end_date and not start_date:
+            return f"timestamp <= '{self._format_time(end_date)}' AND "
+        elif start_date and not end_date:
+            return f"timestamp >= '{self._format_time(start_date)}' AND "
+        return ""
+    
+    def _data_query(self,ticker:Ticker,interval:str,values:list[str],start_date:datetime|None=None,end_date:datetime|None=None)-> str:
         selection = ["timestamp"]+values
         selection = ",".join(selection)
         query = f"SELECT {selection} FROM 'interval_{interval}'"
         query += "WHERE "
-        if end_date and start_date:
-            query += f"timestamp BETWEEN '{self._format_time(start_date)}' AND '{self._format_time(end_date)}' AND "
-        elif end_date and not start_date:
-            query += f"timestamp <= '{self._format_time(end_date)}' AND "
-        elif start_date and not end_date:
-            query += f"timestamp >= '{self._format_time(start_date)}' AND "
-            
+        query += self._time_filter(start_date,end_date)
         query += f"ticker='{ticker.ticker}' AND exchange='{ticker.exchange}';"
-        
-        response = self.raw_query(query)
+        return query
+    
+    def get_data(self,ticker:Ticker,interval:str,values:list[str]=["close"],start_date:datetime|None=None,end_date:datetime|None=None)-> None|dict:
+        """
+        Querry data for the given ticker and interval
+        """
+        response = self.raw_query(self._data_query(ticker,interval,values,start_date,end_date))
         if response.status_code == 200:
             return response.json()
         return None
     
+    def get_frame(self,ticker:Ticker,interval:str,values:list[str]=["close"],start_date:datetime|None=None,end_date:datetime|None=None)-> None|pd.DataFrame:
+        """
+        Querry data for the given ticker and interval via the csv export endpoint. The result is indexed by the timestamp.
+        """
+        df = self.query_frame(self._data_query(ticker,interval,values,start_date,end_date))
+        if df is not None:
+            df = df.set_index("timestamp")
+            df.index.name = None
+        return df
+    
+    def _batch_tickers(self,base_query:str,tickers:list[str],endpoint:str="exec")->list[list[str]]:
+        """
+        Splits the tickers into batches so that `base_query` with a `ticker IN (...)` list of each batch stays below the max url length
+        """
+        budget = MAX_URL_LENGTH - len(self._query_url(base_query,endpoint))
+        batches = []
+        batch = []
+        length = 0
+        for ticker in tickers:
+            ticker_length = len(requests.utils.quote(f"'{ticker}',"))
+            if len(batch) > 0 and length + ticker_length > budget:
+                batches.append(batch)
+                batch = []
+                length = 0
+            batch.append(ticker)
+            length += ticker_length
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+    
+    def _ticker_query(self,exchange:str,tickers:list[str],interval:str,values:list[str],start_date:datetime|None=None,end_date:datetime|None=None,suffix:str="")-> str:
+        """
+        `ticker IN (...)` query of the tickers of one exchange, `suffix` is appended after the WHERE clause
+        """
+        selection = ",".join(["ticker","timestamp"]+values)
+        query = f"SELECT {selection} FROM 'interval_{interval}'"
+        query += "WHERE "
+        query += self._time_filter(start_date,end_date)
+        ticker_list = ",".join(f"'{ticker}'" for ticker in tickers)
+        query += f"exchange='{exchange}' AND ticker IN ({ticker_list}){suffix};"
+        return query
+    
+    def _ticker_queries(self,tickers:list[Ticker],interval:str,values:list[str],start_date:datetime|None=None,end_date:datetime|None=None,endpoint:str="exec",suffix:str="")-> Iterator[tuple[list[Ticker],str]]:
+        """
+        Builds one `ticker IN (...)` query per exchange and batch. The first two selected columns are the ticker and the timestamp.
+        The `suffix` (e.g. SAMPLE BY or ORDER BY ... LIMIT) counts against the max url length.
+        """
+        by_exchange:dict[str,dict[str,Ticker]] = {}
+        for ticker in tickers:
+            by_exchange.setdefault(ticker.exchange,{})[ticker.ticker] = ticker
+            
+        for exchange,exchange_tickers in by_exchange.items():
+            base_query = self._ticker_query(exchange,[],interval,values,start_date,end_date,suffix)
+            for batch in self._batch_tickers(base_query,list(exchange_tickers),endpoint):
+                yield [exchange_tickers[ticker] for ticker in batch],self._ticker_query(exchange,batch,interval,values,start_date,end_date,suffix)
+    
+    def get_data_for_tickers(self,tickers:list[Ticker],interval:str,values:list[str]=["close"],start_date:datetime|None=None,end_date:datetime|None=None)-> list[tuple[list[Ticker],dict|None]]:
+        """
+        Querry data for multiple tickers with as few requests as possible (one `ticker IN (...)` query per exchange and batch).
+        The first two columns of each result are the ticker and the timestamp. 
+        Returns the requested tickers of each batch together with the result (None if the query failed).
+        """
+        results = []
+        for batch,query in self._ticker_queries(tickers,interval,values,start_date,end_date):
+            response = self.raw_query(query)
+            results.append((batch,response.json() if response.status_code == 200 else None))
+        return results
+    
+    def get_frames_for_tickers(self,tickers:list[Ticker],interval:str,values:list[str]=["close"],start_date:datetime|None=None,end_date:datetime|None=None,dtype:dict[str,str]=COLUMN_DTYPES)-> list[tuple[list[Ticker],pd.DataFrame|None]]:
+        """
+        Same as `get_data_for_tickers` but reads the results via the csv export endpoint into typed DataFrames.
+        """
+        results = []
+        for batch,query in self._ticker_queries(tickers,interval,values,start_date,end_date,endpoint="exp"):
+            results.append((batch,self.query_frame(query,dtype)))
+        return results
+    
+    def iter_frames(self,tickers:Ticker|list[Ticker],interval:str,values:list[str]=["close"],start_date:datetime|None=None,end_date:datetime|None=None,page_size:int=PAGE_SIZE)-> Iterator[pd.DataFrame]:
+        """
+        Streams the data of the tickers as typed DataFrame pages of at most `page_size` rows (columns: ticker, timestamp, values).
+        Pages are ordered by timestamp and ticker and continue from a timestamp cursor, rows that share the timestamp
+        of the cursor are skipped with a (small) LIMIT offset. Memory use doesn't depend on the length of the history.
+        """
+        tickers = [tickers] if isinstance(tickers,Ticker) else tickers
+        #the timestamps are stored as UTC
+        start_date,end_date = [pd.Timestamp(date).tz_convert("UTC").tz_localize(None).to_pydatetime() if date is not None and pd.Timestamp(date).tzinfo is not None else date
+                               for date in (start_date,end_date)]
+        order = " ORDER BY timestamp,ticker LIMIT {},{}"
+        #the batches are split once, the budget covers the cursor predicate and the widest LIMIT of the later pages
+        budget_start = start_date if start_date is not None else datetime(1970,1,1)
+        for batch,_ in self._ticker_queries(tickers,interval,values,budget_start,end_date,endpoint="exp",suffix=order.format(2**63,2**63)):
+            names = [ticker.ticker for ticker in batch]
+            cursor = start_date
+            skip = 0
+            while True:
+                query = self._ticker_query(batch[0].exchange,names,interval,values,cursor,end_date,order.format(skip,skip+page_size))
+                df = self.query_frame(query)
+                if df is None:
+                    raise Exception(f"Paged query for interval_{interval} failed at {cursor}")
+                if len(df) > 0:
+                    yield df
+                if len(df) < page_size:
+                    break
+                last = df["timestamp"].iloc[-1]
+                ties = int((df["timestamp"] == last).sum())
+                #the next page starts at the last timestamp => skip the rows of it that were already returned
+                skip = skip+ties if cursor is not None and pd.Timestamp(cursor) == last else ties
+                cursor = last.to_pydatetime()
+    
+    def _aggregation(self,name:str,aggregation:str)-> str:
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*",name):
+            raise ValueError(f"Invalid column name {name}")
+        if aggregation.lower() == "vwap":
+            return f"sum(close*volume)/sum(volume) {name}"
+        match = re.fullmatch(r"(\w+)\((\w+)\)",aggregation.strip().lower())
+        if match is None or match.group(1) not in AGGREGATION_FUNCTIONS or match.group(2) not in AGGREGATION_COLUMNS:
+            raise ValueError(f"Unsupported aggregation {aggregation}, use vwap or one of {AGGREGATION_FUNCTIONS} of {AGGREGATION_COLUMNS}")
+        return f"{match.group(1)}({match.group(2)}) {name}"
+    
+    def get_aggregated(self,tickers:list[Ticker],interval:str,sample_by:str,aggregations:dict[str,str]=OHLCV_AGGREGATIONS,start_date:datetime|None=None,end_date:datetime|None=None,fill:str="NONE")-> pd.DataFrame:
+        """
+        Aggregates the tickers into `sample_by` buckets (e.g. 1h, 7d, 1M) on the server, only the aggregated rows are transferred.
+        `aggregations` maps the output columns to `function(column)` (first, last, min, max, sum, avg) or `vwap`.
+        `fill` is NONE, NULL, PREV, LINEAR or a constant for empty buckets. Returns a long frame (ticker, timestamp, aggregations).
+        """
+        if not re.fullmatch(r"\d+[smhdMy]",sample_by):
+            raise ValueError(f"Invalid SAMPLE BY unit {sample_by}")
+        fill = str(fill).upper()
+        if fill not in FILL_MODES:
+            try:
+                float(fill)
+            except ValueError:
+                raise ValueError(f"Invalid fill {fill}, use one of {FILL_MODES} or a number")
+        selection = [self._aggregation(name,aggregation) for name,aggregation in aggregations.items()]
+        
+        frames = []
+        for batch,query in self._ticker_queries(tickers,interval,selection,start_date,end_date,endpoint="exp",suffix=f" SAMPLE BY {sample_by} FILL({fill}) ALIGN TO CALENDAR"):
+            #aggregates of empty buckets can be null => only the symbols get fixed dtypes
+            df = self.query_frame(query,dtype={"ticker":"category"})
+            if df is None:
+                raise Exception(f"Aggregation of interval_{interval} failed for {','.join(ticker.ticker for ticker in batch)}")
+            frames.append(df)
+        if len(frames) == 0:
+            return pd.DataFrame(columns=["ticker","timestamp"]+list(aggregations))
+        return pd.concat(frames,ignore_index=True) if len(frames) > 1 else frames[0]
+    
+    def query_frame(self,query:str,dtype:dict[str,str]=COLUMN_DTYPES)-> pd.DataFrame|None:
+        """
+        Streams the result of the query from the csv export endpoint into a typed DataFrame.
+        Known columns get the dtypes of the interval tables and the timestamp is parsed vectorized (naive UTC, like the json results).
+        """
+        response = self.raw_export(query)
+        try:
+            if response.status_code != 200:
+                return None
+            response.raw.decode_content = True
+            df = pd.read_csv(response.raw,engine="pyarrow",dtype=dtype)
+        finally:
+            #release the connection back to the pool
+            response.close()
+        if "timestamp" in df.columns:
+            df["timestamp"] = pd.to_datetime(df["timestamp"],format="%Y-%m-%dT%H:%M:%S.%fZ",utc=True).dt.tz_convert(None)
+        return df
+    
+    def _query_url(self,query:str,endpoint:str="exec")-> str:
+        return f"http://{self.host}:{self.port}/{endpoint}?query=" + requests.utils.quote(query)
+    
     def raw_query(self,query:str)-> Response:
-        return requests.get(f"http://{self.host}:{self.port}/exec?query=" + requests.utils.quote(query))
+        start = time.perf_counter()
+        try:
+            return self.session.get(self._query_url(query),timeout=self.timeout)
+        finally:
+            QUERY_SECONDS.observe(time.perf_counter()-start,endpoint="exec")
+    
+    def raw_export(self,query:str)-> Response:
+        #only measures the time until the export starts streaming
+        start = time.perf_counter()
+        try:
+            return self.session.get(self._query_url(query,"exp"),stream=True,timeout=self.timeout)
+        finally:
+            QUERY_SECONDS.observe(time.perf_counter()-start,endpoint="exp")
                      
 if __name__ == "__main__":
     questClient = QuestClient()
@@ -0,0 +1,114 @@
+import os
+import time
+import logging
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from finance_stock_scraper.CompleteBarsDataProvider import CompleteBarsDataProvider
+from finance_stock_scraper.model.Ticker import Ticker
+from finance_stock_scraper.Metrics import JOB_SECONDS, LAST_SUCCESS
+from finance_stock_scraper.workflow import CONFIGURED_INTERVALS, gather_interval, prepare_interval
+
+WORKERS = int(os.getenv('STOCKSCRAPER_WORKERS',4)) # (exchange, interval) jobs running at the same time
+
+class JobResult(object):
+    def __init__(self,exchange:str,interval:str,duration:float,error:Exception|None=None) -> None:
+        self.exchange = exchange
+        self.interval = interval
+        self.duration = duration
+        self.error = error
+
+    @property
+    def succeeded(self)->bool:
+        return self.error is None
+
+class TickerSelection(object):
+    """
+    Read-only ticker repository that only knows the given tickers
+    """
+    def __init__(self,tickers:list[Ticker]) -> None:
+        self._tickers:dict[str,list[Ticker]] = {}
+        for ticker in tickers:
+            self._tickers.setdefault(ticker.exchange,[]).append(ticker)
+
+    def get_exchanges(self)->list[str]:
+        return list(self._tickers)
+
+    def get_tickers(self,exchange:str)->list[Ticker]:
+        return self._tickers.get(exchange,[])
+
+class Scheduler(object):
+    """
+    Runs the (exchange, interval) jobs of a gathering run concurrently on a worker pool.
+    Concurrent downloads and writes are capped by the YFDataProvider and the ExecutionContext.
+    """
+    def __init__(self,executionContext:ExecutionContext,workers:int=WORKERS,intervals:list[str]=CONFIGURED_INTERVALS) -> None:
+        self.executionContext = executionContext
+        self.workers = workers
+        self.intervals = intervals
+
+    def _run_job(self,exchange:str,interval:str,now:datetime)->JobResult:
+        start = time.perf_counter()
+        try:
+            gather_interval(exchange,interval,self.executionContext,now)
+            result = JobResult(exchange,interval,time.perf_counter()-start)
+            LAST_SUCCESS.set(time.time(),exchange=exchange,interval=interval)
+        except Exception as e:
+            logging.error(f"Job {exchange} - {interval} failed: {e}")
+            logging.debug(traceback.format_exc())
+            result = JobResult(exchange,interval,time.perf_counter()-start,e)
+        JOB_SECONDS.observe(result.duration,exchange=exchange,interval=interval,status="succeeded" if result.succeeded else "failed")
+        return result
+
+    def run_jobs(self,jobs:list[tuple[str,str]],now:datetime)->list[JobResult]:
+        """
+        Runs the given (exchange, interval) jobs on the worker pool. The intervals have to be prepared already.
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers,thread_name_prefix="gather") as executor:
+            futures = [executor.submit(self._run_job,exchange,interval,now) for exchange,interval in jobs]
+            for future in as_completed(futures):
+                results.append(future.result())
+        return results
+
+    def run(self,exchanges:list[str],now:datetime)->list[JobResult]:
+        """
+        Gathers all intervals of the given exchanges and returns the result of every job
+        """
+        results = []
+        if len(exchanges) == 0:
+            return results
+        try:
+            #prepare the intervals up front so concurrent jobs don't race on them, the jobs of an interval that can't be prepared are skipped
+            intervals = []
+            for interval in self.intervals:
+                try:
+                    prepare_interval(interval,self.executionContext)
+                    intervals.append(interval)
+                except Exception as e:
+                    logging.error(f"Preparing interval {interval} failed, skipping its jobs: {e}")
+                    logging.debug(traceback.format_exc())
+
+            results = self.run_jobs([(exchange,interval) for exchange in exchanges for interval in intervals],now)
+        finally:
+            #there is nothing to ingest until the next run => release the ILP connection
+            self.executionContext.questClient.close_ingestion()
+
+        for result in sorted(results,key=lambda result:result.duration,reverse=True):
+            status = "finished" if result.succeeded else f"failed ({result.error})"
+            logging.info(f"Job {result.exchange} - {result.interval} {status} in {result.duration:.1f}s")
+        if self.executionContext.failureRegistry is not None:
+            for kind,stats in self.executionContext.failureRegistry.report().items():
+                logging.info(f"Failing tickers ({kind}): {stats['tickers']}, skipped downloads so far: {stats['skipped']}")
+        return results
+
+    def backfill(self,tickers:list[Ticker],now:datetime)->list[JobResult]:
+        """
+        Runs the jobs of the given tickers only (e.g. tickers added by a reload), tickers without data take the backfill path.
+        Bars that are still in progress are dropped, so the regular runs continue from complete bars.
+        """
+        executionContext = ExecutionContext(TickerSelection(tickers),CompleteBarsDataProvider(self.executionContext.yfDataProcider),self.executionContext.questClient,
+                                            watermarkStore=self.executionContext.watermarkStore,failureRegistry=self.executionContext.failureRegistry)
+        selection = Scheduler(executionContext,self.workers,self.intervals)
+        return selection.run(executionContext.tickerRepository.get_exchanges(),now)
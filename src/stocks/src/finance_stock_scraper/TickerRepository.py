@@ -1,16 +1,39 @@
-from finance_stock_scraper.QuestClient import QuestClient
+from finance_stock_scraper.QuestClient import QuestClient, PAGE_SIZE, OHLCV_AGGREGATIONS, PANEL_DTYPES
 from finance_stock_scraper.model.Ticker import Ticker
+from finance_stock_scraper.ParquetCache import ParquetCache, CACHE_DIR, CACHED_COLUMNS
 import os
+import hashlib
+import numpy as np
 import pandas as pd
+import pytz
 from datetime import datetime
+from typing import Iterable, Iterator
 import logging
 
+READ_MODE = os.getenv('STOCKSCRAPER_READ_MODE',"JSON").upper() # JSON (/exec) or CSV (/exp)
+
 class TickerRepository(object):
-    exchanges:dict[str,dict[str,Ticker]]
-    
-    def __init__(self,quest_client:QuestClient) -> None:
-        self.exchanges = {}
+    """
+    Registry of all tickers. Tickers are stored once in a list (their id is the position), an index maps each (exchange, symbol)
+    to its id, a global index maps each symbol to the (ordered) ids of its listings and every exchange keeps the (ordered) ids of its tickers.
+    The same symbol can be listed on several exchanges, the slots of removed tickers are reused.
+    """
+    def __init__(self,quest_client:QuestClient,read_mode:str=READ_MODE,cache:ParquetCache|None=None) -> None:
+        self._tickers:list[Ticker|None] = []
+        self._index:dict[tuple[str,str],int] = {}
+        self._symbols:dict[str,dict[int,None]] = {}
+        self._free:list[int] = []
+        self._members:dict[str,dict[int,None]] = {}
+        #ticker file => (mtime,size,hash) and the tickers it contributed
+        self._files:dict[str,tuple[int,int,str]] = {}
+        self._file_tickers:dict[str,dict[str,Ticker]] = {}
+        #(exchange, symbol) => number of ticker files listing it
+        self._references:dict[tuple[str,str],int] = {}
         self.quest_client = quest_client
+        self.read_mode = read_mode.upper()
+        if cache is None and CACHE_DIR:
+            cache = ParquetCache(CACHE_DIR)
+        self.cache = cache
         
     def load_tickers(self,directory:str)->None:
         """
@@ -21,32 +44,126 @@ class TickerRepository(object):
             logging.error("Found no *.csv files in the Tickers Directory!")
              
         logging.debug(f"Found files: {','.join(files)}")
-                          
-        for file in files:
-            file = os.path.join(directory,file)
-            exchange = os.path.basename(file).split('.')[0].upper()
-            tickers = pd.read_csv(file)
-            for ticker in tickers.values:
-                if ticker[0] is not None and isinstance(ticker[0],str):
-                    self.add_ticker(Ticker(ticker[0],exchange))
+        self.reload_tickers(directory)
+        
+    def _read_ticker_file(self,file:str)->list[Ticker]:
+        exchange = os.path.basename(file).split('.')[0].upper()
+        tickers = pd.read_csv(file)
+        return [Ticker(ticker[0],exchange) for ticker in tickers.values if ticker[0] is not None and isinstance(ticker[0],str)]
+    
+    def reload_tickers(self,directory:str)->tuple[list[Ticker],list[Ticker]]:
+        """
+        Re-parses the *.csv files that were added, changed (mtime/size, confirmed by their hash) or deleted since the last call
+        and applies the difference to the registry. Returns the added and the removed tickers.
+        """
+        paths = [os.path.join(directory,file) for file in os.listdir(directory) if file.endswith(".csv")]
+        to_add:list[Ticker] = []
+        to_remove:list[Ticker] = []
+        for path in set(self._files)-set(paths):
+            #the file was deleted => all of its tickers are gone
+            to_remove.extend(self._file_tickers.pop(path).values())
+            del self._files[path]
+            
+        for path in paths:
+            stat = os.stat(path)
+            known = self._files.get(path)
+            if known is not None and known[:2] == (stat.st_mtime_ns,stat.st_size):
+                continue
+            with open(path,"rb") as file:
+                digest = hashlib.sha1(file.read()).hexdigest()
+            self._files[path] = (stat.st_mtime_ns,stat.st_size,digest)
+            if known is not None and known[2] == digest:
+                continue
+            
+            tickers = {ticker.ticker:ticker for ticker in self._read_ticker_file(path)}
+            previous = self._file_tickers.get(path,{})
+            to_remove.extend(ticker for symbol,ticker in previous.items() if symbol not in tickers)
+            to_add.extend(ticker for symbol,ticker in tickers.items() if symbol not in previous)
+            self._file_tickers[path] = tickers
+        
+        #several files can list a ticker => it is only removed once no file lists it anymore (and a ticker that moved to another file survives)
+        changes:dict[Ticker,int] = {}
+        for ticker in to_remove:
+            changes[ticker] = changes.get(ticker,0)-1
+        for ticker in to_add:
+            changes[ticker] = changes.get(ticker,0)+1
+        added,removed = [],[]
+        for ticker,change in changes.items():
+            key = (ticker.exchange,ticker.ticker)
+            count = self._references.get(key,0)
+            if count+change > 0:
+                self._references[key] = count+change
+            else:
+                self._references.pop(key,None)
+            if count == 0 and count+change > 0:
+                if key not in self._index:
+                    added.append(ticker)
+                self.add_ticker(ticker)
+            elif count > 0 and count+change <= 0 and self.remove(ticker.ticker,ticker.exchange):
+                removed.append(ticker)
+        if len(added) > 0 or len(removed) > 0:
+            logging.info(f"Reloaded tickers: {len(added)} added, {len(removed)} removed")
+        return added,removed
                 
     def add_ticker(self,ticker:Ticker)->None:
-        if ticker.exchange not in self.exchanges:
-             self.exchanges[ticker.exchange] = {}
-        self.exchanges[ticker.exchange][ticker.ticker] = ticker
+        key = (ticker.exchange,ticker.ticker)
+        id = self._index.get(key)
+        if id is None:
+            if len(self._free) > 0:
+                id = self._free.pop()
+            else:
+                id = len(self._tickers)
+                self._tickers.append(None)
+            self._index[key] = id
+            self._symbols.setdefault(ticker.ticker,{})[id] = None
+            self._members.setdefault(ticker.exchange,{})[id] = None
+        self._tickers[id] = ticker
+        
+    @property
+    def exchanges(self)->dict[str,dict[str,Ticker]]:
+        """
+        Snapshot of the tickers grouped by exchange
+        """
+        return {exchange:{self._tickers[id].ticker:self._tickers[id] for id in ids} for exchange,ids in self._members.items()}
+    
+    def get_exchanges(self)->list[str]:
+        return [exchange for exchange,ids in self._members.items() if len(ids) > 0]
+    
+    def get_tickers(self,exchange:str)->list[Ticker]:
+        return [self._tickers[id] for id in self._members.get(exchange.upper(),{})]
         
+    def lookup(self,ticker:str,exchange:str|None=None)->tuple[str,int]|None:
+        """
+        Exchange and id of a symbol or None if it is unknown. Without an exchange the first added listing of the symbol is used.
+        """
+        if exchange is not None:
+            exchange = exchange.upper()
+            id = self._index.get((exchange,ticker.upper()))
+            return (exchange,id) if id is not None else None
+        ids = self._symbols.get(ticker.upper())
+        if not ids:
+            return None
+        id = next(iter(ids))
+        return self._tickers[id].exchange,id
         
-    def get_ticker(self,ticker:str)->Ticker|None:
-        found_ticker = None
-        ticker = ticker.upper()
-        for exchage in self.exchanges:
-            if ticker in self.exchanges[exchage]:
-                found_ticker = self.exchanges[exchage][ticker]
-                break 
-        return found_ticker
+    def get_ticker(self,ticker:str,exchange:str|None=None)->Ticker|None:
+        found = self.lookup(ticker,exchange)
+        return self._tickers[found[1]] if found is not None else None
     
+    def difference(self,exchange:str,existing:Iterable[str])->list[Ticker]:
+        """
+        Tickers of the exchange whose symbols are not in `existing`
+        """
+        existing = existing if isinstance(existing,(set,frozenset,dict)) else set(existing)
+        return [ticker for ticker in self.get_tickers(exchange) if ticker.ticker not in existing]
+    
+    def __len__(self)->int:
+        return len(self._index)
     
     def _get_single_value(self,ticker:Ticker,interval:str,values:list[str]=["close"],start_time:datetime|None=None,end_time:datetime|None=None)->pd.DataFrame|None:
+        if self.read_mode == "CSV":
+            return self.quest_client.get_frame(ticker,interval,values,start_time,end_time)
+        
         df = None
         result = self.quest_client.get_data(ticker,interval,values,start_time,end_time)
         if result:
@@ -59,25 +176,159 @@ class TickerRepository(object):
     
     def _get_multiple_values(self,tickers:list[Ticker],interval:str,values:list[str]=["close"],start_time:datetime|None=None,end_time:datetime|None=None)->dict[str,pd.DataFrame]:
         dataframes = {}
-        for ticker in tickers:
-            df = self._get_single_value(ticker,interval,values,start_time,end_time)
-            if df is not None:
-                dataframes[ticker.ticker] = df
-        return dataframes
+        if self.read_mode == "CSV":
+            results = self.quest_client.get_frames_for_tickers(tickers,interval,values,start_time,end_time)
+        else:
+            results = self.quest_client.get_data_for_tickers(tickers,interval,values,start_time,end_time)
+            
+        for batch,result in results:
+            if result is None:
+                continue
+            if isinstance(result,pd.DataFrame):
+                df = result
+            else:
+                df = pd.DataFrame(result['dataset'],columns=["ticker","timestamp"]+values)
+                df["timestamp"] = pd.to_datetime(df["timestamp"],format="%Y-%m-%dT%H:%M:%S.%fZ")
+            df = df.set_index("timestamp")
+            df.index.name = None
+            groups = dict(tuple(df.groupby("ticker",sort=False,observed=True)))
+            for ticker in batch:
+                if ticker.ticker in groups:
+                    dataframes[ticker.ticker] = groups[ticker.ticker][values]
+                else:
+                    dataframes[ticker.ticker] = pd.DataFrame(columns=values)
+        #keep the order of the requested tickers
+        return {ticker.ticker:dataframes[ticker.ticker] for ticker in tickers if ticker.ticker in dataframes}
+    
+    def _get_cached_values(self,tickers:list[Ticker],interval:str,values:list[str]=["close"],start_time:datetime|None=None,end_time:datetime|None=None)->dict[str,pd.DataFrame]:
+        """
+        Reads the tickers through the local cache and only fetches the ranges that are not cached yet from QuestDB.
+        The ranges of a ticker are only marked as covered up to its own last row, so rows of tickers that are ingested
+        or backfilled later are fetched again (a ticker without rows isn't cached at all).
+        """
+        latest = self.quest_client.get_latest_timestamp(interval)
+        self.cache.validate(interval,latest.replace(tzinfo=None) if latest else None)
+        start = self._to_naive_utc(start_time) if start_time else datetime(1970,1,1)
+        end = self._to_naive_utc(end_time) if end_time else datetime.utcnow()
+        covered_end = min(end,latest.replace(tzinfo=None)) if latest else None
+        
+        #group the tickers by their missing ranges to fetch them with bulk reads
+        missing_ranges:dict[tuple[datetime,datetime],list[Ticker]] = {}
+        if covered_end is not None and start <= covered_end:
+            for ticker in tickers:
+                for missing in self.cache.missing(interval,ticker.exchange,ticker.ticker,start,covered_end):
+                    missing_ranges.setdefault(missing,[]).append(ticker)
+                    
+        for (missing_start,missing_end),batch in missing_ranges.items():
+            fetched = self._get_multiple_values(batch,interval,CACHED_COLUMNS,missing_start,missing_end)
+            for ticker in batch:
+                df = fetched.get(ticker.ticker)
+                if df is not None and len(df) > 0:
+                    self.cache.store(interval,ticker.exchange,ticker.ticker,df,missing_start,min(missing_end,df.index.max().to_pydatetime()))
+                    
+        #rows newer than the latest timestamp can't exist yet, everything else is served from the cache
+        result = {ticker.ticker:self.cache.load(interval,ticker.exchange,ticker.ticker,start,end,values) for ticker in tickers}
+        self.cache.evict()
+        return result
+    
+    def _to_naive_utc(self,time:datetime)->datetime:
+        if time.tzinfo is not None:
+            return time.astimezone(pytz.UTC).replace(tzinfo=None)
+        return time
     
     def get_values(self,tickers:list[Ticker]|Ticker,interval:str,values:list[str]=["close"],start_time:datetime|None=None,end_time:datetime|None=None)->pd.DataFrame|dict[str,pd.DataFrame]|None:
+        if self.cache is not None:
+            if isinstance(tickers,list):
+                return self._get_cached_values(tickers,interval,values,start_time,end_time)
+            return self._get_cached_values([tickers],interval,values,start_time,end_time)[tickers.ticker]
+        
         if isinstance(tickers,list):
             return self._get_multiple_values(tickers,interval,values,start_time,end_time)
         else:
             return self._get_single_value(tickers,interval,values,start_time,end_time)
+
+    def get_panel(self,tickers:list[Ticker],interval:str,values:list[str]=["close"],start_time:datetime|None=None,end_time:datetime|None=None,layout:str="wide")->pd.DataFrame:
+        """
+        Reads the tickers into one frame instead of a dict of frames. Prices are float32 like in the interval tables, ticker and exchange are categorical.
+        layout="long": rows of (exchange, ticker, timestamp, values) in the order of the query results.
+        layout="wide": a frame indexed by the union of all timestamps with (value, ticker) columns, missing bars are NaN (volume becomes float64).
+        The wide layout needs unique symbols, a symbol listed on several exchanges can only be read in the long layout.
+        Both are built from the typed query results without intermediate per ticker frames. Bypasses the cache.
+        """
+        layout = layout.lower()
+        if layout not in ("wide","long"):
+            raise ValueError(f"Unknown layout {layout}, use wide or long")
+        symbols = list(dict.fromkeys(ticker.ticker for ticker in tickers))
+        if layout == "wide":
+            listings = {}
+            for ticker in dict.fromkeys(tickers):
+                listings[ticker.ticker] = listings.get(ticker.ticker,0)+1
+            duplicates = [symbol for symbol,count in listings.items() if count > 1]
+            if len(duplicates) > 0:
+                raise ValueError(f"The wide layout is keyed by symbol, {','.join(duplicates)} requested on several exchanges (use the long layout)")
+        exchanges = sorted({ticker.exchange for ticker in tickers})
+        frames = []
+        for batch,df in self.quest_client.get_frames_for_tickers(tickers,interval,values,start_time,end_time,dtype=PANEL_DTYPES):
+            if df is None or len(df) == 0:
+                continue
+            #shared categories keep the columns categorical through the concat
+            df["ticker"] = df["ticker"].astype("category").cat.set_categories(symbols)
+            df.insert(0,"exchange",pd.Categorical.from_codes(np.full(len(df),exchanges.index(batch[0].exchange),dtype=np.int8),categories=exchanges))
+            frames.append(df)
+        if len(frames) == 0:
+            long = pd.DataFrame({"exchange":pd.Categorical([],categories=exchanges),"ticker":pd.Categorical([],categories=symbols),
+                                 "timestamp":pd.Series([],dtype="datetime64[ns]"),**{value:pd.Series([],dtype=PANEL_DTYPES.get(value,"float64")) for value in values}})
+        else:
+            long = pd.concat(frames,ignore_index=True,copy=False) if len(frames) > 1 else frames[0]
+        if layout == "long":
+            return long
         
-    def remove(self,ticker:str)->bool:
-        ticker = ticker.upper()
-        for exchage in self.exchanges:
-            if ticker in self.exchanges[exchage]:
-                self.exchanges[exchage].pop(ticker)
-                return True
-        return False
+        long = long[long["ticker"].cat.codes.to_numpy() >= 0]
+        timestamps,rows = np.unique(long["timestamp"].to_numpy(),return_inverse=True)
+        columns = long["ticker"].cat.codes.to_numpy()
+        blocks = []
+        for value in values:
+            dtype = np.float32 if long[value].dtype == np.float32 else np.float64
+            block = np.full((len(timestamps),len(symbols)),np.nan,dtype=dtype)
+            block[rows,columns] = long[value].to_numpy()
+            blocks.append(pd.DataFrame(block,index=pd.DatetimeIndex(timestamps),columns=symbols,copy=False))
+        return pd.concat(blocks,axis=1,keys=values,copy=False)
+    
+    def get_aggregated(self,tickers:list[Ticker]|Ticker,interval:str,sample_by:str,aggregations:dict[str,str]=OHLCV_AGGREGATIONS,start_time:datetime|None=None,end_time:datetime|None=None,fill:str="NONE")->pd.DataFrame|dict[str,pd.DataFrame]:
+        """
+        Time-bucket aggregation of the values computed by QuestDB (SAMPLE BY), e.g. weekly closes with sample_by="7d" and {"close":"last(close)"}
+        or hourly VWAP of a 5m table with sample_by="1h" and {"vwap":"vwap"}. Returns the same shapes as `get_values`.
+        """
+        requested = tickers if isinstance(tickers,list) else [tickers]
+        df = self.quest_client.get_aggregated(requested,interval,sample_by,aggregations,start_time,end_time,fill)
+        df = df.set_index("timestamp")
+        df.index.name = None
+        groups = dict(tuple(df.groupby(df["ticker"].astype(str),sort=False)))
+        columns = list(aggregations)
+        dataframes = {ticker.ticker:groups[ticker.ticker][columns] if ticker.ticker in groups else pd.DataFrame(columns=columns) for ticker in requested}
+        return dataframes if isinstance(tickers,list) else dataframes[tickers.ticker]
+
+    def iter_values(self,tickers:list[Ticker]|Ticker,interval:str,values:list[str]=["close"],start_time:datetime|None=None,end_time:datetime|None=None,page_size:int=PAGE_SIZE)->Iterator[pd.DataFrame]:
+        """
+        Streams the values as pages of at most `page_size` rows in long format (ticker, timestamp, values) for histories that don't fit into memory.
+        Bypasses the cache.
+        """
+        return self.quest_client.iter_frames(tickers,interval,values,start_time,end_time,page_size)
+
+    def remove(self,ticker:str,exchange:str|None=None)->bool:
+        found = self.lookup(ticker,exchange)
+        if found is None:
+            return False
+        exchange,id = found
+        symbol = self._tickers[id].ticker
+        del self._index[(exchange,symbol)]
+        self._symbols[symbol].pop(id,None)
+        if len(self._symbols[symbol]) == 0:
+            del self._symbols[symbol]
+        self._members[exchange].pop(id,None)
+        self._tickers[id] = None
+        self._free.append(id)
+        return True
 
                 
 if __name__ == "__main__":
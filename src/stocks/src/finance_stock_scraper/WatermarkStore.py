@@ -0,0 +1,91 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+import pandas as pd
+from datetime import datetime
+
+WATERMARK_DB = os.getenv('STOCKSCRAPER_WATERMARK_DB',None) # SQLite file of the watermark store (defaults to the data directory)
+WATERMARK_MAX_AGE = float(os.getenv('STOCKSCRAPER_WATERMARK_MAX_AGE',7*24*60*60)) # Seconds after which the watermarks of an (exchange, interval) are rebuilt from QuestDB
+
+class WatermarkStore(object):
+    """
+    Persistent record of the last ingested timestamp per (interval, exchange, ticker).
+    Watermarks are staged while points are written and only committed once the ingestion was flushed.
+    """
+    def __init__(self,path:str=WATERMARK_DB,max_age:float=WATERMARK_MAX_AGE) -> None:
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._staged:dict[tuple[str,str],dict[str,int]] = {}
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self._connection = sqlite3.connect(path,check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS watermarks (interval TEXT, exchange TEXT, ticker TEXT, timestamp INTEGER, PRIMARY KEY (interval, exchange, ticker))")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS synced (interval TEXT, exchange TEXT, rebuilt REAL, PRIMARY KEY (interval, exchange))")
+
+    def needs_rebuild(self,interval:str,exchange:str)->bool:
+        with self._lock:
+            row = self._connection.execute("SELECT rebuilt FROM synced WHERE interval = ? AND exchange = ?",(interval,exchange)).fetchone()
+        return row is None or time.time()-row[0] > self.max_age
+
+    def rebuild(self,interval:str,exchange:str,last_entries:dict[str,datetime])->None:
+        """
+        Replaces the watermarks of the (interval, exchange) with the last entries found in QuestDB
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM watermarks WHERE interval = ? AND exchange = ?",(interval,exchange))
+            self._connection.executemany("INSERT INTO watermarks VALUES (?, ?, ?, ?)",[(interval,exchange,ticker,pd.Timestamp(timestamp).value) for ticker,timestamp in last_entries.items()])
+            self._connection.execute("INSERT OR REPLACE INTO synced VALUES (?, ?, ?)",(interval,exchange,time.time()))
+        logging.info(f"Rebuilt {len(last_entries)} watermarks of {exchange} - {interval}")
+
+    def validate(self,interval:str,latest:datetime|None)->None:
+        """
+        Drops the watermarks of the interval if they are ahead of the table (e.g. the table was emptied or rebuilt)
+        """
+        with self._lock, self._connection:
+            known = self._connection.execute("SELECT max(timestamp) FROM watermarks WHERE interval = ?",(interval,)).fetchone()[0]
+            if known is not None and (latest is None or known > pd.Timestamp(latest).value):
+                logging.info(f"Watermarks of interval_{interval} are ahead of the table, dropping them")
+                self._connection.execute("DELETE FROM watermarks WHERE interval = ?",(interval,))
+                self._connection.execute("DELETE FROM synced WHERE interval = ?",(interval,))
+
+    def get(self,interval:str,exchange:str)->dict[str,datetime]:
+        with self._lock:
+            rows = self._connection.execute("SELECT ticker, timestamp FROM watermarks WHERE interval = ? AND exchange = ?",(interval,exchange)).fetchall()
+        return {ticker:pd.Timestamp(timestamp,tz="UTC").to_pydatetime() for ticker,timestamp in rows}
+
+    def stage(self,interval:str,exchange:str,latest:dict[str,datetime])->None:
+        """
+        Remembers the latest written timestamp of each ticker until the ingestion is committed
+        """
+        with self._lock:
+            staged = self._staged.setdefault((interval,exchange),{})
+            for ticker,timestamp in latest.items():
+                timestamp = pd.Timestamp(timestamp).value
+                staged[ticker] = max(staged.get(ticker,timestamp),timestamp)
+
+    def commit(self,interval:str,exchange:str)->int:
+        """
+        Persists the staged watermarks of the (interval, exchange), the watermarks only move forward
+        """
+        with self._lock, self._connection:
+            staged = self._staged.pop((interval,exchange),{})
+            self._connection.executemany(
+                "INSERT INTO watermarks VALUES (?, ?, ?, ?) ON CONFLICT (interval, exchange, ticker) DO UPDATE SET timestamp = max(timestamp, excluded.timestamp)",
+                [(interval,exchange,ticker,timestamp) for ticker,timestamp in staged.items()])
+        return len(staged)
+
+    def invalidate(self,interval:str,exchange:str)->None:
+        """
+        Discards the staged watermarks and forces a rebuild of the (interval, exchange) on its next use
+        """
+        with self._lock, self._connection:
+            self._staged.pop((interval,exchange),None)
+            self._connection.execute("DELETE FROM synced WHERE interval = ? AND exchange = ?",(interval,exchange))
+
+    def close(self)->None:
+        with self._lock:
+            self._connection.close()
@@ -1,24 +1,85 @@
+import os
+import re
+import time
 import datetime
+import logging
+import threading
 import pandas as pd
-import yfinance as yf
-from yfinance import shared
+from finance_stock_scraper.lazy import LazyModule
+from typing import Iterator
+from finance_stock_scraper.Metrics import DOWNLOAD_SECONDS
+
+yf = LazyModule("yfinance")
+
+BATCH_SIZE = int(os.getenv('STOCKSCRAPER_DOWNLOAD_BATCH_SIZE',500)) # Tickers per yf.download call (caps memory)
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('STOCKSCRAPER_MAX_CONCURRENT_DOWNLOADS',2)) # yf.download calls running at the same time
+
+NO_DATA_ERROR = "No data returned, symbol may be delisted"
+
+class ErrorCollector(logging.Handler):
+    """
+    Collects the reasons yfinance logs for the failed tickers of a download ("['A', 'B']: error").
+    Only used to classify the failures, which tickers failed is read from the returned frame.
+    """
+    def __init__(self,tickers:list[str]) -> None:
+        super().__init__(logging.ERROR)
+        self.tickers = {ticker.upper() for ticker in tickers}
+        self.errors:dict[str,str] = {}
+
+    def emit(self,record:logging.LogRecord)->None:
+        match = re.match(r"\[([^\]]*)\]: (.*)",record.getMessage(),re.S)
+        if match is None:
+            return
+        for symbol in re.findall(r"'([^']*)'",match.group(1)):
+            if symbol in self.tickers:
+                self.errors.setdefault(symbol,match.group(2))
 
 class YFDataProvider(object):
-    def __init__(self) -> None:
-        pass
-    
-    def get_data(self,tickers:list[str],start_date:datetime.datetime,end_date:datetime.datetime,interval:str)->tuple[pd.DataFrame,dict]:
-        if len(tickers) < 1:
-            return None
+    def __init__(self,batch_size:int=BATCH_SIZE,max_concurrent_downloads:int=MAX_CONCURRENT_DOWNLOADS) -> None:
+        self.batch_size = batch_size
+        self._download_slots = threading.BoundedSemaphore(max_concurrent_downloads)
         
-        ticker_string = " ".join(tickers)
-        data = yf.download(ticker_string, start_date, end_date, interval=interval, threads=True, group_by = 'ticker', progress=True)
-        return data,shared._ERRORS
+    def _batches(self,tickers:list[str])->Iterator[list[str]]:
+        for i in range(0,len(tickers),self.batch_size):
+            yield tickers[i:i+self.batch_size]
+            
+    def _download(self,tickers:list[str],**kwargs)->tuple[pd.DataFrame,dict]:
+        with self._download_slots:
+            start = time.perf_counter()
+            collector = ErrorCollector(tickers)
+            logger = logging.getLogger("yfinance")
+            logger.addHandler(collector)
+            try:
+                data = yf.download(" ".join(tickers), threads=True, group_by = 'ticker', progress=True, **kwargs)
+            finally:
+                logger.removeHandler(collector)
+            DOWNLOAD_SECONDS.observe(time.perf_counter()-start,interval=kwargs.get("interval",""))
+        if len(tickers) == 1 and not isinstance(data.columns,pd.MultiIndex):
+            #a single ticker is not grouped by yfinance
+            data.columns = pd.MultiIndex.from_product([tickers,data.columns])
+        return data,self._failures(data,tickers,collector.errors)
 
-    def get_data_from_period(self,tickers:list[str],interval:str,period:str="max")->tuple[pd.DataFrame,dict]:
-        if len(tickers) < 1:
-            return None
-        
-        ticker_string = " ".join(tickers)
-        data = yf.download(ticker_string, period = period, interval=interval, threads=True, group_by = 'ticker', progress=True)
-        return data,shared._ERRORS
\ No newline at end of file
+    def _failures(self,data:pd.DataFrame,tickers:list[str],reasons:dict[str,str])->dict[str,str]:
+        """
+        Tickers of the batch without a single value in the returned frame (yfinance fills failed tickers with NaN columns)
+        """
+        if len(data.columns) > 0:
+            returned = data.notna().any().groupby(level=0).any()
+            returned = set(returned.index[returned])
+        else:
+            returned = set()
+        return {ticker:reasons.get(ticker.upper(),NO_DATA_ERROR) for ticker in tickers if ticker not in returned}
+    
+    def get_data(self,tickers:list[str],start_date:datetime.datetime,end_date:datetime.datetime,interval:str)->Iterator[tuple[pd.DataFrame,dict]]:
+        """
+        Downloads the tickers in batches of `batch_size` and yields the frame and the errors of each batch
+        """
+        for batch in self._batches(tickers):
+            yield self._download(batch, start=start_date, end=end_date, interval=interval)
+
+    def get_data_from_period(self,tickers:list[str],interval:str,period:str="max")->Iterator[tuple[pd.DataFrame,dict]]:
+        """
+        Downloads the tickers in batches of `batch_size` and yields the frame and the errors of each batch
+        """
+        for batch in self._batches(tickers):
+            yield self._download(batch, period = period, interval=interval)
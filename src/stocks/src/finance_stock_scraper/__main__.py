@@ -1,7 +1,6 @@
 import time
 import os
 import pytz
-import pandas_market_calendars as mcal
 import logging
 from datetime import datetime, timedelta
 from finance_stock_scraper.ExecutionContext import ExecutionContext
@@ -9,13 +8,20 @@ from finance_stock_scraper.QuestClient import QuestClient
 from finance_stock_scraper.TickerRepository import TickerRepository
 from finance_stock_scraper.YFDataProvider import YFDataProvider
 from finance_stock_scraper.model.Ticker import Ticker
-from finance_stock_scraper.workflow import gather_data
+from finance_stock_scraper.model.MarketSchedule import SCHEDULE_CACHE
+from finance_stock_scraper.Scheduler import Scheduler
+from finance_stock_scraper.LivePoller import LivePoller
+from finance_stock_scraper.WatermarkStore import WatermarkStore, WATERMARK_DB
+from finance_stock_scraper.FailureRegistry import FailureRegistry, FAILURE_DB
+from finance_stock_scraper.IngestionSpool import SPOOL_DIR
+from finance_stock_scraper.Metrics import METRICS, METRICS_PORT, MetricsServer
 
 
 
 TICKERS_DIR = os.path.abspath(os.getenv('STOCKSCRAPER_TICKERS_DIR',"../../../Tickers"))
+DATA_DIR = os.path.abspath(os.getenv('STOCKSCRAPER_DATA_DIR',"../../../storage/stock-scraper")) # State of the scraper (spool, watermarks, failures), kept out of the tickers directory
 DEBUG = os.getenv('STOCKSCRAPER_DEBUG',"False").upper() == "TRUE"
-MODE = os.getenv('STOCKSCRAPER_MODE',"Single").upper() # Single or Scheduled
+MODE = os.getenv('STOCKSCRAPER_MODE',"Single").upper() # Single, Scheduled or Live
 SLEEP_TIME = int(os.getenv('STOCKSCRAPER_SLEEPTIME',60*60*3)) # 3 hours
 
 if __name__ == "__main__":
@@ -30,11 +36,21 @@ if __name__ == "__main__":
         
     logging.info(f"---Starting Scraper---")
     logging.info(f"TICKERS_DIR:{TICKERS_DIR}")
+    logging.info(f"DATA_DIR:{DATA_DIR}")
     logging.info(f"MODE:{MODE}")
     logging.info(f"SLEEP_TIME:{SLEEP_TIME}")
+    
+    if METRICS_PORT > 0:
+        MetricsServer(METRICS).start()
         
-    # Create QuestClient
-    questClient = QuestClient()
+    if not os.path.isdir(TICKERS_DIR):
+        raise Exception(f"Tickers Directory '{TICKERS_DIR}' does not exist!")
+    os.makedirs(DATA_DIR,exist_ok=True)
+    
+    # Create QuestClient, points that can't be written are spooled and replayed later
+    spool_dir = SPOOL_DIR or os.path.join(DATA_DIR,"spool")
+    logging.info(f"SPOOL_DIR:{spool_dir}")
+    questClient = QuestClient(spool_dir=spool_dir)
     retries = 0
     while True:
         if questClient.health_check():
@@ -46,36 +62,55 @@ if __name__ == "__main__":
             
         if retries > 10:
             raise Exception("Could not connect to QuestDB!")
-        
-    if not os.path.isdir(TICKERS_DIR):
-        raise Exception(f"Tickers Directory '{TICKERS_DIR}' does not exist!")
     
     
     ticker_repo = TickerRepository(questClient)
     ticker_repo.load_tickers(TICKERS_DIR)
     
     logging.info("Loaded Tickers:")
-    for exchange in ticker_repo.exchanges:
+    for exchange in ticker_repo.get_exchanges():
         logging.info(f"{exchange}:")
-        logging.info(",".join([ticker for ticker in ticker_repo.exchanges[exchange]]))
+        logging.info(",".join([ticker.ticker for ticker in ticker_repo.get_tickers(exchange)]))
     
     yfDataProvider = YFDataProvider()
     
-    executionContext = ExecutionContext(ticker_repo, yfDataProvider, questClient)
+    watermarkStore = WatermarkStore(WATERMARK_DB or os.path.join(DATA_DIR,"watermarks.sqlite"))
+    logging.info(f"WATERMARK_DB:{watermarkStore.path}")
+    
+    failureRegistry = FailureRegistry(FAILURE_DB or os.path.join(DATA_DIR,"failures.sqlite"))
+    logging.info(f"FAILURE_DB:{failureRegistry.path}")
+    
+    executionContext = ExecutionContext(ticker_repo, yfDataProvider, questClient, watermarkStore=watermarkStore, failureRegistry=failureRegistry)
+    scheduler = Scheduler(executionContext)
 
     # if its in single mode, we will run the gathering process once and then exit
     if MODE == "SINGLE":
-        for exchange in ticker_repo.exchanges:
-            now = datetime.now().astimezone(pytz.utc)
-            gather_data(exchange, executionContext,now)
+        now = datetime.now().astimezone(pytz.utc)
+        scheduler.run(ticker_repo.get_exchanges(), now)
+    elif MODE == "LIVE":
+        # poll the intraday intervals of open exchanges whenever a new bar is complete
+        def get_exchanges()->list[str]:
+            ticker_repo.reload_tickers(TICKERS_DIR)
+            return ticker_repo.get_exchanges()
+        LivePoller(executionContext).run_forever(get_exchanges)
     else:
         # otherwise, we will run the gathering process in a loop
         last_runs = {} 
         while True:
             try:
+                #pick up edited ticker files, new tickers are backfilled right away
+                added,removed = ticker_repo.reload_tickers(TICKERS_DIR)
+                if len(removed) > 0:
+                    logging.info(f"Removed Tickers: {','.join([ticker.ticker for ticker in removed])}")
+                if len(added) > 0:
+                    #new tickers don't wait for the next run of their exchange
+                    logging.info(f"New Tickers: {','.join([ticker.ticker for ticker in added])}, starting their backfill ...")
+                    scheduler.backfill(added, datetime.now().astimezone(pytz.utc))
+
                 #check all exchanges and if we are are after the tradingtimes we start the gathering process
                 now = datetime.now().astimezone(pytz.utc)
-                for exchange in ticker_repo.exchanges:
+                due_exchanges = []
+                for exchange in ticker_repo.get_exchanges():
                     
                     #Check if we already run the gathering process for this exchange today
                     if exchange in last_runs:
@@ -83,20 +118,21 @@ if __name__ == "__main__":
                         if now-last_run < timedelta(hours=23,minutes=45):
                             continue
                         
-                    calender = mcal.get_calendar(exchange)
-                    schedule = calender.schedule(start_date=now, end_date=now)
-                    if len(schedule) == 0:
+                    closing_time = SCHEDULE_CACHE.market_close(exchange,now.date())
+                    if closing_time is None:
                         #Not a trading day => nothing to fetch
                         continue
-                    closing_time = schedule["market_close"][0]
                     #Yahoo Finance can have a delay of 15-30 Minutes for the data  to be available => we add 30 minutes to the closing time
                     closing_time += timedelta(minutes=30)
                     if now > closing_time:
                         #we are after the closing time => we start the gathering process
                         last_runs[exchange] = now
-                        logging.info(f"Starting gathering process for exchange {exchange}...")
-                        gather_data(exchange, executionContext, now)
-                        logging.info(f"Finished gathering process for exchange {exchange}!")
+                        due_exchanges.append(exchange)
+                        
+                if len(due_exchanges) > 0:
+                    logging.info(f"Starting gathering process for exchanges {','.join(due_exchanges)}...")
+                    scheduler.run(due_exchanges, now)
+                    logging.info(f"Finished gathering process for exchanges {','.join(due_exchanges)}!")
                         
                 #sleep for a while
                 logging.info(f"Sleeping for {SLEEP_TIME} Seconds!")
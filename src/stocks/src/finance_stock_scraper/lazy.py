@@ -0,0 +1,38 @@
+import importlib
+from types import ModuleType
+
+class LazyModule(object):
+    """
+    Stand-in for a heavy module that is imported on the first attribute access.
+    Attribute writes are forwarded to the real module, so patching it behaves like patching the import.
+    """
+    def __init__(self,name:str) -> None:
+        object.__setattr__(self,"_name",name)
+        object.__setattr__(self,"_module",None)
+
+    def _load(self)->ModuleType:
+        module = object.__getattribute__(self,"_module")
+        if module is None:
+            #the import system holds a per module lock, concurrent first accesses get the same module
+            module = importlib.import_module(object.__getattribute__(self,"_name"))
+            object.__setattr__(self,"_module",module)
+        return module
+
+    @property
+    def is_loaded(self)->bool:
+        return object.__getattribute__(self,"_module") is not None
+
+    def __getattr__(self,name:str):
+        return getattr(self._load(),name)
+
+    def __setattr__(self,name:str,value)->None:
+        setattr(self._load(),name,value)
+
+    def __delattr__(self,name:str)->None:
+        delattr(self._load(),name)
+
+    def __dir__(self)->list[str]:
+        return dir(self._load())
+
+    def __repr__(self)->str:
+        return f"<lazy module '{object.__getattribute__(self,'_name')}'>"
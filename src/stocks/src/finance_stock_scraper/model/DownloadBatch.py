@@ -0,0 +1,26 @@
+from datetime import datetime
+from finance_stock_scraper.model.Ticker import Ticker
+
+class DownloadBatch(object):
+    """
+    Tickers that are downloaded with one request starting at the earliest last entry of the batch.
+    Each ticker keeps its own last entry to drop the rows it already has.
+    """
+    def __init__(self) -> None:
+        self.tickers:list[Ticker] = []
+        self.minimal_dates:dict[str,datetime] = {}
+
+    def add(self,ticker:Ticker,last_date:datetime)->None:
+        self.tickers.append(ticker)
+        self.minimal_dates[ticker.ticker] = last_date
+
+    @property
+    def start(self)->datetime:
+        return min(self.minimal_dates.values())
+
+    @property
+    def names(self)->list[str]:
+        return [ticker.ticker for ticker in self.tickers]
+
+    def __len__(self)->int:
+        return len(self.tickers)
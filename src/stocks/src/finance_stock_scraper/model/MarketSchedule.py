@@ -0,0 +1,88 @@
+import os
+import threading
+import datetime
+import pandas as pd
+from finance_stock_scraper.lazy import LazyModule
+
+mcal = LazyModule("pandas_market_calendars")
+
+WINDOW_DAYS = int(os.getenv('STOCKSCRAPER_SCHEDULE_WINDOW_DAYS',2*365)) # Days before and after today that are precomputed
+
+def _to_date(date:datetime.date)->datetime.date:
+    return date.date() if isinstance(date,datetime.datetime) else date
+
+class ExchangeSchedule(object):
+    """
+    Precomputed trading schedule of an exchange for a fixed window of days with O(1) lookups per day
+    """
+    def __init__(self,exchange:str,start_date:datetime.date,end_date:datetime.date) -> None:
+        self.exchange = exchange
+        self.start_date = start_date
+        self.end_date = end_date
+        self.schedule = mcal.get_calendar(exchange).schedule(start_date=start_date,end_date=end_date)
+        self._sessions = {
+            day.date():(market_open,market_close)
+            for day,market_open,market_close in zip(self.schedule.index,self.schedule["market_open"],self.schedule["market_close"])
+        }
+
+    def covers(self,date:datetime.date)->bool:
+        return self.start_date <= date <= self.end_date
+
+    def is_trading_day(self,date:datetime.date)->bool:
+        return date in self._sessions
+
+    def session(self,date:datetime.date)->tuple[pd.Timestamp,pd.Timestamp]|None:
+        """
+        Opening and closing time (UTC) of the session on the given day or None if it is no trading day
+        """
+        return self._sessions.get(date)
+
+    def market_close(self,date:datetime.date)->pd.Timestamp|None:
+        session = self._sessions.get(date)
+        return session[1] if session else None
+
+    def get_trading_times(self,start_date:datetime.date,end_date:datetime.date)->pd.DataFrame:
+        return self.schedule.loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
+
+class ScheduleCache(object):
+    """
+    Process-wide cache of exchange schedules. The window is rebuilt around a day that is requested outside of it.
+    """
+    def __init__(self,window_days:int=WINDOW_DAYS) -> None:
+        self.window_days = window_days
+        self._schedules:dict[str,ExchangeSchedule] = {}
+        self._lock = threading.Lock()
+
+    def get(self,exchange:str,date:datetime.date|None=None)->ExchangeSchedule:
+        date = date or datetime.date.today()
+        exchange = exchange.upper()
+        schedule = self._schedules.get(exchange)
+        if schedule is None or not schedule.covers(date):
+            with self._lock:
+                schedule = self._schedules.get(exchange)
+                if schedule is None or not schedule.covers(date):
+                    window = datetime.timedelta(days=self.window_days)
+                    schedule = ExchangeSchedule(exchange,date-window,date+window)
+                    self._schedules[exchange] = schedule
+        return schedule
+
+    def get_trading_times(self,exchange:str,start_date:datetime.date,end_date:datetime.date)->pd.DataFrame:
+        schedule = self.get(exchange)
+        if schedule.covers(start_date) and schedule.covers(end_date):
+            return schedule.get_trading_times(start_date,end_date)
+        #the range is larger than the window => compute it directly
+        return mcal.get_calendar(exchange).schedule(start_date=start_date,end_date=end_date)
+
+    def is_trading_day(self,exchange:str,date:datetime.date)->bool:
+        date = _to_date(date)
+        return self.get(exchange,date).is_trading_day(date)
+
+    def market_close(self,exchange:str,date:datetime.date)->pd.Timestamp|None:
+        date = _to_date(date)
+        return self.get(exchange,date).market_close(date)
+
+    def clear(self)->None:
+        with self._lock:
+            self._schedules = {}
+
+SCHEDULE_CACHE = ScheduleCache()
@@ -1,29 +1,34 @@
-import pandas_market_calendars as mcal
-from pandas_market_calendars import MarketCalendar
-import pandas as pd
 import datetime
+import sys
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
      
 class Ticker(object):
-    trading_times:MarketCalendar
+    #tickers are created by the ten thousands => no per instance __dict__ and shared (interned) strings
+    __slots__ = ("ticker","exchange")
     
     def __init__(self,ticker:str,exchange:str):
-        self.ticker = ticker.upper()
-        self.exchange = exchange.upper()
-        self.trading_times = None 
+        self.ticker = sys.intern(ticker.upper())
+        self.exchange = sys.intern(exchange.upper())
         
-    def _init_calendar(self)->None:
-        self.trading_times = mcal.get_calendar(self.exchange)
+    def __eq__(self,other:object)->bool:
+        return isinstance(other,Ticker) and self.ticker == other.ticker and self.exchange == other.exchange
+    
+    def __hash__(self)->int:
+        return hash((self.ticker,self.exchange))
+    
+    def __repr__(self)->str:
+        return f"Ticker({self.ticker},{self.exchange})"
         
-    def get_trading_times(self,start_date:datetime.date,end_date:datetime.date)->pd.DataFrame:
-        if self.trading_times is None:
-            self._init_calendar()
-        return self.trading_times.schedule(start_date=start_date, end_date=end_date)
+    def get_trading_times(self,start_date:datetime.date,end_date:datetime.date)->"pd.DataFrame":
+        from finance_stock_scraper.model.MarketSchedule import SCHEDULE_CACHE
+        return SCHEDULE_CACHE.get_trading_times(self.exchange,start_date,end_date)
     
     def is_in_trading_times(self,date:datetime.date)->bool:
-        schedule = self.get_trading_times(date,date)
-        if len(schedule) == 0:
-            return False
-        return date == schedule.index[0].date()
+        from finance_stock_scraper.model.MarketSchedule import SCHEDULE_CACHE
+        return SCHEDULE_CACHE.is_trading_day(self.exchange,date)
     
     
 
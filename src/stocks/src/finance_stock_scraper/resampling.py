@@ -0,0 +1,85 @@
+import logging
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from finance_stock_scraper.model.MarketSchedule import SCHEDULE_CACHE
+
+def session_bounds(exchange:str,start:pd.Timestamp,end:pd.Timestamp)->tuple[np.ndarray,np.ndarray]:
+    """
+    Opening and closing times (UTC nanoseconds) of the sessions of the exchange between start and end (with a day of margin).
+    Returns empty arrays if the exchange has no calendar => buckets are aligned to the epoch.
+    """
+    try:
+        schedule = SCHEDULE_CACHE.get_trading_times(exchange,(start-timedelta(days=1)).date(),(end+timedelta(days=1)).date())
+    except Exception as e:
+        logging.warning(f"No trading calendar for {exchange}, aligning bars to the epoch: {e}")
+        return np.array([],dtype=np.int64),np.array([],dtype=np.int64)
+    opens = pd.DatetimeIndex(schedule["market_open"]).tz_convert("UTC").asi8
+    closes = pd.DatetimeIndex(schedule["market_close"]).tz_convert("UTC").asi8
+    return opens,closes
+
+def bucket_bounds(timestamps:np.ndarray,step:int,opens:np.ndarray,closes:np.ndarray)->tuple[np.ndarray,np.ndarray]:
+    """
+    Start and end (nanoseconds) of the bar each timestamp falls into.
+    Bars are aligned to the opening of their session and never extend past its close (e.g. the last 1h bar of a NYSE session is 15:30-16:00).
+    Timestamps outside of a session are aligned to the epoch.
+    """
+    session = np.searchsorted(opens,timestamps,side="right")-1
+    valid = np.clip(session,0,max(len(opens)-1,0))
+    in_session = (session >= 0) & (timestamps < closes[valid]) if len(opens) > 0 else np.zeros(len(timestamps),dtype=bool)
+    anchors = np.where(in_session,opens[valid] if len(opens) > 0 else 0,0)
+    starts = anchors+(timestamps-anchors)//step*step
+    ends = starts+step
+    if len(opens) > 0:
+        ends = np.where(in_session,np.minimum(ends,closes[valid]),ends)
+    return starts,ends
+
+def resample(long_frame:pd.DataFrame,base_step:timedelta,step:timedelta,exchange:str,minimal_timestamp:int|np.ndarray=0)->pd.DataFrame:
+    """
+    Aggregates a long frame of base bars (see `workflow.to_long_frame`, ordered by ticker and time) into coarser bars:
+    open=first, high=max, low=min, close/adj_close=last and volume=sum (as int64, the caller has to clip it).
+    Only complete bars are returned, a bar is complete if the data of the ticker reaches from its start to its end.
+    Bars that already ended at or before `minimal_timestamp` (ns, one for all tickers or an array indexed by the ticker codes) are skipped as they were derived by an earlier run.
+    """
+    if len(long_frame) == 0:
+        return long_frame
+    base_step,step = base_step//timedelta(microseconds=1)*1000,step//timedelta(microseconds=1)*1000
+    if step % base_step != 0:
+        raise ValueError(f"Bars of {step}ns can't be derived from bars of {base_step}ns")
+
+    timestamps = long_frame["timestamp"].array.asi8
+    ticker_codes = long_frame["ticker"].cat.codes.to_numpy()
+    starts,ends = bucket_bounds(timestamps,step,*session_bounds(exchange,pd.Timestamp(timestamps.min(),tz="UTC"),pd.Timestamp(timestamps.max(),tz="UTC")))
+
+    #the frame is ordered by ticker and time => every bar is a contiguous run of rows
+    new_bar = np.ones(len(long_frame),dtype=bool)
+    new_bar[1:] = (ticker_codes[1:] != ticker_codes[:-1]) | (starts[1:] != starts[:-1])
+    first = np.flatnonzero(new_bar)
+    last = np.append(first[1:],len(long_frame))-1
+
+    #complete bars are fully covered by the data of their ticker
+    new_ticker = np.ones(len(long_frame),dtype=bool)
+    new_ticker[1:] = ticker_codes[1:] != ticker_codes[:-1]
+    ticker_run = np.cumsum(new_ticker)-1
+    ticker_first = timestamps[new_ticker]
+    ticker_last = timestamps[np.append(np.flatnonzero(new_ticker)[1:],len(long_frame))-1]
+    bar_ticker = ticker_run[first]
+    complete = (ticker_first[bar_ticker] <= starts[first]) & (ticker_last[bar_ticker]+base_step >= ends[first])
+    minimal_timestamp = np.asarray(minimal_timestamp)
+    complete &= ends[first]-base_step > (minimal_timestamp[ticker_codes[first]] if minimal_timestamp.ndim > 0 else minimal_timestamp)
+
+    def aggregate(column:str,reducer:np.ufunc)->np.ndarray:
+        return reducer.reduceat(long_frame[column].to_numpy(),first)[complete]
+
+    bars = pd.DataFrame({
+        "exchange":long_frame["exchange"].array[first[complete]],
+        "ticker":long_frame["ticker"].array[first[complete]],
+        "open":long_frame["open"].to_numpy()[first[complete]],
+        "high":aggregate("high",np.maximum),
+        "low":aggregate("low",np.minimum),
+        "close":long_frame["close"].to_numpy()[last[complete]],
+        "adj_close":long_frame["adj_close"].to_numpy()[last[complete]],
+        "volume":aggregate("volume",np.add),
+        "timestamp":pd.to_datetime(starts[first[complete]],utc=True),
+    })
+    return bars
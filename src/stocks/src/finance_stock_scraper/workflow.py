@@ -1,19 +1,47 @@
 from finance_stock_scraper.ExecutionContext import ExecutionContext
 from finance_stock_scraper.model.Intervals import INTERVALS,IntervalTypes
 from finance_stock_scraper.model.Ticker import Ticker
+from finance_stock_scraper.model.DownloadBatch import DownloadBatch
+from finance_stock_scraper.resampling import resample
+from finance_stock_scraper.Metrics import ROWS_INGESTED
+from finance_stock_scraper.lazy import LazyModule
 import pytz
 import pandas as pd
 import os
 import logging
 import traceback
+import queue
+import threading
 from tqdm import tqdm
 import ctypes
 import numpy as np
-from questdb.ingress import TimestampNanos, Buffer
 from datetime import datetime,date,timedelta
+from typing import Iterator,Iterable,TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from questdb.ingress import Buffer
+
+ingress = LazyModule("questdb.ingress")
 CONFIGURED_INTERVALS = os.getenv("STOCKSCRAPER_INTERVALS","5m,1d").split(",")
+DERIVED_INTERVALS = [interval for interval in os.getenv("STOCKSCRAPER_DERIVED_INTERVALS","").split(",") if interval] # Intraday intervals that are aggregated from a configured interval instead of downloaded
+INGESTION_MODE = os.getenv("STOCKSCRAPER_INGESTION_MODE","Columnar").upper() # Columnar or Row
 FLUX_PROTOCOL_MAX_INT = 2_147_483_647 #In theory this should be the int64 max but flux-line-protocol in quest db only supports up to int32
+POINTS_PER_FLUSH = 30_000
+SLICE_QUEUE_DEPTH = int(os.getenv("STOCKSCRAPER_SLICE_QUEUE_DEPTH",1)) # Downloaded slices that may wait to be stored (caps memory)
+INTRADAY_BUCKET = timedelta(hours=float(os.getenv("STOCKSCRAPER_INTRADAY_BUCKET_HOURS",24))) # Intraday tickers whose last entries fall into the same bucket are downloaded together
+DAILY_BUCKET = timedelta(days=float(os.getenv("STOCKSCRAPER_DAILY_BUCKET_DAYS",7))) # Same for daily intervals
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+#Rows at or before the minimal date are skipped, either one date for all tickers or a date per ticker
+MinimalDates = datetime|dict[str,datetime]
+#Maps the yfinance columns to the columns of the interval tables
+COLUMN_MAPPING = {
+    "Open":"open",
+    "High":"high",
+    "Low":"low",
+    "Close":"close",
+    "Adj Close":"adj_close",
+    "Volume":"volume",
+}
 
 def get_interval(interval:str)->IntervalTypes:
     if interval not in INTERVALS:
@@ -51,9 +79,36 @@ def interval_to_timedelta(interval:str)->timedelta:
         case _:
             raise ValueError(f"Unknown interval {interval}")
         
-def difference(existing:list[str],tickers:list[Ticker])->list[Ticker]:
+def get_derived_intervals(interval:str,configured:list[str]=None,derived:list[str]=None)->list[str]:
+    """
+    Derived intervals that are aggregated from the given interval. Each derived interval uses the coarsest configured intraday interval it is a multiple of.
+    """
+    configured = CONFIGURED_INTERVALS if configured is None else configured
+    derived = DERIVED_INTERVALS if derived is None else derived
+    if interval not in configured or get_interval(interval) != IntervalTypes.Intraday:
+        return []
+    result = []
+    for derived_interval in derived:
+        if derived_interval in configured or get_interval(derived_interval) != IntervalTypes.Intraday:
+            continue
+        step = interval_to_timedelta(derived_interval)
+        bases = [base for base in configured if get_interval(base) == IntervalTypes.Intraday and step > interval_to_timedelta(base) and step % interval_to_timedelta(base) == timedelta(0)]
+        if len(bases) > 0 and max(bases,key=interval_to_timedelta) == interval:
+            result.append(derived_interval)
+    return result
+
+def difference(existing:Iterable[str],tickers:list[Ticker])->list[Ticker]:
+    existing = existing if isinstance(existing,(set,frozenset,dict)) else set(existing)
     return [ticker for ticker in tickers if ticker.ticker not in existing]
 
+def get_minimal_date(minimal_date:MinimalDates,ticker:str)->datetime:
+    """
+    Minimal date (tz-aware) of a ticker, `minimal_date` is either shared by all tickers or a dict with a date per ticker
+    """
+    if isinstance(minimal_date,dict):
+        minimal_date = minimal_date.get(ticker,datetime(1, 1, 1))
+    return make_datetime_tz_aware(minimal_date)
+
 def make_datetime_tz_aware(datetime:datetime):
     if datetime.tzinfo is not None and datetime.tzinfo.utcoffset(datetime) is not None:
         return datetime.astimezone(pytz.UTC)
@@ -66,7 +121,7 @@ def make_timestamp_tz_aware(timestamp:pd.Timestamp):
     else:
         return timestamp.tz_localize(pytz.UTC)
     
-def create_point(timestamp:pd.Timestamp,row:pd.Series,ticker:Ticker,interval:str,buffer:Buffer,minimal_date:datetime=datetime(1, 1, 1))->bool:
+def create_point(timestamp:pd.Timestamp,row:pd.Series,ticker:Ticker,interval:str,buffer:"Buffer",minimal_date:datetime=datetime(1, 1, 1))->bool:
     
     #Invalide Data skip this row
     if row.isnull().values.any():
@@ -91,93 +146,344 @@ def create_point(timestamp:pd.Timestamp,row:pd.Series,ticker:Ticker,interval:str
             "adj_close":float(row["Adj Close"]),
             "volume": min(int(row["Volume"]),FLUX_PROTOCOL_MAX_INT)
         },
-        at=TimestampNanos(timestamp.value)
+        at=ingress.TimestampNanos(timestamp.value)
     )
     return True
 
+def prepare_interval(interval:str,executionContext:ExecutionContext)->None:
+    """
+    Creates the tables of the interval (and its derived intervals) and checks the watermarks against the table.
+    Has to run before the exchanges of the interval are gathered.
+    """
+    executionContext.questClient.create_table(interval)
+    for derived_interval in get_derived_intervals(interval):
+        executionContext.questClient.create_table(derived_interval)
+    if executionContext.watermarkStore is not None:
+        #spooled points are not in the table yet => the watermarks can only be checked once the spool is replayed
+        spooled = executionContext.questClient.spooled_bytes
+        if spooled > 0:
+            logging.warning(f"{spooled} bytes are still spooled, keeping the watermarks of interval_{interval}")
+        else:
+            try:
+                latest = executionContext.questClient.get_latest_timestamp(interval)
+            except Exception as e:
+                #a failed query says nothing about the table => keep the watermarks
+                logging.warning(f"Could not check the watermarks of interval_{interval}: {e}")
+            else:
+                executionContext.watermarkStore.validate(interval,latest)
+
+def get_last_entries(interval:str,exchange:str,executionContext:ExecutionContext)->dict[str,datetime]:
+    """
+    Last stored timestamp of each ticker of the exchange. QuestDB is only queried if there is no watermark store or it has to be rebuilt.
+    """
+    watermarkStore = executionContext.watermarkStore
+    if watermarkStore is None:
+        return executionContext.questClient.get_last_entry_dates(interval,exchange)
+    if watermarkStore.needs_rebuild(interval,exchange):
+        watermarkStore.rebuild(interval,exchange,executionContext.questClient.get_last_entry_dates(interval,exchange))
+    return watermarkStore.get(interval,exchange)
+
+def gather_interval(exchange:str,interval:str,executionContext:ExecutionContext,now:datetime)->None:
+    """
+    Syncs the data of a single interval of the given Exchange with the database
+    """
+    logging.info(f"Starting {exchange} - {interval}")
+    watermarkStore = executionContext.watermarkStore
+    try:
+        #jobs run concurrently on the shared ingestion channel => only the errors of this job's points fail it
+        with executionContext.questClient.job():
+            flow(exchange,interval,executionContext,now)
+            #make sure everything of this interval reached the database (or the spool, from where it is replayed)
+            executionContext.questClient.flush_points()
+        if watermarkStore is not None:
+            watermarkStore.commit(interval,exchange)
+    except Exception:
+        if watermarkStore is not None:
+            #parts of the points may have been written => take the watermarks from QuestDB next time
+            watermarkStore.invalidate(interval,exchange)
+        raise
+    finally:
+        logging.info(f"Finished {exchange} - {interval}")
+
 def gather_data(exchange:str,executionContext:ExecutionContext,now:datetime=datetime.now()):
     """
     Syncs the data of the given Exchange with the database
     """
-    for interval in CONFIGURED_INTERVALS:
-        try:
-            logging.info(f"Starting {exchange} - {interval}")
-            executionContext.questClient.create_table(interval)
-            flow(exchange,interval,executionContext,now)
-        except Exception as e:
-            logging.error(e)
-            logging.debug(traceback.format_exc())
-        finally:
-            logging.info(f"Finished {exchange} - {interval}")
+    try:
+        for interval in CONFIGURED_INTERVALS:
+            try:
+                prepare_interval(interval,executionContext)
+                gather_interval(exchange,interval,executionContext,now)
+            except Exception as e:
+                logging.error(e)
+                logging.debug(traceback.format_exc())
+    finally:
+        #there is nothing to ingest until the next run => release the ILP connection
+        executionContext.questClient.close_ingestion()
                 
     
     
-def download_in_slices(tickers:list[Ticker],interval:str,exchange:str,start:datetime,stop:datetime,executionContext:ExecutionContext,include_start:bool=True,slice_size:int=6)->pd.DataFrame:
+def download_in_slices(tickers:list[Ticker],interval:str,exchange:str,start:datetime,stop:datetime,executionContext:ExecutionContext,include_start:bool=True,slice_size:int=6,queue_depth:int=SLICE_QUEUE_DEPTH,lookback:timedelta=timedelta(0),minimal_dates:dict[str,datetime]|None=None)->None:
     """
-    Some intraday data can only be downladed in slices of 6 Days at a time => we have to download in slices if we want to pull the last 30 days
+    Some intraday data can only be downladed in slices of 6 Days at a time => we have to download in slices if we want to pull the last 30 days.
+    The next slice is downloaded in a background thread while the current one is stored. At most `queue_depth` downloaded slices are waiting to be stored.
+    Every slice additionally downloads `lookback` before its start to complete the derived bars that cross the slice boundary,
+    the rows before the start of a later slice were stored by the previous one and are skipped.
+    If `minimal_dates` are given, the rows of each ticker up to its minimal date are skipped instead of the rows up to the start.
     """
+    if minimal_dates is None:
+        minimal_dates = datetime(1, 1, 1) if include_start else start
     dif = (stop-start).days
     offsets = list(range(0,dif,slice_size))
     if dif not in offsets:
         offsets.append(dif)
-       
-    for i,offset in enumerate(offsets[:-1]):
-        local_start  = start+timedelta(days=offset)
-        local_end = start+timedelta(days=offsets[i+1])
-        data,errors = executionContext.yfDataProcider.get_data([ticker.ticker for ticker in  tickers],local_start,local_end,interval)
-        handle_errors(errors,executionContext)
-        #for many tickers (> 10.000) we get a lot of data (> 10GB) => we need to commit it to the database in slices
-        if data is not None:
-            store_points(data,tickers,f"Intraday Tickers (Slice {i+1}/{len(offsets[:-1])})",executionContext,interval,exchange,datetime(1, 1, 1) if include_start else start)
-        else:
-            joined_tickers = ",".join(tickers)
-            logging.warning(f"Could not download data for {joined_tickers} from {local_start} to {local_end}")
+    slices = [(i,start+timedelta(days=offset)-lookback,start+timedelta(days=offsets[i+1])) for i,offset in enumerate(offsets[:-1])]
+    ticker_names = [ticker.ticker for ticker in tickers]
+    #rows > minimal date are stored => a later slice keeps the rows from its (exclusive) start on
+    slice_minimal_dates = [minimal_dates]+[{name:max(get_minimal_date(minimal_dates,name),make_datetime_tz_aware(start+timedelta(days=offset)-timedelta(microseconds=1))) for name in ticker_names} for offset in offsets[1:-1]]
+    registry = executionContext.failureRegistry
     
+    downloaded = queue.Queue(maxsize=max(1,queue_depth))
+    cancelled = threading.Event()
     
-def store_points(data:pd.DataFrame,tickers:list[Ticker],message:str,executionContext:ExecutionContext,interval:str,exchange:str,minimal_date:datetime=datetime(1, 1, 1))->None:
-    logging.info(f"[{message}] Storing Points ({interval}) for exchange {exchange} ...")
-    minimal_date = make_datetime_tz_aware(minimal_date)
+    def download()->None:
+        for i,local_start,local_end in slices:
+            #tickers that failed in an earlier slice are not requested again
+            names = ticker_names if registry is None else [name for name in ticker_names if not registry.is_blocked(name)]
+            if len(names) == 0:
+                continue
+            try:
+                #each slice arrives as a sequence of ticker batches
+                for data,errors in wait_for_rate_limit(executionContext.yfDataProcider.get_data(names,local_start,local_end,interval),executionContext):
+                    if cancelled.is_set():
+                        break
+                    downloaded.put((i,local_start,local_end,names,data,errors,None))
+            except Exception as e:
+                downloaded.put((i,local_start,local_end,names,None,{},e))
+            if cancelled.is_set():
+                break
+        downloaded.put(None)
+        
+    producer = threading.Thread(target=download,name=f"download-{exchange}-{interval}",daemon=True)
+    producer.start()
+    try:
+        while (item := downloaded.get()) is not None:
+            i,local_start,local_end,names,data,errors,exception = item
+            message = f"Intraday Tickers (Slice {i+1}/{len(slices)})"
+            if exception is not None:
+                logging.error(f"[{message}] Download from {local_start} to {local_end} failed: {exception}")
+                continue
+            #only the tickers of this batch => a later batch doesn't clear the failures of an earlier one
+            handle_errors(errors,executionContext,batch_names(data,errors))
+            #for many tickers (> 10.000) we get a lot of data (> 10GB) => we need to commit it to the database in slices
+            if data is not None:
+                try:
+                    store_points(data,tickers,message,executionContext,interval,exchange,slice_minimal_dates[i])
+                except Exception as e:
+                    logging.error(f"[{message}] Storing failed: {e}")
+                    logging.debug(traceback.format_exc())
+            else:
+                logging.warning(f"[{message}] Could not download data for {','.join(names)} from {local_start} to {local_end}")
+            #release the slice before waiting for the next one
+            item = data = None
+    finally:
+        #unblock the producer if we stopped early
+        cancelled.set()
+        while producer.is_alive():
+            try:
+                downloaded.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    
+    
+def datetime_to_nanos(datetime:datetime)->int:
+    """
+    Converts a tz-aware datetime into nanoseconds since the epoch (also works outside of the pandas timestamp bounds)
+    """
+    return ((datetime - EPOCH) // timedelta(microseconds=1)) * 1000
+
+def to_long_frame(data:pd.DataFrame,tickers:list[Ticker],minimal_date:MinimalDates=datetime(1, 1, 1))->pd.DataFrame:
+    """
+    Reshapes a yfinance frame (grouped by ticker) into one long frame with a row per (ticker,timestamp).
+    Invalid rows (null values, timestamps before the epoch or before the minimal date) are dropped.
+    The rows are ordered by ticker (in the order of `tickers`) and then by time, like the row based ingestion.
+    """
+    tickers = [ticker for ticker in tickers if ticker.ticker in data.columns]
+    columns = ["exchange","ticker"] + list(COLUMN_MAPPING.values()) + ["timestamp"]
+    if len(tickers) == 0 or len(data) == 0:
+        return pd.DataFrame(columns=columns)
+    
+    fields = list(data[tickers[0].ticker].columns)
+    missing = [field for field in COLUMN_MAPPING if field not in fields]
+    if len(missing) > 0:
+        raise KeyError(f"Missing columns {','.join(missing)} in the downloaded data")
+    
+    #(time,ticker*field) => (ticker*time,field)
+    names = [ticker.ticker for ticker in tickers]
+    values = data.reindex(columns=pd.MultiIndex.from_product([names,fields])).to_numpy(dtype=np.float64)
+    values = values.reshape(len(data),len(names),len(fields)).transpose(1,0,2).reshape(-1,len(fields))
+    
+    index = pd.DatetimeIndex(data.index)
+    index = index.tz_convert(pytz.UTC) if index.tz is not None else index.tz_localize(pytz.UTC)
+    timestamps = np.tile(index.asi8,len(names))
+    
+    mask = ~np.isnan(values).any(axis=1)
+    minimal_timestamps = np.array([max(0,datetime_to_nanos(get_minimal_date(minimal_date,name))) for name in names],dtype=np.int64)
+    mask &= timestamps > np.repeat(minimal_timestamps,len(data))
+    
+    rows = np.flatnonzero(mask)
+    ticker_codes = rows // len(data)
+    exchanges = pd.Categorical([ticker.exchange for ticker in tickers])
+    long_frame = pd.DataFrame({
+        "exchange":pd.Categorical.from_codes(exchanges.codes[ticker_codes],categories=exchanges.categories),
+        "ticker":pd.Categorical.from_codes(ticker_codes,categories=names),
+    })
+    for field,column in COLUMN_MAPPING.items():
+        long_frame[column] = values[rows,fields.index(field)]
+    long_frame["volume"] = np.minimum(long_frame["volume"].to_numpy().astype(np.int64),FLUX_PROTOCOL_MAX_INT)
+    long_frame["timestamp"] = pd.to_datetime(timestamps[rows],utc=True)
+    return long_frame
+
+def _store_points_columnar(data:pd.DataFrame,tickers:list[Ticker],message:str,executionContext:ExecutionContext,interval:str,exchange:str,minimal_date:MinimalDates)->tuple[int,dict]:
+    return _store_long_frame(to_long_frame(data,tickers,minimal_date),message,executionContext,interval,exchange)
+
+def _store_long_frame(long_frame:pd.DataFrame,message:str,executionContext:ExecutionContext,interval:str,exchange:str)->tuple[int,dict]:
+    """
+    Submits the long frame in chunks and returns the number of stored points and the latest stored timestamp of each ticker
+    """
     stored_points = 0
+    latest = {}
+    for start in tqdm(range(0,len(long_frame),POINTS_PER_FLUSH),f"[{message}] Storing Points ({interval}) for exchange {exchange} ..."):
+        chunk = long_frame.iloc[start:start+POINTS_PER_FLUSH]
+        try:
+            buffer = ingress.Buffer(init_capacity=1024*1024)
+            buffer.dataframe(chunk,table_name=f"interval_{interval}",symbols=["exchange","ticker"],at="timestamp")
+            #the ingestion channel flushes the buffer in the background
+            executionContext.questClient.submit_points(buffer,len(chunk))
+            stored_points += len(chunk)
+            #the frame is ordered by time per ticker => later chunks hold later timestamps
+            latest.update(chunk.groupby("ticker",observed=True,sort=False)["timestamp"].max().to_dict())
+        except Exception as e:
+            logging.error(e)
+            logging.debug(traceback.format_exc())
+    return stored_points,latest
+
+def _store_points_rows(data:pd.DataFrame,tickers:list[Ticker],message:str,executionContext:ExecutionContext,interval:str,exchange:str,minimal_date:MinimalDates)->tuple[int,dict]:
+    stored_points = 0
+    latest,pending = {},{}
     current_iteration = 0
-    buffer = Buffer(init_capacity=1024*1024)
+    buffer = ingress.Buffer(init_capacity=1024*1024)
     for ticker in tqdm(tickers,f"[{message}] Storing Points ({interval}) for exchange {exchange} ..."):
         if ticker.ticker in data.columns:
             try:
+                ticker_minimal_date = get_minimal_date(minimal_date,ticker.ticker)
                 for timestamp,row in data[ticker.ticker].iterrows():
-                    if create_point(timestamp,row,ticker,interval,buffer,minimal_date):
+                    if create_point(timestamp,row,ticker,interval,buffer,ticker_minimal_date):
                         current_iteration += 1
+                        pending[ticker.ticker] = make_timestamp_tz_aware(timestamp)
                     
-                    if current_iteration > 30_000:
-                        executionContext.questClient.store_points(buffer)  
+                    if current_iteration > POINTS_PER_FLUSH:
+                        executionContext.questClient.submit_points(buffer,current_iteration)
+                        buffer = ingress.Buffer(init_capacity=1024*1024)
                         stored_points += current_iteration
                         current_iteration = 0
+                        latest.update(pending)
+                        pending = {}
             except Exception as e:
                 logging.error(e)
                 logging.debug(traceback.format_exc())
                     
     if current_iteration > 0:
-        executionContext.questClient.store_points(buffer)
+        executionContext.questClient.submit_points(buffer,current_iteration)
         stored_points += current_iteration
         current_iteration = 0
-        
+        latest.update(pending)
+    return stored_points,latest
+    
+def store_points(data:pd.DataFrame,tickers:list[Ticker],message:str,executionContext:ExecutionContext,interval:str,exchange:str,minimal_date:MinimalDates=datetime(1, 1, 1))->None:
+    logging.info(f"[{message}] Storing Points ({interval}) for exchange {exchange} ...")
+    with executionContext.write_slots:
+        if INGESTION_MODE == "ROW":
+            stored_points,latest = _store_points_rows(data,tickers,message,executionContext,interval,exchange,minimal_date)
+        else:
+            stored_points,latest = _store_points_columnar(data,tickers,message,executionContext,interval,exchange,minimal_date)
+    ROWS_INGESTED.inc(stored_points,interval=interval)
+    if executionContext.watermarkStore is not None:
+        #committed by `gather_interval` once the points reached the database
+        executionContext.watermarkStore.stage(interval,exchange,latest)
     logging.info(f"[{message}] Stored {stored_points} Points ({interval}) for exchange {exchange}!")
+    store_derived_points(data,tickers,message,executionContext,interval,exchange,minimal_date)
+
+def store_derived_points(data:pd.DataFrame,tickers:list[Ticker],message:str,executionContext:ExecutionContext,interval:str,exchange:str,minimal_date:MinimalDates=datetime(1, 1, 1))->None:
+    """
+    Aggregates the downloaded bars into the derived intervals of `interval` (see STOCKSCRAPER_DERIVED_INTERVALS).
+    The data has to start one derived bar before the minimal date, otherwise the first bar is incomplete and skipped.
+    """
+    derived_intervals = get_derived_intervals(interval)
+    if len(derived_intervals) == 0:
+        return
+    #the bars before the minimal date are needed to complete the first derived bar
+    long_frame = to_long_frame(data,tickers)
+    if len(long_frame) == 0:
+        return
+    minimal_timestamps = np.array([max(0,datetime_to_nanos(get_minimal_date(minimal_date,name))) for name in long_frame["ticker"].cat.categories],dtype=np.int64)
+    for derived_interval in derived_intervals:
+        with executionContext.write_slots:
+            bars = resample(long_frame,interval_to_timedelta(interval),interval_to_timedelta(derived_interval),exchange,minimal_timestamps)
+            bars["volume"] = np.minimum(bars["volume"].to_numpy(),FLUX_PROTOCOL_MAX_INT)
+            stored_points,_ = _store_long_frame(bars,message,executionContext,derived_interval,exchange)
+        ROWS_INGESTED.inc(stored_points,interval=derived_interval)
+        logging.info(f"[{message}] Derived {stored_points} Points ({derived_interval}) from {interval} for exchange {exchange}!")
+    
     
     
+def store_batches(batches:Iterator[tuple[pd.DataFrame,dict]],tickers:list[Ticker],message:str,executionContext:ExecutionContext,interval:str,exchange:str,minimal_date:MinimalDates=datetime(1, 1, 1))->None:
+    """
+    Stores the batches of a download one after another (only one batch is held in memory) and handles the errors of each batch
+    """
+    for i,(data,batch_errors) in enumerate(wait_for_rate_limit(batches,executionContext)):
+        names = batch_names(data,batch_errors)
+        if data is not None:
+            store_points(data,tickers,f"{message} (Batch {i+1})",executionContext,interval,exchange,minimal_date)
+        del data
+        #rate limits have to be known before the next batch is requested
+        handle_errors(batch_errors,executionContext,names)
+
+def batch_names(data:pd.DataFrame|None,errors:dict)->list[str]:
+    """
+    Tickers requested by a download batch: the failed ones and the ones with columns in the data
+    """
+    names = list(errors)
+    if data is not None:
+        names += [name for name in data.columns.get_level_values(0).unique() if name not in errors]
+    return names
+
+def wait_for_rate_limit(batches:Iterator[tuple[pd.DataFrame,dict]],executionContext:ExecutionContext)->Iterator[tuple[pd.DataFrame,dict]]:
+    """
+    Holds back the download of the next batch while Yahoo Finance rate limits the scraper
+    """
+    registry = executionContext.failureRegistry
+    iterator = iter(batches)
+    while True:
+        if registry is not None:
+            registry.wait_for_rate_limit()
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return
+        yield batch
     
-def handle_errors(errors:dict,executionContext:ExecutionContext):
+def handle_errors(errors:dict,executionContext:ExecutionContext,tickers:list[str]|None=None):
     """
-    Handles the yFinanced errors and removes faulted tickers from the repository
+    Handles the yFinanced errors: failing tickers are backed off in the failure registry, the other requested tickers are cleared
     """
+    registry = executionContext.failureRegistry
+    if registry is not None and tickers is not None:
+        registry.record_successes([ticker for ticker in tickers if ticker not in errors])
     if len(errors)>0:
         logging.warning(f"{len(errors)} errors occured")
-        #TODO
-        # removed = []
-        # for ticker,error in errors.items():
-        #     if error == "No data found for this date range, symbol may be delisted":
-        #         if executionContext.tickerRepository.remove(ticker):
-        #             removed.append(ticker)
-        # if len(removed) > 0:
-        #     logging.debug(f"Removed {','.join(removed)} from the repository!")
+        if registry is not None:
+            registry.record_failures(errors)
     
                 
 def flow(exchange:str,interval:str,executionContext:ExecutionContext,now:datetime):
@@ -187,65 +493,71 @@ def flow(exchange:str,interval:str,executionContext:ExecutionContext,now:datetim
     interval_type = get_interval(interval)
     time_delta = interval_to_timedelta(interval)
     
-    tickers = list(executionContext.tickerRepository.exchanges[exchange].values())
+    tickers = executionContext.tickerRepository.get_tickers(exchange)
     if len(tickers) == 0:
         raise ValueError(f"No tickers found for exchange {exchange}")
+    if executionContext.failureRegistry is not None:
+        #delisted or misspelled tickers are only probed again once their backoff expired
+        tickers = executionContext.failureRegistry.filter(tickers)
     
     #First we check if the ticker is in the database if not we download the max from YFinance and add it
-    existing_tickers = executionContext.questClient.get_existing_tickers_for_interval(interval,exchange)
-    tickers_to_gather = difference(existing_tickers,tickers)
+    last_entries = get_last_entries(interval,exchange,executionContext)
+    tickers_to_gather = difference(last_entries,tickers)
     if len(tickers_to_gather) > 0:
-        data = None
         if interval_type == IntervalTypes.Daily:
-            data,errors = executionContext.yfDataProcider.get_data_from_period([ticker.ticker for ticker in tickers_to_gather],interval)
-            handle_errors(errors,executionContext)
-            if data is not None:
-                store_points(data,tickers_to_gather,"New Tickers",executionContext,interval,exchange)
+            batches = executionContext.yfDataProcider.get_data_from_period([ticker.ticker for ticker in tickers_to_gather],interval)
+            store_batches(batches,tickers_to_gather,"New Tickers",executionContext,interval,exchange)
         else:
             #Maximum for Intraday is 30 days
             download_in_slices(tickers_to_gather,interval,exchange,now-timedelta(days=29),now,executionContext,) 
               
     #If we already have data for an stock we just download the latest data
     #1. We ignore the stocks we just downloaded
-    tickers_to_check = difference([ticker.ticker for ticker in tickers_to_gather],tickers)
+    tickers_to_check = difference({ticker.ticker for ticker in tickers_to_gather},tickers)
     
-    #2. Querry the database for the last date we got data for each stock and group by datetime
-    tickers_to_gather = {}
-    last_entries = executionContext.questClient.get_last_entry_dates(interval)
+    #2. Group the stocks by their last entry so that stocks with similar last entries are downloaded together
+    last_dates = {}
     for ticker in tickers_to_check:
         if ticker.ticker in last_entries:
             last_date = last_entries[ticker.ticker]
-            #this schould never happen
-            if last_date == now:
+            #We cant download data from the future (e.g we want to download an interval of 7days => we can only downlaod 7 days after the last date)
+            if now-last_date < time_delta:
                 continue
-            
-            if last_date not in tickers_to_gather:
-                tickers_to_gather[last_date] = [ticker]
-            else:
-                tickers_to_gather[last_date].append(ticker) 
+            last_dates[ticker] = last_date
         else:
             logging.warning(f"Can't find last date for {ticker.ticker}!")
+    download_batches = plan_batches(last_dates,interval)
 
     #3. Download the data from YFinance
-    for date in tickers_to_gather:
-        if now-date < time_delta:
-            #We cant download data from the future (e.g we want to download an interval of 7days => we can only downlaod 7 days after the last date)
-            continue
-        
-        batched_tickers = tickers_to_gather[date]
-        batched_tickers_names = [ticker.ticker for ticker in batched_tickers]
-        data = None
-        
+    #derived bars that started before the last entry are only complete with the bars before it
+    lookback = max([interval_to_timedelta(derived_interval) for derived_interval in get_derived_intervals(interval)],default=timedelta(0))
+    for batch in download_batches:
+        date = batch.start
         if interval_type == IntervalTypes.Intraday and now-date > timedelta(days=6):
             if now-date > timedelta(days=30):
                 #we can only get the last 30 days
-                logging.warning(f"[WARNING] The last entry for {','.join(batched_tickers_names)} is older than 30 days! Only  the last 30 days will be downloaded!")
-                download_in_slices(batched_tickers,interval,exchange,now-timedelta(days=29),now,executionContext,include_start=False)  
+                logging.warning(f"[WARNING] The last entry for {','.join(batch.names)} is older than 30 days! Only  the last 30 days will be downloaded!")
+                download_in_slices(batch.tickers,interval,exchange,now-timedelta(days=29),now,executionContext,lookback=lookback,minimal_dates=batch.minimal_dates)
             else:
                 #we have to download in slices
-                download_in_slices(batched_tickers,interval,exchange,date,now,executionContext,include_start=False)          
+                download_in_slices(batch.tickers,interval,exchange,date,now,executionContext,lookback=lookback,minimal_dates=batch.minimal_dates)
         else:
-            data,errors = executionContext.yfDataProcider.get_data(batched_tickers_names,date,now,interval)
-            handle_errors(errors,executionContext)
-            if data is not None:
-                store_points(data,batched_tickers,"Existing Tickers",executionContext,interval,exchange,date)
+            batches = executionContext.yfDataProcider.get_data(batch.names,date-lookback,now,interval)
+            store_batches(batches,batch.tickers,"Existing Tickers",executionContext,interval,exchange,batch.minimal_dates)
+
+def plan_batches(last_dates:dict[Ticker,datetime],interval:str)->list[DownloadBatch]:
+    """
+    Groups the tickers into download batches by bucketing their last entries (buckets are aligned to the epoch, e.g. one bucket per UTC day for intraday intervals).
+    Each batch is downloaded from its earliest last entry and the rows a ticker already has are dropped by its minimal date.
+    """
+    bucket_size = INTRADAY_BUCKET if get_interval(interval) == IntervalTypes.Intraday else DAILY_BUCKET
+    batches:dict[int,DownloadBatch] = {}
+    for ticker,last_date in last_dates.items():
+        bucket = (make_datetime_tz_aware(last_date)-EPOCH)//bucket_size
+        if bucket not in batches:
+            batches[bucket] = DownloadBatch()
+        batches[bucket].add(ticker,last_date)
+    if len(last_dates) > 0:
+        requests_before = len(set(last_dates.values()))
+        logging.info(f"Planned {len(batches)} download requests for {len(last_dates)} tickers ({interval}), grouping by exact last entry would need {requests_before}")
+    return [batches[bucket] for bucket in sorted(batches)]
@@ -0,0 +1,140 @@
+from finance_stock_scraper import workflow
+from finance_stock_scraper import YFDataProvider as provider_module
+from finance_stock_scraper.YFDataProvider import YFDataProvider
+from finance_stock_scraper.FailureRegistry import FailureRegistry, classify, DELISTED, NO_DATA, RATE_LIMITED, OTHER
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from finance_stock_scraper.model.Ticker import Ticker
+from datetime import datetime, timedelta
+import logging
+import numpy as np
+import pandas as pd
+import pytz
+
+DAY = 24*60*60
+
+def test_classify_yfinance_errors():
+    assert classify("Exception('XYZ: No timezone found, symbol may be delisted')") == DELISTED
+    assert classify("No data found for this date range, symbol may be delisted") == DELISTED
+    assert classify("No price data found, symbol may be delisted (1d 2022-08-01 -> 2022-08-02)".replace("symbol may be delisted","")) == NO_DATA
+    assert classify("HTTP Error 429: Too Many Requests") == RATE_LIMITED
+    assert classify("4290.T: timeout") == OTHER
+
+def test_failures_back_off_exponentially_and_persist(tmp_path):
+    path = str(tmp_path/"failures.sqlite")
+    registry = FailureRegistry(path,max_backoff=3*DAY)
+    registry.record_failures({"XYZ":"symbol may be delisted"},now=0)
+    assert registry.is_blocked("XYZ",now=DAY-1)
+    assert not registry.is_blocked("XYZ",now=DAY)
+    registry.record_failures({"XYZ":"symbol may be delisted"},now=DAY)
+    assert registry.is_blocked("XYZ",now=3*DAY-1) and not registry.is_blocked("XYZ",now=3*DAY)
+    #the backoff is capped => the ticker is re-probed periodically
+    registry.record_failures({"XYZ":"symbol may be delisted"},now=3*DAY)
+    assert not registry.is_blocked("XYZ",now=6*DAY)
+    registry.close()
+
+    registry = FailureRegistry(path)
+    assert registry.is_blocked("XYZ",now=5*DAY)
+    tickers = [Ticker("XYZ","NASDAQ"),Ticker("MSFT","NASDAQ")]
+    assert registry.filter(tickers,now=5*DAY) == [Ticker("MSFT","NASDAQ")]
+    assert registry.filter(tickers,now=5*DAY) == [Ticker("MSFT","NASDAQ")]
+    assert registry.report() == {DELISTED:{"tickers":1,"skipped":2}}
+
+    registry.record_successes(["XYZ","MSFT"])
+    assert not registry.is_blocked("XYZ",now=5*DAY)
+    assert registry.report() == {}
+
+def test_rate_limits_pause_all_downloads():
+    registry = FailureRegistry(":memory:",max_pause=600)
+    registry.record_failures({"MSFT":"YFRateLimitError('Too Many Requests. Rate limited. Try after a while.')"},now=0)
+    #the ticker isn't blocked, the downloads are paused
+    assert not registry.is_blocked("MSFT",now=1)
+    assert registry.report() == {}
+    assert registry.paused_for(now=0) == 300
+    registry.record_failures({"AAPL":"Too Many Requests"},now=300)
+    assert registry.paused_for(now=300) == 600
+    registry.record_failures({"AAPL":"Too Many Requests"},now=900)
+    assert registry.paused_for(now=900) == 600
+    #a successful download resets the escalation
+    registry.record_successes(["MSFT"])
+    registry.record_failures({"AAPL":"Too Many Requests"},now=2000)
+    assert registry.paused_for(now=2000) == 300
+
+class FakeRepository(object):
+    def __init__(self,tickers:list[Ticker]) -> None:
+        self.tickers = tickers
+
+    def get_tickers(self,exchange:str)->list[Ticker]:
+        return self.tickers
+
+class FailingDataProvider(object):
+    """
+    Returns a bar for every requested ticker except the delisted ones
+    """
+    def __init__(self,delisted:list[str]) -> None:
+        self.delisted = delisted
+        self.requests = []
+
+    def get_data(self,tickers:list[str],start_date:datetime,end_date:datetime,interval:str):
+        self.requests.append(tuple(tickers))
+        found = [ticker for ticker in tickers if ticker not in self.delisted]
+        columns = pd.MultiIndex.from_product([found,["Open","High","Low","Close","Adj Close","Volume"]])
+        data = pd.DataFrame(np.ones((1,len(columns))),index=pd.DatetimeIndex([end_date-timedelta(minutes=5)]),columns=columns)
+        yield data,{ticker:"No timezone found, symbol may be delisted" for ticker in tickers if ticker in self.delisted}
+
+class FakeQuestClient(object):
+    def get_last_entry_dates(self,interval:str,exchange:str|None=None)->dict[str,datetime]:
+        return {}
+
+    def submit_points(self,buffer,rows:int=0)->None:
+        pass
+
+def test_flow_skips_failing_tickers():
+    now = datetime(2022,8,20,tzinfo=pytz.UTC)
+    registry = FailureRegistry(":memory:")
+    provider = FailingDataProvider(["XYZ"])
+    executionContext = ExecutionContext(FakeRepository([Ticker("MSFT","NASDAQ"),Ticker("XYZ","NASDAQ")]),provider,FakeQuestClient(),failureRegistry=registry)
+    workflow.flow("NASDAQ","5m",executionContext,now)
+    #the delisted ticker fails in the first slice, the producer runs at most two slices ahead => the last slices skip it
+    assert len(provider.requests) == 5
+    assert provider.requests[0] == ("MSFT","XYZ")
+    assert provider.requests[3:] == [("MSFT",),("MSFT",)]
+    assert registry.is_blocked("XYZ")
+
+    provider.requests = []
+    workflow.flow("NASDAQ","5m",executionContext,now)
+    assert all("XYZ" not in request for request in provider.requests)
+    assert registry.report()[DELISTED] == {"tickers":1,"skipped":1}
+
+def test_registry_is_fed_by_the_provider(monkeypatch):
+    def download(tickers:str,**kwargs):
+        #like yf.download: the failed ticker is a NaN column and its reason is only logged
+        names = tickers.split(" ")
+        index = pd.date_range("2022-08-01",periods=3,freq="D",tz="UTC")
+        frames = {name:pd.DataFrame(np.nan if name == "XYZ" else 1.0,index=index,columns=["Open","High","Low","Close","Adj Close","Volume"]) for name in names}
+        logging.getLogger("yfinance").error("['XYZ']: YFTzMissingError('possibly delisted; no timezone found')")
+        return pd.concat(frames.values(),axis=1,keys=frames.keys(),names=["Ticker","Price"])
+    monkeypatch.setattr(provider_module.yf,"download",download)
+    registry = FailureRegistry(":memory:")
+    executionContext = ExecutionContext(FakeRepository([Ticker("MSFT","NASDAQ"),Ticker("XYZ","NASDAQ")]),YFDataProvider(),FakeQuestClient(),failureRegistry=registry)
+    workflow.flow("NASDAQ","1d",executionContext,datetime(2022,8,5,tzinfo=pytz.UTC))
+    assert registry.is_blocked("XYZ") and not registry.is_blocked("MSFT")
+    assert registry.report() == {DELISTED:{"tickers":1,"skipped":0}}
+
+class BatchedDataProvider(FailingDataProvider):
+    """
+    Splits every request into batches of two tickers like the YFDataProvider
+    """
+    def get_data(self,tickers:list[str],start_date:datetime,end_date:datetime,interval:str):
+        for i in range(0,len(tickers),2):
+            yield from super().get_data(tickers[i:i+2],start_date,end_date,interval)
+
+def test_later_batches_keep_the_failures_of_earlier_batches():
+    now = datetime(2022,8,20,tzinfo=pytz.UTC)
+    registry = FailureRegistry(":memory:")
+    provider = BatchedDataProvider(["XYZ"])
+    tickers = [Ticker("XYZ","NASDAQ"),Ticker("MSFT","NASDAQ"),Ticker("AAPL","NASDAQ"),Ticker("IBM","NASDAQ")]
+    workflow.flow("NASDAQ","5m",ExecutionContext(FakeRepository(tickers),provider,FakeQuestClient(),failureRegistry=registry),now)
+    #XYZ fails in the first batch of the first slice, the second batch only clears its own tickers
+    assert provider.requests[:2] == [("XYZ","MSFT"),("AAPL","IBM")]
+    assert registry.is_blocked("XYZ")
+    assert registry.report() == {DELISTED:{"tickers":1,"skipped":0}}
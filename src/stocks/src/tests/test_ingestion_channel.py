@@ -0,0 +1,181 @@
+from finance_stock_scraper.IngestionChannel import IngestionChannel
+from finance_stock_scraper.IngestionSpool import IngestionSpool
+from finance_stock_scraper.QuestClient import QuestClient
+from questdb.ingress import Buffer, TimestampNanos
+import socket
+import threading
+import time
+import pytest
+
+class IlpSink(object):
+    """
+    Minimal TCP server that collects everything written to it
+    """
+    def __init__(self,port:int=0) -> None:
+        self.server = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self.server.bind(("127.0.0.1",port))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+        self.data = bytearray()
+        self.connections = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self._accept,daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection,_ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._read,args=(connection,),daemon=True).start()
+
+    def _read(self,connection):
+        with connection:
+            while chunk := connection.recv(65536):
+                with self.lock:
+                    self.data += chunk
+
+    def lines(self,expected:int,timeout:float=5)->list[str]:
+        deadline = time.monotonic()+timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                lines = self.data.decode().splitlines()
+            if len(lines) >= expected:
+                return lines
+            time.sleep(0.01)
+        return lines
+
+    def close(self):
+        self.server.close()
+
+@pytest.fixture
+def sink():
+    sink = IlpSink()
+    yield sink
+    sink.close()
+
+def build_buffer(rows:int,offset:int=0)->Buffer:
+    buffer = Buffer()
+    for i in range(rows):
+        buffer.row("interval_5m",symbols={"ticker":"A"},columns={"close":float(i)},at=TimestampNanos(offset+i+1))
+    return buffer
+
+def test_channel_reuses_one_connection(sink):
+    channel = IngestionChannel("127.0.0.1",sink.port,max_rows=10,flush_interval=60)
+    for i in range(10):
+        channel.submit(build_buffer(5,i*5),5)
+    channel.flush()
+    assert len(sink.lines(50)) == 50
+    assert channel.stats["rows"] == 50
+    assert channel.stats["connections"] == 1
+    assert channel.stats["flushes"] == 5
+    channel.close()
+    assert channel.closed
+    assert sink.connections == 1
+
+def test_channel_flushes_after_interval(sink):
+    channel = IngestionChannel("127.0.0.1",sink.port,flush_interval=0.05)
+    channel.submit(build_buffer(3),3)
+    assert len(sink.lines(3)) == 3
+    channel.close()
+
+def free_port()->int:
+    server = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+    server.bind(("127.0.0.1",0))
+    port = server.getsockname()[1]
+    server.close()
+    return port
+
+def test_channel_reports_errors_on_flush():
+    port = free_port()
+    channel = IngestionChannel("127.0.0.1",port,retries=1,retry_backoff=0)
+    channel.submit(build_buffer(3),3)
+    with pytest.raises(Exception):
+        channel.flush()
+    channel.close()
+
+def timestamps(lines:list[str])->list[int]:
+    return [int(line.split(" ")[-1]) for line in lines]
+
+def test_channel_spools_while_questdb_is_down(tmp_path):
+    port = free_port()
+    spool = IngestionSpool(str(tmp_path))
+    channel = IngestionChannel("127.0.0.1",port,max_rows=5,retries=0,spool=spool,spool_retry_interval=60)
+    for i in range(3):
+        channel.submit(build_buffer(5,i*5),5)
+    #nothing is lost => the flush succeeds
+    channel.flush()
+    assert spool.pending > 0
+    assert channel.stats["spooled"] > 0
+
+    sink = IlpSink(port)
+    try:
+        channel.submit(build_buffer(5,15),5)
+        channel.flush()
+        assert timestamps(sink.lines(20)) == list(range(1,21))
+        assert spool.empty
+        channel.close()
+    finally:
+        sink.close()
+
+def test_channel_spills_when_the_writer_is_behind(sink,tmp_path):
+    spool = IngestionSpool(str(tmp_path))
+    channel = IngestionChannel("127.0.0.1",sink.port,max_rows=5,max_pending=1,flush_interval=60,spool=spool)
+    #block the writer
+    with channel._writing:
+        channel.submit(build_buffer(5),5)
+        while channel._queue.qsize() > 0:
+            time.sleep(0.01)
+        for i in range(1,4):
+            channel.submit(build_buffer(5,i*5),5)
+        assert channel.stats["spooled"] > 0
+    channel.flush()
+    assert timestamps(sink.lines(20)) == list(range(1,21))
+    assert spool.empty
+    channel.close()
+
+def test_flush_only_raises_the_errors_of_the_job(sink):
+    channel = IngestionChannel("127.0.0.1",sink.port,retries=0)
+    send = channel._send
+    def failing_send(buffer:Buffer)->None:
+        if "interval_1m" in str(buffer):
+            raise ConnectionError("QuestDB dropped the buffer")
+        send(buffer)
+    channel._send = failing_send
+    failing = Buffer()
+    failing.row("interval_1m",symbols={"ticker":"A"},columns={"close":1.0},at=TimestampNanos(1))
+    channel.submit(failing,1,job="A")
+    channel.submit(build_buffer(3),3,job="B")
+    channel.flush(job="B")
+    with pytest.raises(ConnectionError):
+        channel.flush(job="A")
+    channel.close()
+
+def test_quest_client_scopes_errors_to_the_job_of_the_thread():
+    client = QuestClient("127.0.0.1",ilp_port=free_port())
+    client.ingestion.retries = 0
+    submitted = threading.Event()
+    results = {}
+    def job_a():
+        with client.job():
+            client.submit_points(build_buffer(3),3)
+            submitted.set()
+            try:
+                client.flush_points()
+            except Exception as e:
+                results["A"] = e
+    def job_b():
+        submitted.wait()
+        with client.job():
+            client.flush_points()
+            results["B"] = None
+    threads = [threading.Thread(target=job_b),threading.Thread(target=job_a)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results["B"] is None
+    assert isinstance(results["A"],Exception)
+    client.close()
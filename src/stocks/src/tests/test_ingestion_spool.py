@@ -0,0 +1,93 @@
+from finance_stock_scraper.IngestionSpool import IngestionSpool
+import os
+import pytest
+
+def segments(directory)->list[str]:
+    return sorted(name for name in os.listdir(directory) if name.endswith(".spool"))
+
+def test_spool_replays_in_order_and_deletes_segments(tmp_path):
+    spool = IngestionSpool(str(tmp_path),segment_bytes=20)
+    for i in range(5):
+        spool.append(f"line {i}\n".encode())
+    #every segment holds at most 20 bytes => one record (4 byte header + 7 bytes) per segment
+    assert len(segments(tmp_path)) == 5
+    assert spool.pending == spool.size == 55
+    sent = []
+    assert spool.replay(sent.append) == 35
+    assert sent == [f"line {i}\n".encode() for i in range(5)]
+    assert spool.empty and spool.size == 0
+    assert segments(tmp_path) == []
+
+    #appending after a replay starts a new segment
+    spool.append(b"line 5\n")
+    sent = []
+    spool.replay(sent.append)
+    assert sent == [b"line 5\n"]
+    spool.close()
+
+def test_spool_can_be_replayed_repeatedly(tmp_path):
+    spool = IngestionSpool(str(tmp_path))
+    for round in range(3):
+        spool.append(f"round {round}\n".encode())
+        spool.append(f"round {round}\n".encode())
+        assert spool.pending == 2*(4+8)
+        sent = []
+        assert spool.replay(sent.append) == 16
+        assert sent == [f"round {round}\n".encode()]*2
+        assert spool.empty and segments(tmp_path) == []
+    spool.close()
+
+    #the numbering continues after a restart
+    spool = IngestionSpool(str(tmp_path))
+    spool.append(b"round 3\n")
+    spool.close()
+    spool = IngestionSpool(str(tmp_path))
+    sent = []
+    spool.replay(sent.append)
+    assert sent == [b"round 3\n"]
+    spool.close()
+
+def test_spool_is_bounded(tmp_path):
+    spool = IngestionSpool(str(tmp_path),max_bytes=30)
+    spool.append(b"x"*20)
+    with pytest.raises(Exception):
+        spool.append(b"x"*20)
+    spool.replay(lambda payload:None)
+    spool.append(b"x"*20)
+    spool.close()
+
+def test_spool_resumes_after_a_failed_replay(tmp_path):
+    spool = IngestionSpool(str(tmp_path),segment_bytes=1024)
+    for i in range(3):
+        spool.append(f"line {i}\n".encode())
+    sent = []
+    def send(payload:bytes)->None:
+        if len(sent) == 2:
+            raise ConnectionError("QuestDB is down")
+        sent.append(payload)
+    with pytest.raises(ConnectionError):
+        spool.replay(send)
+    assert spool.pending == 11
+    spool.close()
+
+    #the position survives a restart, the replayed records aren't sent twice
+    spool = IngestionSpool(str(tmp_path))
+    assert spool.pending == 11
+    spool.replay(sent.append)
+    assert sent == [f"line {i}\n".encode() for i in range(3)]
+    assert spool.empty
+    spool.close()
+
+def test_spool_cuts_off_torn_records(tmp_path):
+    spool = IngestionSpool(str(tmp_path))
+    spool.append(b"line 0\n")
+    spool.append(b"line 1\n")
+    spool.close()
+    path = os.path.join(str(tmp_path),segments(tmp_path)[0])
+    os.truncate(path,os.path.getsize(path)-3)
+
+    spool = IngestionSpool(str(tmp_path))
+    sent = []
+    spool.replay(sent.append)
+    assert sent == [b"line 0\n"]
+    spool.close()
@@ -0,0 +1,36 @@
+from finance_stock_scraper.lazy import LazyModule
+import subprocess
+import json
+import sys
+import pytest
+
+HEAVY_MODULES = ["yfinance","pandas_market_calendars","questdb.ingress"]
+
+def loaded_after_import(module:str)->list[str]:
+    code = f"import sys,json; import {module}; print(json.dumps([name for name in {HEAVY_MODULES!r} if name in sys.modules]))"
+    output = subprocess.run([sys.executable,"-c",code],capture_output=True,text=True,check=True).stdout
+    return json.loads(output)
+
+@pytest.mark.parametrize("module",[
+    "finance_stock_scraper.model.Ticker",
+    "finance_stock_scraper.TickerRepository",
+    "finance_stock_scraper.QuestClient",
+    "finance_stock_scraper.YFDataProvider",
+    "finance_stock_scraper.workflow",
+    "finance_stock_scraper.__main__",
+])
+def test_public_modules_defer_heavy_dependencies(module):
+    assert loaded_after_import(module) == []
+
+def test_lazy_module_imports_on_first_access():
+    module = LazyModule("json.decoder")
+    assert not module.is_loaded
+    assert module.JSONDecodeError is json.JSONDecodeError
+    assert module.is_loaded
+
+def test_lazy_module_forwards_patches(monkeypatch):
+    module = LazyModule("json")
+    monkeypatch.setattr(module,"dumps",lambda value:"patched")
+    assert json.dumps({}) == "patched"
+    monkeypatch.undo()
+    assert json.dumps({}) == "{}"
@@ -0,0 +1,69 @@
+from finance_stock_scraper import Scheduler as scheduler_module
+from finance_stock_scraper.LivePoller import LivePoller, CompleteBarsDataProvider
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from datetime import datetime
+import pandas as pd
+import pytest
+import pytz
+
+def utc(*args)->datetime:
+    return datetime(*args,tzinfo=pytz.UTC)
+
+class FakeDataProvider(object):
+    batch_size = 10
+
+    def get_data(self,tickers:list[str],start_date:datetime,end_date:datetime,interval:str):
+        index = pd.date_range(start_date,end_date,freq="5min",tz="UTC")
+        yield pd.DataFrame({"Close":range(len(index))},index=index),{}
+
+def test_provider_drops_bars_in_progress():
+    provider = CompleteBarsDataProvider(FakeDataProvider())
+    data,_ = next(provider.get_data(["A"],utc(2022,8,1,13,30),utc(2022,8,1,13,47),"5m"))
+    #the 13:45 bar closes at 13:50
+    assert list(data.index) == list(pd.date_range(utc(2022,8,1,13,30),utc(2022,8,1,13,40),freq="5min"))
+    assert provider.batch_size == 10
+
+def test_polls_open_sessions_at_the_bar_cadence():
+    #NASDAQ trades from 13:30 to 20:00 UTC on 2022-08-01, Saturday 2022-08-06 is closed
+    poller = LivePoller(ExecutionContext(None,FakeDataProvider(),None),intervals=["5m","1d"],delay=10)
+    assert poller.intervals == ["5m"]
+    assert poller.due_jobs(["NASDAQ"],utc(2022,8,1,13,0)) == []
+    assert poller.due_jobs(["NASDAQ"],utc(2022,8,6,15,0)) == []
+
+    #the first poll catches up, afterwards every bar is polled once it is complete
+    assert poller.due_jobs(["NASDAQ"],utc(2022,8,1,13,42)) == [("NASDAQ","5m")]
+    assert poller.seconds_until_next_poll(utc(2022,8,1,13,42)) == 190
+    assert poller.due_jobs(["NASDAQ"],utc(2022,8,1,13,45,5)) == []
+    assert poller.due_jobs(["NASDAQ"],utc(2022,8,1,13,45,10)) == [("NASDAQ","5m")]
+
+    #the last bar closes with the session, then the exchange is idle until the next session
+    assert poller.due_jobs(["NASDAQ"],utc(2022,8,1,20,0,10)) == [("NASDAQ","5m")]
+    assert poller.due_jobs(["NASDAQ"],utc(2022,8,1,20,30)) == []
+    assert poller.seconds_until_next_poll(utc(2022,8,1,20,30)) == poller.idle_sleep
+    assert poller.due_jobs(["NASDAQ"],utc(2022,8,2,13,35,10)) == [("NASDAQ","5m")]
+
+def test_polls_sessions_that_open_before_utc_midnight():
+    #the ASX session of 2022-12-05 (local date) runs from 2022-12-04 23:00 to 2022-12-05 05:10 UTC
+    poller = LivePoller(ExecutionContext(None,FakeDataProvider(),None),intervals=["5m"],delay=10)
+    assert poller.due_jobs(["ASX"],utc(2022,12,4,22,50)) == []
+    assert poller.due_jobs(["ASX"],utc(2022,12,4,23,5,10)) == [("ASX","5m")]
+    assert poller.due_jobs(["ASX"],utc(2022,12,5,0,0,10)) == [("ASX","5m")]
+    #after the close the next session opens on the same UTC day
+    assert poller.due_jobs(["ASX"],utc(2022,12,5,5,10,10)) == [("ASX","5m")]
+    assert poller.due_jobs(["ASX"],utc(2022,12,5,12,0)) == []
+    assert poller.due_jobs(["ASX"],utc(2022,12,5,23,5,10)) == [("ASX","5m")]
+
+def test_poll_runs_the_due_jobs(monkeypatch):
+    calls = []
+    def fake_gather_interval(exchange:str,interval:str,executionContext:ExecutionContext,now:datetime)->None:
+        assert isinstance(executionContext.yfDataProcider,CompleteBarsDataProvider)
+        calls.append((exchange,interval))
+    monkeypatch.setattr(scheduler_module,"gather_interval",fake_gather_interval)
+    poller = LivePoller(ExecutionContext(None,FakeDataProvider(),None),intervals=["1m","5m"])
+    results = poller.poll(["NASDAQ","XETR"],utc(2022,8,1,14,0,30))
+    assert sorted(calls) == [("NASDAQ","1m"),("NASDAQ","5m"),("XETR","1m"),("XETR","5m")]
+    assert all(result.succeeded for result in results)
+
+def test_live_mode_needs_intraday_intervals():
+    with pytest.raises(ValueError):
+        LivePoller(ExecutionContext(None,None,None),intervals=["1d"])
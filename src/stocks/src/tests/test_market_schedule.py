@@ -0,0 +1,37 @@
+from finance_stock_scraper.model.MarketSchedule import ScheduleCache
+from finance_stock_scraper.model.Ticker import Ticker
+import pandas_market_calendars as mcal
+import datetime
+import pytz
+
+def test_schedule_matches_market_calendar():
+    cache = ScheduleCache(window_days=60)
+    start,end = datetime.date(2022,6,1),datetime.date(2022,7,31)
+    expected = mcal.get_calendar("NASDAQ").schedule(start_date=start,end_date=end)
+    trading_days = {day.date() for day in expected.index}
+    day = start
+    while day <= end:
+        assert cache.is_trading_day("NASDAQ",day) == (day in trading_days)
+        day += datetime.timedelta(days=1)
+    assert cache.get_trading_times("NASDAQ",start,end).equals(expected)
+
+def test_schedule_lookups():
+    cache = ScheduleCache(window_days=30)
+    assert not cache.is_trading_day("NASDAQ",datetime.date(2022,7,4))
+    assert cache.market_close("NASDAQ",datetime.date(2022,7,4)) is None
+    close = cache.market_close("NASDAQ",datetime.datetime(2022,7,5,12,tzinfo=pytz.UTC))
+    assert close == datetime.datetime(2022,7,5,20,tzinfo=pytz.UTC)
+
+def test_schedule_is_shared_and_rebuilt_outside_window():
+    cache = ScheduleCache(window_days=30)
+    schedule = cache.get("NASDAQ",datetime.date(2022,7,1))
+    assert cache.get("nasdaq",datetime.date(2022,7,20)) is schedule
+    moved = cache.get("NASDAQ",datetime.date(2023,7,1))
+    assert moved is not schedule
+    assert moved.covers(datetime.date(2023,7,1))
+
+def test_ticker_uses_schedule_cache():
+    ticker = Ticker("GOOGL","NASDAQ")
+    assert ticker.is_in_trading_times(datetime.date(2022,7,5))
+    assert not ticker.is_in_trading_times(datetime.date(2022,7,9))
+    assert len(ticker.get_trading_times(datetime.date(2022,7,1),datetime.date(2022,7,8))) == 5
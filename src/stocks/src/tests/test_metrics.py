@@ -0,0 +1,88 @@
+from finance_stock_scraper.Metrics import Metric, MetricsRegistry, MetricsServer, JOB_SECONDS, LAST_SUCCESS
+from finance_stock_scraper import Scheduler as scheduler_module
+from finance_stock_scraper.Scheduler import Scheduler
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from datetime import datetime
+import urllib.request
+import urllib.error
+import pytest
+
+def test_registry_renders_prometheus_text_format():
+    registry = MetricsRegistry()
+    rows = registry.counter("rows_total","Ingested rows",["interval"])
+    latency = registry.histogram("latency_seconds","Latency",buckets=(0.1,1))
+    rows.inc(10,interval="5m")
+    rows.inc(5,interval="5m")
+    rows.inc(1,interval="1d")
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE rows_total counter" in lines
+    assert 'rows_total{interval="5m"} 15' in lines
+    assert 'rows_total{interval="1d"} 1' in lines
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 5.55" in lines
+    assert "latency_seconds_count 3" in lines
+
+def test_metrics_validate_labels_and_values():
+    registry = MetricsRegistry()
+    rows = registry.counter("rows_total","Ingested rows",["interval"])
+    with pytest.raises(ValueError):
+        rows.inc(1)
+    with pytest.raises(ValueError):
+        rows.inc(-1,interval="5m")
+    with pytest.raises(ValueError):
+        registry.counter("rows_total","Duplicate")
+
+def test_gauges_go_up_and_down():
+    registry = MetricsRegistry()
+    pending = registry.gauge("pending_bytes","Pending bytes")
+    pending.inc(10)
+    pending.dec(4)
+    pending.inc(-2)
+    assert pending.value() == 4
+    pending.set(1)
+    assert "pending_bytes 1" in registry.render().splitlines()
+    with pytest.raises(ValueError):
+        registry.counter("rows_total","Rows").inc(-1)
+    #the base class only defines how metrics are rendered
+    with pytest.raises(TypeError):
+        Metric("untyped","Untyped")
+
+def test_server_exposes_metrics():
+    registry = MetricsRegistry()
+    registry.gauge("up","Scraper is running").set(1)
+    server = MetricsServer(registry,"127.0.0.1",0).start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert response.status == 200
+            assert "up 1" in response.read().decode().splitlines()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other")
+    finally:
+        server.stop()
+
+class FakeQuestClient(object):
+    def create_table(self,interval:str)->None:
+        pass
+
+    def close_ingestion(self)->None:
+        pass
+
+def test_scheduler_records_job_metrics(monkeypatch):
+    def fake_gather_interval(exchange:str,interval:str,executionContext:ExecutionContext,now:datetime)->None:
+        if interval == "1d":
+            raise ValueError("Yahoo is down")
+    monkeypatch.setattr(scheduler_module,"gather_interval",fake_gather_interval)
+    succeeded = JOB_SECONDS.count(exchange="METRICS",interval="5m",status="succeeded")
+    failed = JOB_SECONDS.count(exchange="METRICS",interval="1d",status="failed")
+    Scheduler(ExecutionContext(None,None,FakeQuestClient()),intervals=["5m","1d"]).run(["METRICS"],datetime.now())
+    assert JOB_SECONDS.count(exchange="METRICS",interval="5m",status="succeeded") == succeeded+1
+    assert JOB_SECONDS.count(exchange="METRICS",interval="1d",status="failed") == failed+1
+    assert LAST_SUCCESS.value(exchange="METRICS",interval="5m") > 0
+    assert LAST_SUCCESS.value(exchange="METRICS",interval="1d") == 0
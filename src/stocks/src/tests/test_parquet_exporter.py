@@ -0,0 +1,78 @@
+from finance_stock_scraper.ParquetExporter import ParquetExporter, month_windows
+from finance_stock_scraper.QuestClient import QuestClient
+from datetime import datetime
+import pandas as pd
+import pytest
+import pytz
+import re
+
+def build_table()->pd.DataFrame:
+    timestamps = pd.date_range("2022-01-30","2022-03-10",freq="1D")
+    frames = []
+    for exchange,ticker in [("NASDAQ","MSFT"),("NASDAQ","AAPL"),("EUREX","SAP.DE")]:
+        frames.append(pd.DataFrame({"exchange":exchange,"ticker":ticker,"timestamp":timestamps,
+                                    "open":1.0,"high":2.0,"low":0.5,"close":1.5,"adj_close":1.5,"volume":100}))
+    return pd.concat(frames).sort_values("timestamp",kind="stable").reset_index(drop=True)
+
+class FakeQuestClient(QuestClient):
+    """
+    Answers the export queries from an in memory table
+    """
+    def __init__(self,table:pd.DataFrame,fail_after:int|None=None) -> None:
+        super().__init__("localhost")
+        self.table = table
+        self.queries = 0
+        self.fail_after = fail_after
+
+    def get_earliest_timestamp(self,interval:str)->datetime:
+        return self.table["timestamp"].min().to_pydatetime().replace(tzinfo=pytz.UTC)
+
+    def get_latest_timestamp(self,interval:str)->datetime:
+        return self.table["timestamp"].max().to_pydatetime().replace(tzinfo=pytz.UTC)
+
+    def query_frame(self,query:str)->pd.DataFrame|None:
+        self.queries += 1
+        if self.fail_after is not None and self.queries > self.fail_after:
+            return None
+        start,end = [pd.Timestamp(time.rstrip("Z")) for time in re.findall(r"'(\d{4}-[^']+)'",query)]
+        rows = self.table[(self.table["timestamp"] >= start) & (self.table["timestamp"] < end)]
+        return rows.astype({"exchange":"category","ticker":"category"}).reset_index(drop=True)
+
+def test_month_windows():
+    assert list(month_windows(datetime(2022,11,15),datetime(2023,1,2))) == [
+        (datetime(2022,11,1),datetime(2022,12,1)),
+        (datetime(2022,12,1),datetime(2023,1,1)),
+        (datetime(2023,1,1),datetime(2023,2,1)),
+    ]
+
+def test_export_writes_hive_partitions(tmp_path):
+    table = build_table()
+    exporter = ParquetExporter(FakeQuestClient(table),str(tmp_path),chunk_bars=7)
+    assert exporter.export("1d") == len(table)
+
+    exported = pd.read_parquet(tmp_path/"interval_1d")
+    assert len(exported) == len(table)
+    assert sorted(exported["exchange"].astype(str).unique()) == ["EUREX","NASDAQ"]
+    assert sorted(exported["month"].unique()) == [1,2,3]
+    assert (tmp_path/"interval_1d"/"exchange=NASDAQ"/"year=2022"/"month=02"/"part-0.parquet").is_file()
+    february = pd.read_parquet(tmp_path/"interval_1d"/"exchange=NASDAQ"/"year=2022"/"month=02"/"part-0.parquet")
+    assert len(february) == 2*28
+    assert february["timestamp"].is_monotonic_increasing
+    #the last month isn't complete yet
+    assert exporter.completed_months("1d") == {"2022-01","2022-02"}
+
+def test_interrupted_export_resumes(tmp_path):
+    table = build_table()
+    questClient = FakeQuestClient(table,fail_after=3)
+    exporter = ParquetExporter(questClient,str(tmp_path),chunk_bars=7)
+    with pytest.raises(Exception):
+        exporter.export("1d")
+    assert exporter.completed_months("1d") == {"2022-01"}
+    #the unfinished month never gets its final file name
+    assert not (tmp_path/"interval_1d"/"exchange=NASDAQ"/"year=2022"/"month=02"/"part-0.parquet").exists()
+
+    questClient.fail_after = None
+    questClient.queries = 0
+    assert exporter.export("1d") == len(table[table["timestamp"] >= "2022-02-01"])
+    assert len(pd.read_parquet(tmp_path/"interval_1d")) == len(table)
+    assert not list(tmp_path.rglob("*.tmp"))
@@ -0,0 +1,123 @@
+from finance_stock_scraper import QuestClient as quest_client_module
+from finance_stock_scraper.QuestClient import QuestClient
+from finance_stock_scraper.model.Ticker import Ticker
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import json
+import re
+import pandas as pd
+import pytest
+
+class ExecHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    failures = 0
+
+    def do_GET(self):
+        if ExecHandler.failures > 0:
+            ExecHandler.failures -= 1
+            status,body = 503,b"{}"
+        else:
+            status,body = 200,json.dumps({"dataset":[["A"]]}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1",0),ExecHandler)
+    thread = threading.Thread(target=server.serve_forever,daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    ExecHandler.failures = 0
+
+def test_client_reuses_connections(server):
+    client = QuestClient("127.0.0.1",port=server.server_address[1],monitoring_port=server.server_address[1])
+    for _ in range(10):
+        assert client.raw_query("SELECT 1").status_code == 200
+    assert client.health_check()
+    stats = client.connection_stats()
+    assert stats["requests"] == 11
+    assert stats["connections"] == 1
+    assert stats["reused"] == 10
+    client.close()
+
+def test_client_can_be_shared_across_threads(server):
+    client = QuestClient("127.0.0.1",port=server.server_address[1],pool_size=4)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        codes = list(executor.map(lambda _:client.raw_query("SELECT 1").status_code,range(40)))
+    assert codes == [200]*40
+    stats = client.connection_stats()
+    assert stats["requests"] == 40
+    assert stats["connections"] <= 4
+    client.close()
+
+def test_client_retries_unavailable_server(server):
+    ExecHandler.failures = 2
+    client = QuestClient("127.0.0.1",port=server.server_address[1],retries=3,retry_backoff=0)
+    assert client.raw_query("SELECT 1").status_code == 200
+    client.close()
+
+class PagedQuestClient(QuestClient):
+    """
+    Answers the paged export queries from an in memory table
+    """
+    def __init__(self,table:pd.DataFrame) -> None:
+        super().__init__("localhost")
+        self.table = table
+        self.queries = []
+
+    def query_frame(self,query:str)->pd.DataFrame|None:
+        self.queries.append(query)
+        rows = self.table
+        if start := re.search(r"timestamp (?:>=|BETWEEN) '([^']*)'",query):
+            rows = rows[rows["timestamp"] >= pd.Timestamp(start.group(1).rstrip("Z"))]
+        if end := re.search(r"AND '([^']*)' AND",query):
+            rows = rows[rows["timestamp"] <= pd.Timestamp(end.group(1).rstrip("Z"))]
+        tickers = re.findall(r"'([^']*)'",re.search(r"IN \((.*)\)",query).group(1))
+        rows = rows[rows["ticker"].isin(tickers)].sort_values(["timestamp","ticker"])
+        lo,hi = [int(value) for value in re.search(r"LIMIT (\d+),(\d+)",query).groups()]
+        return rows.iloc[lo:hi][["ticker","timestamp","close"]].reset_index(drop=True)
+
+@pytest.mark.parametrize("page_size",[1,2,3,7,100])
+def test_iter_frames_pages_through_ties(page_size):
+    #three tickers share every timestamp => pages regularly end in the middle of a timestamp
+    timestamps = pd.date_range("2022-08-01",periods=5,freq="1D")
+    table = pd.DataFrame([(ticker,timestamp,float(i)) for i,timestamp in enumerate(timestamps) for ticker in ["A","B","C"]],columns=["ticker","timestamp","close"])
+    client = PagedQuestClient(table)
+    pages = list(client.iter_frames([Ticker(ticker,"NASDAQ") for ticker in ["A","B","C"]],"1d",page_size=page_size))
+    assert all(len(page) <= page_size for page in pages)
+    result = pd.concat(pages,ignore_index=True)
+    pd.testing.assert_frame_equal(result,table.sort_values(["timestamp","ticker"]).reset_index(drop=True))
+    #every page is one request
+    assert len(client.queries) in (len(pages),len(pages)+1)
+
+def test_iter_frames_keeps_full_batches(monkeypatch):
+    monkeypatch.setattr(quest_client_module,"MAX_URL_LENGTH",400)
+    tickers = [f"T{i:02d}" for i in range(40)]
+    timestamps = pd.date_range("2022-08-01",periods=10,freq="1D")
+    table = pd.DataFrame([(ticker,timestamp,float(i)) for i,timestamp in enumerate(timestamps) for ticker in tickers],columns=["ticker","timestamp","close"])
+    client = PagedQuestClient(table)
+    pages = list(client.iter_frames([Ticker(ticker,"NASDAQ") for ticker in tickers],"1d",page_size=7))
+    assert sum(len(page) for page in pages) == 400
+    #the later pages add the cursor predicate and a longer LIMIT, they still fit into the url
+    assert any("timestamp >=" in query for query in client.queries)
+    assert all(len(client._query_url(query,"exp")) <= 400 for query in client.queries)
+
+def test_iter_frames_converts_the_window_to_utc():
+    timestamps = pd.date_range("2022-08-01",periods=24,freq="1h")
+    table = pd.DataFrame([("A",timestamp,float(i)) for i,timestamp in enumerate(timestamps)],columns=["ticker","timestamp","close"])
+    client = PagedQuestClient(table)
+    start = pd.Timestamp("2022-08-01 12:00",tz="Europe/Berlin").to_pydatetime()
+    pages = list(client.iter_frames(Ticker("A","NASDAQ"),"1h",start_date=start,page_size=5))
+    result = pd.concat(pages,ignore_index=True)
+    #12:00 in Berlin is 10:00 UTC
+    assert result["timestamp"].iloc[0] == pd.Timestamp("2022-08-01 10:00")
+    assert len(result) == 14
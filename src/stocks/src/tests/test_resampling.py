@@ -0,0 +1,116 @@
+from finance_stock_scraper import workflow
+from finance_stock_scraper.resampling import resample, bucket_bounds
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from finance_stock_scraper.model.Ticker import Ticker
+from datetime import datetime,timedelta
+import numpy as np
+import pandas as pd
+import pytz
+
+class FakeQuestClient(object):
+    def __init__(self) -> None:
+        self.flushed = []
+
+    def submit_points(self,buffer,rows:int=0)->None:
+        self.flushed.append(str(buffer))
+
+def build_sessions(tickers:list[str],days:list[str],seed:int=0)->pd.DataFrame:
+    """
+    Regular NYSE sessions (09:30-16:00) of 5m bars
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.DatetimeIndex(np.concatenate([pd.date_range(f"{day} 09:30",f"{day} 15:55",freq="5min",tz="America/New_York") for day in days]))
+    columns = pd.MultiIndex.from_product([tickers,["Open","High","Low","Close","Adj Close","Volume"]])
+    df = pd.DataFrame(rng.random((len(index),len(columns)))*100,index=index,columns=columns)
+    for ticker in tickers:
+        df[(ticker,"Volume")] = rng.integers(0,1_000_000,len(index)).astype(np.float64)
+    return df
+
+def reference(long_frame:pd.DataFrame,offset:str)->pd.DataFrame:
+    df = long_frame.copy()
+    df["bucket"] = (df["timestamp"].dt.tz_convert("America/New_York")-pd.Timedelta(offset)).dt.floor("1h")+pd.Timedelta(offset)
+    grouped = df.groupby(["ticker","bucket"],observed=True,sort=False)
+    return grouped.agg(open=("open","first"),high=("high","max"),low=("low","min"),close=("close","last"),adj_close=("adj_close","last"),volume=("volume","sum")).reset_index()
+
+def test_resample_matches_groupby_and_respects_sessions():
+    tickers = [Ticker(name,"NYSE") for name in ["A","B"]]
+    long_frame = workflow.to_long_frame(build_sessions(["A","B"],["2022-08-01","2022-08-02"]),tickers)
+    bars = resample(long_frame,timedelta(minutes=5),timedelta(hours=1),"NYSE")
+    #7 bars per session and ticker, the last one only lasts 30 minutes
+    assert len(bars) == 2*2*7
+    local = bars["timestamp"].dt.tz_convert("America/New_York")
+    assert set(local.dt.strftime("%H:%M")) == {"09:30","10:30","11:30","12:30","13:30","14:30","15:30"}
+    expected = reference(long_frame,"30min")
+    for column in ["open","high","low","close","adj_close","volume"]:
+        assert np.allclose(bars[column].to_numpy(),expected[column].to_numpy())
+    assert list(bars["ticker"]) == list(expected["ticker"])
+
+def test_resample_skips_incomplete_and_already_derived_bars():
+    tickers = [Ticker("A","NYSE")]
+    data = build_sessions(["A"],["2022-08-01"])
+    #the data starts at 09:45 and ends at 15:00 => the first and the last bars are incomplete
+    data = data.loc["2022-08-01 09:45":"2022-08-01 14:55"]
+    long_frame = workflow.to_long_frame(data,tickers)
+    bars = resample(long_frame,timedelta(minutes=5),timedelta(hours=1),"NYSE")
+    assert list(bars["timestamp"].dt.tz_convert("America/New_York").dt.strftime("%H:%M")) == ["10:30","11:30","12:30","13:30"]
+
+    #bars that ended before the last stored entry were derived by an earlier run
+    minimal_date = pd.Timestamp("2022-08-01 12:25",tz="America/New_York")
+    bars = resample(long_frame,timedelta(minutes=5),timedelta(hours=1),"NYSE",minimal_date.value)
+    assert list(bars["timestamp"].dt.tz_convert("America/New_York").dt.strftime("%H:%M")) == ["12:30","13:30"]
+
+def test_bucket_bounds_without_calendar_aligns_to_epoch():
+    timestamps = pd.to_datetime(["2022-08-01 10:10","2022-08-01 10:59"],utc=True).asi8
+    starts,ends = bucket_bounds(timestamps,3_600_000_000_000,np.array([],dtype=np.int64),np.array([],dtype=np.int64))
+    assert list(pd.to_datetime(starts,utc=True)) == [pd.Timestamp("2022-08-01 10:00",tz="UTC")]*2
+    assert (ends-starts == 3_600_000_000_000).all()
+
+def test_get_derived_intervals():
+    configured = ["5m","30m","1d"]
+    derived = ["15m","1h","90m","1d"]
+    assert workflow.get_derived_intervals("5m",configured,derived) == ["15m"]
+    assert workflow.get_derived_intervals("30m",configured,derived) == ["1h","90m"]
+    assert workflow.get_derived_intervals("1d",configured,derived) == []
+    assert workflow.get_derived_intervals("5m",configured,[]) == []
+
+def test_store_points_writes_derived_intervals(monkeypatch):
+    monkeypatch.setattr(workflow,"CONFIGURED_INTERVALS",["5m","1d"])
+    monkeypatch.setattr(workflow,"DERIVED_INTERVALS",["15m","1h"])
+    tickers = [Ticker("A","NYSE")]
+    questClient = FakeQuestClient()
+    workflow.store_points(build_sessions(["A"],["2022-08-01"]),tickers,"Test",ExecutionContext(None,None,questClient),"5m","NYSE")
+    lines = "".join(questClient.flushed).splitlines()
+    assert len([line for line in lines if line.startswith("interval_5m,")]) == 78
+    assert len([line for line in lines if line.startswith("interval_15m,")]) == 26
+    assert len([line for line in lines if line.startswith("interval_1h,")]) == 7
+
+class SessionDataProvider(object):
+    """
+    Returns the bars of the sessions between the start and the (exclusive) end like yfinance
+    """
+    def __init__(self,sessions:pd.DataFrame) -> None:
+        self.sessions = sessions
+        self.requests = []
+
+    def get_data(self,tickers:list[str],start_date:datetime,end_date:datetime,interval:str):
+        self.requests.append((start_date,end_date))
+        yield self.sessions[(self.sessions.index >= start_date) & (self.sessions.index < end_date)],{}
+
+def test_download_in_slices_derives_bars_across_the_slice_boundary(monkeypatch):
+    monkeypatch.setattr(workflow,"CONFIGURED_INTERVALS",["5m","1d"])
+    monkeypatch.setattr(workflow,"DERIVED_INTERVALS",["1h"])
+    questClient = FakeQuestClient()
+    provider = SessionDataProvider(build_sessions(["A"],["2022-08-01","2022-08-02","2022-08-03"]))
+    #the slices are cut at 2022-08-02 12:00 EDT, inside the 11:30-12:30 bar
+    start = datetime(2022,8,1,16,0,tzinfo=pytz.UTC)
+    workflow.download_in_slices([Ticker("A","NYSE")],"5m","NYSE",start,start+timedelta(days=2),ExecutionContext(None,provider,questClient),slice_size=1,lookback=timedelta(hours=1),minimal_dates=start)
+    assert provider.requests[1][0] == start+timedelta(days=1)-timedelta(hours=1)
+    lines = "".join(questClient.flushed).splitlines()
+    timestamps = lambda table:[int(line.rsplit(" ",1)[1]) for line in lines if line.startswith(f"{table},")]
+    #every 5m bar after the start is stored once
+    assert len(timestamps("interval_5m")) == len(set(timestamps("interval_5m"))) == 78*2-1
+    hourly = timestamps("interval_1h")
+    assert len(hourly) == len(set(hourly))
+    assert pd.Timestamp("2022-08-02 11:30",tz="America/New_York").value in hourly
+    #the bars ending after 12:00 of the first day, all bars of the second day and the complete ones before 12:00 of the third day
+    assert len(hourly) == 5+7+2
@@ -0,0 +1,72 @@
+from finance_stock_scraper import Scheduler as scheduler_module
+from finance_stock_scraper.Scheduler import Scheduler
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from finance_stock_scraper.CompleteBarsDataProvider import CompleteBarsDataProvider
+from finance_stock_scraper.model.Ticker import Ticker
+from datetime import datetime
+import threading
+
+class FakeQuestClient(object):
+    def __init__(self) -> None:
+        self.tables = []
+        self.closed = 0
+
+    def create_table(self,interval:str)->None:
+        self.tables.append(interval)
+
+    def close_ingestion(self)->None:
+        self.closed += 1
+
+def test_scheduler_runs_jobs_concurrently_and_isolates_failures(monkeypatch):
+    #every job waits until all 4 jobs are running => a sequential scheduler breaks the barrier
+    barrier = threading.Barrier(4,timeout=5)
+    
+    def fake_gather_interval(exchange:str,interval:str,executionContext:ExecutionContext,now:datetime)->None:
+        barrier.wait()
+        if exchange == "EUREX" and interval == "1d":
+            raise ValueError("No tickers found for exchange EUREX")
+        
+    monkeypatch.setattr(scheduler_module,"gather_interval",fake_gather_interval)
+    questClient = FakeQuestClient()
+    scheduler = Scheduler(ExecutionContext(None,None,questClient),workers=4,intervals=["5m","1d"])
+    results = scheduler.run(["NASDAQ","EUREX"],datetime.now())
+    
+    assert not barrier.broken
+    assert len(results) == 4
+    failed = [result for result in results if not result.succeeded]
+    assert [(result.exchange,result.interval) for result in failed] == [("EUREX","1d")]
+    assert questClient.tables == ["5m","1d"]
+    assert questClient.closed == 1
+
+class FailingTableQuestClient(FakeQuestClient):
+    def create_table(self,interval:str)->None:
+        if interval == "5m":
+            raise ConnectionError("QuestDB is down")
+        super().create_table(interval)
+
+def test_scheduler_skips_intervals_that_cannot_be_prepared(monkeypatch):
+    jobs = []
+    monkeypatch.setattr(scheduler_module,"gather_interval",lambda exchange,interval,executionContext,now:jobs.append((exchange,interval)))
+    questClient = FailingTableQuestClient()
+    results = Scheduler(ExecutionContext(None,None,questClient),workers=2,intervals=["5m","1d"]).run(["NASDAQ","EUREX"],datetime.now())
+    assert sorted(jobs) == [("EUREX","1d"),("NASDAQ","1d")]
+    assert all(result.succeeded for result in results) and len(results) == 2
+    assert questClient.closed == 1
+
+def test_scheduler_without_exchanges_does_nothing():
+    questClient = FakeQuestClient()
+    assert Scheduler(ExecutionContext(None,None,questClient)).run([],datetime.now()) == []
+    assert questClient.closed == 0
+
+def test_backfill_runs_only_the_new_tickers(monkeypatch):
+    jobs = []
+    def fake_gather_interval(exchange:str,interval:str,executionContext:ExecutionContext,now:datetime)->None:
+        assert isinstance(executionContext.yfDataProcider,CompleteBarsDataProvider)
+        jobs.append((exchange,interval,tuple(ticker.ticker for ticker in executionContext.tickerRepository.get_tickers(exchange))))
+    monkeypatch.setattr(scheduler_module,"gather_interval",fake_gather_interval)
+    questClient = FakeQuestClient()
+    scheduler = Scheduler(ExecutionContext(None,None,questClient),workers=2,intervals=["5m","1d"])
+    results = scheduler.backfill([Ticker("MSFT","NASDAQ"),Ticker("SAP.DE","EUREX"),Ticker("AAPL","NASDAQ")],datetime.now())
+    assert all(result.succeeded for result in results)
+    assert sorted(jobs) == [("EUREX","1d",("SAP.DE",)),("EUREX","5m",("SAP.DE",)),("NASDAQ","1d",("MSFT","AAPL")),("NASDAQ","5m",("MSFT","AAPL"))]
+    assert questClient.closed == 1
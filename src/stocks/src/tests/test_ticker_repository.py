@@ -0,0 +1,351 @@
+from finance_stock_scraper import QuestClient as quest_client_module
+from finance_stock_scraper.QuestClient import QuestClient
+from finance_stock_scraper.TickerRepository import TickerRepository
+from finance_stock_scraper.model.Ticker import Ticker
+from finance_stock_scraper.ParquetCache import ParquetCache
+from datetime import datetime
+import io
+import os
+import re
+import pytest
+import pandas as pd
+import numpy as np
+import pytz
+
+class FakeResponse(object):
+    def __init__(self,payload:dict,status_code:int=200) -> None:
+        self.payload = payload
+        self.status_code = status_code
+        self.raw = None
+
+    def close(self)->None:
+        pass
+
+    def json(self)->dict:
+        return self.payload
+
+class FakeQuestClient(QuestClient):
+    """
+    Answers `ticker IN (...)` queries from an in memory table and records the executed queries
+    """
+    def __init__(self,rows:list[list]) -> None:
+        super().__init__("localhost")
+        self.rows = rows
+        self.queries = []
+
+    def raw_query(self,query:str):
+        self.queries.append(query)
+        exchange = re.search(r"exchange='([^']*)'",query).group(1)
+        rows = self.rows
+        if between := re.search(r"timestamp BETWEEN '([^']*)' AND '([^']*)'",query):
+            rows = [row for row in rows if between.group(1) <= row[2] <= between.group(2)]
+        if " IN (" in query:
+            tickers = re.findall(r"'([^']*)'",re.search(r"IN \((.*)\)",query).group(1))
+            rows = [row for row in rows if row[0] == exchange and row[1] in tickers]
+        else:
+            ticker = re.search(r"ticker='([^']*)'",query).group(1)
+            rows = [row for row in rows if row[0] == exchange and row[1] == ticker]
+        #every price column holds the value of the row, the volume its integer part
+        columns = re.search(r"SELECT (.*) FROM",query).group(1).split(",")
+        values = {"ticker":lambda row:row[1],"timestamp":lambda row:row[2],"volume":lambda row:int(row[3])}
+        dataset = [[values.get(column,lambda row:row[3])(row) for column in columns] for row in rows]
+        return FakeResponse({"dataset":dataset})
+
+    def get_latest_timestamp(self,interval:str):
+        return datetime.strptime(max(row[2] for row in self.rows),"%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=pytz.UTC)
+
+    def raw_export(self,query:str):
+        dataset = self.raw_query(query).json()["dataset"]
+        columns = re.search(r"SELECT (.*) FROM",query).group(1).split(",")
+        lines = [",".join(f'"{column}"' for column in columns)]
+        lines += [",".join(f'"{value}"' if isinstance(value,str) else str(value) for value in row) for row in dataset]
+        response = FakeResponse(None)
+        response.raw = io.BytesIO(("\r\n".join(lines)+"\r\n").encode())
+        return response
+
+def build_rows(exchange:str,tickers:list[str],periods:int)->list[list]:
+    rows = []
+    for i,ticker in enumerate(tickers):
+        for j in range(periods):
+            rows.append([exchange,ticker,f"2022-08-0{j+1}T00:00:00.000000Z",float(i*100+j)])
+    return rows
+
+def test_get_values_uses_one_query_per_exchange():
+    questClient = FakeQuestClient(build_rows("NASDAQ",["A","B","C"],3)+build_rows("EUREX",["D"],2))
+    repo = TickerRepository(questClient)
+    tickers = [Ticker("A","NASDAQ"),Ticker("D","EUREX"),Ticker("B","NASDAQ"),Ticker("C","NASDAQ"),Ticker("E","NASDAQ")]
+    result = repo.get_values(tickers,"1d")
+    assert len(questClient.queries) == 2
+    assert list(result.keys()) == ["A","D","B","C","E"]
+    assert list(result["B"]["close"]) == [100.0,101.0,102.0]
+    assert result["B"].index[0] == datetime(2022,8,1)
+    assert len(result["D"]) == 2
+    assert len(result["E"]) == 0
+    assert list(result["E"].columns) == ["close"]
+
+def test_get_values_splits_batches_by_url_length(monkeypatch):
+    names = [f"TICKER{i}" for i in range(200)]
+    questClient = FakeQuestClient(build_rows("NASDAQ",names,1))
+    monkeypatch.setattr(quest_client_module,"MAX_URL_LENGTH",1000)
+    result = TickerRepository(questClient).get_values([Ticker(name,"NASDAQ") for name in names],"1d")
+    assert len(questClient.queries) > 1
+    assert all(len(questClient._query_url(query)) <= 1000 for query in questClient.queries)
+    assert len(result) == 200
+    assert all(len(df) == 1 for df in result.values())
+
+def test_csv_read_mode_matches_json_read_mode():
+    questClient = FakeQuestClient(build_rows("NASDAQ",["A","B"],5))
+    tickers = [Ticker("B","NASDAQ"),Ticker("A","NASDAQ")]
+    json_result = TickerRepository(questClient,read_mode="JSON").get_values(tickers,"1d")
+    csv_result = TickerRepository(questClient,read_mode="CSV").get_values(tickers,"1d")
+    assert list(json_result.keys()) == list(csv_result.keys())
+    for ticker in json_result:
+        assert json_result[ticker].equals(csv_result[ticker])
+    
+    json_single = TickerRepository(questClient,read_mode="JSON").get_values(tickers[0],"1d")
+    csv_single = TickerRepository(questClient,read_mode="CSV").get_values(tickers[0],"1d")
+    assert json_single.equals(csv_single)
+
+def test_cache_only_fetches_missing_ranges(tmp_path):
+    questClient = FakeQuestClient(build_rows("NASDAQ",["A","B"],9))
+    repo = TickerRepository(questClient,cache=ParquetCache(str(tmp_path)))
+    tickers = [Ticker("A","NASDAQ"),Ticker("B","NASDAQ")]
+    
+    first = repo.get_values(tickers,"1d",start_time=datetime(2022,8,2),end_time=datetime(2022,8,4))
+    assert len(questClient.queries) == 1
+    assert list(first["A"]["close"]) == [1.0,2.0,3.0]
+    
+    #fully cached
+    again = repo.get_values(tickers,"1d",values=["close","volume"],start_time=datetime(2022,8,2),end_time=datetime(2022,8,3))
+    assert len(questClient.queries) == 1
+    assert list(again["B"]["close"]) == [101.0,102.0]
+    assert list(again["B"].columns) == ["close","volume"]
+    
+    #only the missing tail is fetched
+    extended = repo.get_values(tickers[0],"1d",start_time=datetime(2022,8,3),end_time=datetime(2022,8,6))
+    assert len(questClient.queries) == 2
+    assert "2022-08-04T00:00:00" in questClient.queries[-1]
+    assert list(extended["close"]) == [2.0,3.0,4.0,5.0]
+
+def test_cache_extends_with_new_data(tmp_path):
+    questClient = FakeQuestClient(build_rows("NASDAQ",["A"],3))
+    repo = TickerRepository(questClient,cache=ParquetCache(str(tmp_path)))
+    ticker = Ticker("A","NASDAQ")
+    assert len(repo.get_values(ticker,"1d")) == 3
+    queries = len(questClient.queries)
+    assert len(repo.get_values(ticker,"1d")) == 3
+    assert len(questClient.queries) == queries
+    
+    questClient.rows = build_rows("NASDAQ",["A"],5)
+    assert list(repo.get_values(ticker,"1d")["close"]) == [0.0,1.0,2.0,3.0,4.0]
+    assert len(questClient.queries) == queries+1
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    names = [f"T{i}" for i in range(5)]
+    questClient = FakeQuestClient(build_rows("NASDAQ",names,5))
+    cache = ParquetCache(str(tmp_path),max_size_mb=1)
+    repo = TickerRepository(questClient,cache=cache)
+    repo.get_values([Ticker(name,"NASDAQ") for name in names],"1d")
+    entry_size = cache.size//5
+    cache.max_size = entry_size*3
+    repo.get_values(Ticker("T0","NASDAQ"),"1d")
+    assert len(cache.ranges("1d","NASDAQ","T0")) == 1
+    assert cache.size <= cache.max_size
+
+def test_cache_smaller_than_the_request_returns_all_rows(tmp_path):
+    names = [f"T{i}" for i in range(5)]
+    questClient = FakeQuestClient(build_rows("NASDAQ",names,5))
+    cache = ParquetCache(str(tmp_path),max_size_mb=0)
+    result = TickerRepository(questClient,cache=cache).get_values([Ticker(name,"NASDAQ") for name in names],"1d")
+    assert all(len(df) == 5 for df in result.values())
+    assert cache.size == 0
+
+def test_cache_fetches_tickers_that_are_ingested_later(tmp_path):
+    questClient = FakeQuestClient(build_rows("NASDAQ",["A"],5))
+    repo = TickerRepository(questClient,cache=ParquetCache(str(tmp_path)))
+    tickers = [Ticker("A","NASDAQ"),Ticker("B","NASDAQ")]
+    assert len(repo.get_values(tickers,"1d")["B"]) == 0
+    #B is backfilled inside the range that is covered for A
+    questClient.rows = build_rows("NASDAQ",["A","B"],5)
+    result = repo.get_values(tickers,"1d")
+    assert len(result["A"]) == 5
+    assert list(result["B"]["close"]) == [100.0,101.0,102.0,103.0,104.0]
+
+def test_registry_indexes_symbols_per_exchange(tmp_path):
+    (tmp_path/"nasdaq.csv").write_text("tickers\nmsft\nAAPL\nGOOGL\n")
+    (tmp_path/"EUREX.csv").write_text("tickers\nADS.DE\nSAP.DE\n")
+    repo = TickerRepository(None)
+    repo.load_tickers(str(tmp_path))
+    assert len(repo) == 5
+    assert sorted(repo.get_exchanges()) == ["EUREX","NASDAQ"]
+    assert [ticker.ticker for ticker in repo.get_tickers("NASDAQ")] == ["MSFT","AAPL","GOOGL"]
+    assert repo.get_ticker("sap.de") == Ticker("SAP.DE","EUREX")
+    assert repo.lookup("MSFT") == ("NASDAQ",0)
+    assert repo.get_ticker("UNKNOWN") is None and repo.lookup("UNKNOWN") is None
+    #the symbols are shared with the ticker records
+    assert repo.get_ticker("AAPL").ticker is Ticker("aapl","NASDAQ").ticker
+
+    assert [ticker.ticker for ticker in repo.difference("NASDAQ",["AAPL","SAP.DE"])] == ["MSFT","GOOGL"]
+    assert repo.remove("aapl")
+    assert not repo.remove("AAPL")
+    assert repo.get_ticker("AAPL") is None
+    assert list(repo.exchanges["NASDAQ"]) == ["MSFT","GOOGL"]
+
+    #the same symbol can be listed on another exchange
+    repo.add_ticker(Ticker("MSFT","EUREX"))
+    assert repo.lookup("MSFT") == ("NASDAQ",0)
+    #the slot of AAPL is reused
+    assert repo.lookup("MSFT","eurex") == ("EUREX",1)
+    assert [ticker.ticker for ticker in repo.get_tickers("NASDAQ")] == ["MSFT","GOOGL"]
+    assert [ticker.ticker for ticker in repo.get_tickers("EUREX")] == ["ADS.DE","SAP.DE","MSFT"]
+    assert len(repo) == 5
+    assert repo.remove("MSFT","EUREX")
+    assert repo.get_ticker("MSFT") == Ticker("MSFT","NASDAQ")
+
+def test_registry_reuses_the_slots_of_removed_tickers(tmp_path):
+    nasdaq = tmp_path/"NASDAQ.csv"
+    repo = TickerRepository(None)
+    for round in range(5):
+        nasdaq.write_text("tickers\n"+"\n".join(f"T{round}{i}" for i in range(10))+"\n")
+        repo.reload_tickers(str(tmp_path))
+        assert len(repo) == 10
+    #every reload replaced all tickers, the registry didn't grow
+    assert len(repo._tickers) == 10
+    assert [ticker.ticker for ticker in repo.get_tickers("NASDAQ")] == [f"T4{i}" for i in range(10)]
+
+def test_ticker_has_no_instance_dict():
+    ticker = Ticker("msft","nasdaq")
+    assert not hasattr(ticker,"__dict__")
+    assert ticker == Ticker("MSFT","NASDAQ") and hash(ticker) == hash(Ticker("MSFT","NASDAQ"))
+
+def test_reload_applies_only_the_changed_files(tmp_path,monkeypatch):
+    nasdaq = tmp_path/"NASDAQ.csv"
+    nasdaq.write_text("tickers\nMSFT\nAAPL\n")
+    (tmp_path/"NYSE.csv").write_text("tickers\nIBM\n")
+    repo = TickerRepository(None)
+    added,removed = repo.reload_tickers(str(tmp_path))
+    assert sorted(ticker.ticker for ticker in added) == ["AAPL","IBM","MSFT"] and removed == []
+
+    parsed = []
+    read_ticker_file = repo._read_ticker_file
+    monkeypatch.setattr(repo,"_read_ticker_file",lambda file:parsed.append(os.path.basename(file)) or read_ticker_file(file))
+    assert repo.reload_tickers(str(tmp_path)) == ([],[])
+    #touching a file without changing its content is confirmed by the hash
+    os.utime(nasdaq,ns=(0,0))
+    assert repo.reload_tickers(str(tmp_path)) == ([],[])
+    assert parsed == []
+
+    nasdaq.write_text("tickers\nMSFT\nGOOGL\nIBM\n")
+    (tmp_path/"NYSE.csv").unlink()
+    added,removed = repo.reload_tickers(str(tmp_path))
+    assert parsed == ["NASDAQ.csv"]
+    assert added == [Ticker("GOOGL","NASDAQ"),Ticker("IBM","NASDAQ")]
+    #IBM moved to another exchange
+    assert removed == [Ticker("IBM","NYSE"),Ticker("AAPL","NASDAQ")]
+    assert [ticker.ticker for ticker in repo.get_tickers("NASDAQ")] == ["MSFT","GOOGL","IBM"]
+    assert repo.get_exchanges() == ["NASDAQ"]
+
+class AggregatingQuestClient(QuestClient):
+    """
+    Records the aggregation queries and answers them with one bucket per requested ticker
+    """
+    def __init__(self) -> None:
+        super().__init__("localhost")
+        self.queries = []
+
+    def query_frame(self,query:str,dtype:dict[str,str]={}):
+        self.queries.append(query)
+        tickers = re.findall(r"'([^']*)'",re.search(r"IN \((.*)\)",query).group(1))
+        columns = [column.split(" ")[-1] for column in re.search(r"SELECT (.*) FROM",query).group(1).split(",")[2:]]
+        return pd.DataFrame([[ticker,datetime(2022,8,1)]+[1.0]*len(columns) for ticker in tickers],columns=["ticker","timestamp"]+columns)
+
+def test_get_aggregated_pushes_sample_by_to_questdb():
+    questClient = AggregatingQuestClient()
+    repo = TickerRepository(questClient)
+    tickers = [Ticker("MSFT","NASDAQ"),Ticker("SAP.DE","EUREX"),Ticker("AAPL","NASDAQ")]
+    result = repo.get_aggregated(tickers,"5m","1h",{"close":"last(close)","vwap":"vwap"},fill="prev")
+    assert list(result) == ["MSFT","SAP.DE","AAPL"]
+    assert list(result["SAP.DE"].columns) == ["close","vwap"]
+    #one query per exchange
+    assert len(questClient.queries) == 2
+    query = questClient.queries[0]
+    assert "SELECT ticker,timestamp,last(close) close,sum(close*volume)/sum(volume) vwap FROM 'interval_5m'" in query
+    assert query.endswith(" SAMPLE BY 1h FILL(PREV) ALIGN TO CALENDAR;")
+
+    weekly = repo.get_aggregated(Ticker("MSFT","NASDAQ"),"1d","7d")
+    assert list(weekly.columns) == ["open","high","low","close","volume"]
+    assert "first(open) open,max(high) high,min(low) low,last(close) close,sum(volume) volume" in questClient.queries[-1]
+
+def test_get_aggregated_fits_the_url_length(monkeypatch):
+    monkeypatch.setattr(quest_client_module,"MAX_URL_LENGTH",600)
+    questClient = AggregatingQuestClient()
+    names = [f"TICKER{i}" for i in range(100)]
+    result = TickerRepository(questClient).get_aggregated([Ticker(name,"NASDAQ") for name in names],"5m","1h",fill="linear")
+    assert len(result) == 100
+    assert len(questClient.queries) > 1
+    assert all(len(questClient._query_url(query,"exp")) <= 600 for query in questClient.queries)
+
+def test_get_aggregated_rejects_unsafe_input():
+    repo = TickerRepository(AggregatingQuestClient())
+    ticker = Ticker("MSFT","NASDAQ")
+    for kwargs in [{"sample_by":"1h;DROP TABLE x"},{"sample_by":"1h","aggregations":{"close":"median(close)"}},
+                   {"sample_by":"1h","aggregations":{"close":"last(ticker)"}},{"sample_by":"1h","aggregations":{"a b":"vwap"}},
+                   {"sample_by":"1h","fill":"NEXT"}]:
+        with pytest.raises(ValueError):
+            repo.get_aggregated(ticker,"5m",**kwargs)
+    repo.get_aggregated(ticker,"5m","1h",fill=0)
+
+def test_get_panel_aligns_tickers_in_one_frame():
+    rows = build_rows("NASDAQ",["MSFT","AAPL"],3)+build_rows("EUREX",["SAP.DE"],2)
+    #AAPL misses the second bar
+    rows = [row for row in rows if not (row[1] == "AAPL" and row[2].startswith("2022-08-02"))]
+    repo = TickerRepository(FakeQuestClient(rows))
+    tickers = [Ticker("MSFT","NASDAQ"),Ticker("AAPL","NASDAQ"),Ticker("SAP.DE","EUREX")]
+
+    long = repo.get_panel(tickers,"1d",["close","volume"],layout="long")
+    assert len(long) == 7
+    assert long["ticker"].dtype == "category" and list(long["ticker"].cat.categories) == ["MSFT","AAPL","SAP.DE"]
+    assert long["exchange"].dtype == "category" and set(long["exchange"].astype(str)) == {"NASDAQ","EUREX"}
+    assert long["close"].dtype == np.float32 and long["volume"].dtype == np.int64
+
+    wide = repo.get_panel(tickers,"1d",["close","volume"])
+    assert list(wide.columns) == [(value,ticker) for value in ["close","volume"] for ticker in ["MSFT","AAPL","SAP.DE"]]
+    assert list(wide.index) == list(pd.date_range("2022-08-01",periods=3,freq="1D"))
+    assert wide["close"].dtypes.tolist() == [np.float32]*3
+    assert wide[("close","MSFT")].tolist() == [0.0,1.0,2.0]
+    assert wide[("close","AAPL")].tolist()[1] != wide[("close","AAPL")].tolist()[1]
+    assert wide[("volume","SAP.DE")].tolist()[:2] == [0,1]
+    assert np.isnan(wide[("volume","SAP.DE")].iloc[2])
+
+    empty = repo.get_panel([Ticker("UNKNOWN","NASDAQ")],"1d",["close"])
+    assert empty.shape == (0,1)
+
+def test_get_panel_rejects_a_symbol_on_several_exchanges():
+    rows = build_rows("NASDAQ",["MSFT"],2)+build_rows("EUREX",["MSFT"],2)
+    repo = TickerRepository(FakeQuestClient(rows))
+    tickers = [Ticker("MSFT","NASDAQ"),Ticker("MSFT","EUREX")]
+    #one column per symbol would overwrite one listing with the other
+    with pytest.raises(ValueError):
+        repo.get_panel(tickers,"1d",["close"])
+    long = repo.get_panel(tickers,"1d",["close"],layout="long")
+    assert len(long) == 4 and set(long["exchange"].astype(str)) == {"NASDAQ","EUREX"}
+    #requesting the same listing twice is fine
+    assert list(repo.get_panel([Ticker("MSFT","NASDAQ")]*2,"1d",["close"]).columns) == [("close","MSFT")]
+
+def test_reload_keeps_tickers_listed_by_another_file(tmp_path):
+    (tmp_path/"NASDAQ.csv").write_text("tickers\nMSFT\nAAPL\n")
+    (tmp_path/"nasdaq.extra.csv").write_text("tickers\nAAPL\nIBM\n")
+    repo = TickerRepository(None)
+    added,removed = repo.reload_tickers(str(tmp_path))
+    assert sorted(ticker.ticker for ticker in added) == ["AAPL","IBM","MSFT"] and removed == []
+
+    #AAPL is still listed by the other file of the exchange
+    (tmp_path/"NASDAQ.csv").write_text("tickers\nMSFT\n")
+    assert repo.reload_tickers(str(tmp_path)) == ([],[])
+    assert repo.get_ticker("AAPL","NASDAQ") == Ticker("AAPL","NASDAQ")
+
+    (tmp_path/"nasdaq.extra.csv").unlink()
+    added,removed = repo.reload_tickers(str(tmp_path))
+    assert added == [] and sorted(ticker.ticker for ticker in removed) == ["AAPL","IBM"]
+    assert [ticker.ticker for ticker in repo.get_tickers("NASDAQ")] == ["MSFT"]
+    assert repo.lookup("AAPL") is None and "AAPL" not in repo._symbols
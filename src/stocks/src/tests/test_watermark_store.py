@@ -0,0 +1,188 @@
+import contextlib
+from finance_stock_scraper import workflow
+from finance_stock_scraper.WatermarkStore import WatermarkStore
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from finance_stock_scraper.TickerRepository import TickerRepository
+from finance_stock_scraper.QuestClient import QuestClient
+from finance_stock_scraper.model.Ticker import Ticker
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+import requests
+
+def utc(*args)->datetime:
+    return datetime(*args,tzinfo=pytz.UTC)
+
+def test_watermarks_are_only_persisted_on_commit(tmp_path):
+    path = str(tmp_path/"watermarks.sqlite")
+    store = WatermarkStore(path)
+    store.rebuild("1d","NASDAQ",{"A":utc(2022,8,1)})
+    store.stage("1d","NASDAQ",{"A":utc(2022,8,3),"B":utc(2022,8,2)})
+    store.stage("1d","NASDAQ",{"A":utc(2022,8,2)})
+    assert store.get("1d","NASDAQ") == {"A":utc(2022,8,1)}
+    assert store.commit("1d","NASDAQ") == 2
+    store.close()
+
+    store = WatermarkStore(path)
+    assert store.get("1d","NASDAQ") == {"A":utc(2022,8,3),"B":utc(2022,8,2)}
+    assert store.get("1d","NYSE") == {}
+    assert not store.needs_rebuild("1d","NASDAQ")
+
+    #watermarks never move backwards
+    store.stage("1d","NASDAQ",{"A":utc(2022,7,1)})
+    store.commit("1d","NASDAQ")
+    assert store.get("1d","NASDAQ")["A"] == utc(2022,8,3)
+
+def test_invalidate_and_validate_force_a_rebuild():
+    store = WatermarkStore(":memory:")
+    assert store.needs_rebuild("1d","NASDAQ")
+    store.rebuild("1d","NASDAQ",{"A":utc(2022,8,3)})
+    store.stage("1d","NASDAQ",{"A":utc(2022,8,4)})
+    store.invalidate("1d","NASDAQ")
+    assert store.commit("1d","NASDAQ") == 0
+    assert store.needs_rebuild("1d","NASDAQ")
+
+    store.rebuild("1d","NASDAQ",{"A":utc(2022,8,3)})
+    store.validate("1d",utc(2022,8,3))
+    assert store.get("1d","NASDAQ") == {"A":utc(2022,8,3)}
+    #the table was emptied
+    store.validate("1d",None)
+    assert store.get("1d","NASDAQ") == {}
+    assert store.needs_rebuild("1d","NASDAQ")
+
+class FakeRepository(object):
+    def __init__(self,tickers:list[Ticker]) -> None:
+        self.tickers = tickers
+
+    def get_tickers(self,exchange:str)->list[Ticker]:
+        return self.tickers if exchange == "NASDAQ" else []
+
+class FakeDataProvider(object):
+    def __init__(self) -> None:
+        self.requests = []
+
+    def _frame(self,tickers:list[str],start:datetime,end:datetime)->pd.DataFrame:
+        index = pd.date_range(start,end,freq="1D",tz="UTC",inclusive="right")
+        columns = pd.MultiIndex.from_product([tickers,["Open","High","Low","Close","Adj Close","Volume"]])
+        return pd.DataFrame(np.ones((len(index),len(columns))),index=index,columns=columns)
+
+    def get_data_from_period(self,tickers:list[str],interval:str,period:str="max"):
+        self.requests.append(("period",tuple(tickers)))
+        yield self._frame(tickers,utc(2022,7,1),utc(2022,8,1)),{}
+
+    def get_data(self,tickers:list[str],start_date:datetime,end_date:datetime,interval:str):
+        self.requests.append((start_date,tuple(tickers)))
+        yield self._frame(tickers,start_date,end_date),{}
+
+class FakeQuestClient(object):
+    spooled_bytes = 0
+
+    def __init__(self,last_entries:dict[str,datetime],fail_flush:bool=False) -> None:
+        self.last_entries = last_entries
+        self.fail_flush = fail_flush
+        self.lookups = 0
+
+    def create_table(self,interval:str)->None:
+        pass
+
+    def get_latest_timestamp(self,interval:str)->datetime|None:
+        return max(self.last_entries.values(),default=None)
+
+    def get_last_entry_dates(self,interval:str,exchange:str|None=None)->dict[str,datetime]:
+        self.lookups += 1
+        return dict(self.last_entries)
+
+    def submit_points(self,buffer,rows:int=0)->None:
+        pass
+
+    def job(self):
+        return contextlib.nullcontext()
+
+    def flush_points(self)->None:
+        if self.fail_flush:
+            raise ConnectionError("QuestDB is down")
+
+def run(store:WatermarkStore,questClient:FakeQuestClient,provider:FakeDataProvider,now:datetime)->None:
+    executionContext = ExecutionContext(FakeRepository([Ticker("A","NASDAQ"),Ticker("B","NASDAQ")]),provider,questClient,watermarkStore=store)
+    workflow.prepare_interval("1d",executionContext)
+    workflow.gather_interval("NASDAQ","1d",executionContext,now)
+
+def test_flow_reads_watermarks_from_the_store():
+    store = WatermarkStore(":memory:")
+    questClient = FakeQuestClient({"A":utc(2022,7,20)})
+    provider = FakeDataProvider()
+    run(store,questClient,provider,utc(2022,8,1))
+    assert questClient.lookups == 1
+    assert provider.requests == [("period",("B",)),(utc(2022,7,20),("A",))]
+    assert store.get("1d","NASDAQ") == {"A":utc(2022,8,1),"B":utc(2022,8,1)}
+
+    #the second run doesn't touch QuestDB and continues from the committed watermarks
+    questClient.last_entries = store.get("1d","NASDAQ")
+    provider.requests = []
+    run(store,questClient,provider,utc(2022,8,5))
+    assert questClient.lookups == 1
+    assert provider.requests == [(utc(2022,8,1),("A","B"))]
+    assert store.get("1d","NASDAQ") == {"A":utc(2022,8,5),"B":utc(2022,8,5)}
+
+def test_failed_flush_discards_the_staged_watermarks():
+    store = WatermarkStore(":memory:")
+    questClient = FakeQuestClient({"A":utc(2022,7,20),"B":utc(2022,7,20)},fail_flush=True)
+    with pytest.raises(ConnectionError):
+        run(store,questClient,FakeDataProvider(),utc(2022,8,1))
+    assert store.get("1d","NASDAQ") == {"A":utc(2022,7,20),"B":utc(2022,7,20)}
+    assert store.needs_rebuild("1d","NASDAQ")
+
+def test_reloaded_tickers_are_backfilled(tmp_path):
+    (tmp_path/"NASDAQ.csv").write_text("tickers\nA\nB\n")
+    repository = TickerRepository(None)
+    repository.load_tickers(str(tmp_path))
+    store = WatermarkStore(":memory:")
+    questClient = FakeQuestClient({"A":utc(2022,7,20),"B":utc(2022,7,20)})
+    provider = FakeDataProvider()
+    executionContext = ExecutionContext(repository,provider,questClient,watermarkStore=store)
+    workflow.prepare_interval("1d",executionContext)
+    workflow.gather_interval("NASDAQ","1d",executionContext,utc(2022,8,1))
+
+    (tmp_path/"NASDAQ.csv").write_text("tickers\nA\nB\nC\n")
+    added,_ = repository.reload_tickers(str(tmp_path))
+    assert added == [Ticker("C","NASDAQ")]
+    provider.requests = []
+    workflow.gather_interval("NASDAQ","1d",executionContext,utc(2022,8,5))
+    #only the new ticker takes the backfill path, the watermarks of the others are kept
+    assert provider.requests == [("period",("C",)),(utc(2022,8,1),("A","B"))]
+    assert questClient.lookups == 1
+
+class UnavailableQuestClient(QuestClient):
+    """
+    Every query fails like QuestDB under load
+    """
+    def __init__(self) -> None:
+        super().__init__("localhost")
+
+    def raw_query(self,query:str):
+        response = requests.Response()
+        response.status_code = 500
+        return response
+
+def test_failed_queries_keep_the_watermarks():
+    store = WatermarkStore(":memory:")
+    store.rebuild("1d","NASDAQ",{"A":utc(2022,7,20)})
+    questClient = UnavailableQuestClient()
+    with pytest.raises(Exception):
+        questClient.get_last_entry_dates("1d","NASDAQ")
+    with pytest.raises(Exception):
+        questClient.get_latest_timestamp("1d")
+
+    executionContext = ExecutionContext(FakeRepository([Ticker("A","NASDAQ")]),FakeDataProvider(),questClient,watermarkStore=store)
+    workflow.prepare_interval("1d",executionContext)
+    assert store.get("1d","NASDAQ") == {"A":utc(2022,7,20)}
+    assert not store.needs_rebuild("1d","NASDAQ")
+
+    #a rebuild that can't reach QuestDB fails the job instead of marking the exchange as synced without watermarks
+    store.invalidate("1d","NASDAQ")
+    with pytest.raises(Exception):
+        workflow.get_last_entries("1d","NASDAQ",executionContext)
+    assert store.get("1d","NASDAQ") == {"A":utc(2022,7,20)}
+    assert store.needs_rebuild("1d","NASDAQ")
@@ -0,0 +1,178 @@
+from finance_stock_scraper import workflow
+from finance_stock_scraper.ExecutionContext import ExecutionContext
+from finance_stock_scraper.model.Ticker import Ticker
+from datetime import datetime,timedelta
+import time
+import threading
+import numpy as np
+import pandas as pd
+import pytz
+
+class FakeQuestClient(object):
+    def __init__(self) -> None:
+        self.flushed = []
+
+    def submit_points(self,buffer,rows:int=0)->None:
+        if len(buffer) > 0:
+            self.flushed.append(str(buffer))
+
+def build_frame(tickers:list[str],periods:int,tz:str|None="America/New_York",seed:int=0)->pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2022-08-01 09:30",periods=periods,freq="5min",tz=tz)
+    columns = pd.MultiIndex.from_product([tickers,["Open","High","Low","Close","Adj Close","Volume"]])
+    values = rng.random((periods,len(columns)))*100
+    df = pd.DataFrame(values,index=index,columns=columns)
+    for ticker in tickers:
+        df[(ticker,"Volume")] = rng.integers(0,4_000_000_000,periods).astype(np.float64)
+    #sprinkle some invalid values
+    df.iloc[rng.integers(0,periods,periods//10),rng.integers(0,len(columns),periods//10)] = np.nan
+    return df
+
+def ingest(data:pd.DataFrame,tickers:list[Ticker],mode:str,minimal_date:datetime=datetime(1, 1, 1))->str:
+    questClient = FakeQuestClient()
+    executionContext = ExecutionContext(None,None,questClient)
+    workflow.INGESTION_MODE = mode
+    try:
+        workflow.store_points(data,tickers,"Test",executionContext,"5m","NASDAQ",minimal_date)
+    finally:
+        workflow.INGESTION_MODE = "COLUMNAR"
+    return "".join(questClient.flushed)
+
+def test_columnar_ingestion_matches_row_ingestion():
+    tickers = [Ticker(name,"NASDAQ") for name in ["MSFT","AAPL","GOOGL"]]
+    data = build_frame(["AAPL","GOOGL","MSFT"],500)
+    columnar = ingest(data,tickers,"COLUMNAR")
+    assert len(columnar) > 0
+    assert columnar == ingest(data,tickers,"ROW")
+
+def test_columnar_ingestion_matches_row_ingestion_for_naive_index():
+    tickers = [Ticker(name,"NYSE") for name in ["A","B"]]
+    data = build_frame(["A","B"],300,tz=None)
+    assert ingest(data,tickers,"COLUMNAR") == ingest(data,tickers,"ROW")
+
+def test_columnar_ingestion_respects_minimal_date():
+    tickers = [Ticker(name,"NASDAQ") for name in ["A","B"]]
+    data = build_frame(["A","B"],200)
+    minimal_date = data.index[100].to_pydatetime().astimezone(pytz.UTC)
+    columnar = ingest(data,tickers,"COLUMNAR",minimal_date)
+    assert columnar == ingest(data,tickers,"ROW",minimal_date)
+    assert len(workflow.to_long_frame(data,tickers,minimal_date)) <= 2*99
+
+def test_columnar_ingestion_skips_unknown_tickers_and_clamps_volume():
+    tickers = [Ticker(name,"NASDAQ") for name in ["A","MISSING"]]
+    data = build_frame(["A"],50)
+    long_frame = workflow.to_long_frame(data,tickers)
+    assert set(long_frame["ticker"]) == {"A"}
+    assert long_frame["volume"].max() <= workflow.FLUX_PROTOCOL_MAX_INT
+    assert long_frame[["open","high","low","close","adj_close"]].isna().sum().sum() == 0
+
+def test_columnar_ingestion_respects_minimal_date_per_ticker():
+    tickers = [Ticker(name,"NASDAQ") for name in ["A","B","C"]]
+    data = build_frame(["A","B","C"],200)
+    minimal_dates = {"A":data.index[50].to_pydatetime(),"B":data.index[150].to_pydatetime()}
+    assert ingest(data,tickers,"COLUMNAR",minimal_dates) == ingest(data,tickers,"ROW",minimal_dates)
+    long_frame = workflow.to_long_frame(data,tickers,minimal_dates)
+    first = long_frame.groupby("ticker",observed=True)["timestamp"].min()
+    assert first["A"] > data.index[50] and first["B"] > data.index[150] and first["C"] == data.index[0]
+
+def test_plan_batches_groups_last_entries_into_buckets():
+    tickers = [Ticker(f"T{i}","NASDAQ") for i in range(6)]
+    day = datetime(2022,8,1,tzinfo=pytz.UTC)
+    last_dates = {
+        tickers[0]:day+timedelta(hours=19,minutes=55),
+        tickers[1]:day+timedelta(hours=19,minutes=50),
+        tickers[2]:day+timedelta(hours=13,minutes=30),
+        tickers[3]:day+timedelta(days=1,hours=19,minutes=55),
+        tickers[4]:day+timedelta(days=1,hours=19,minutes=55),
+        tickers[5]:day-timedelta(days=3),
+    }
+    batches = workflow.plan_batches(last_dates,"5m")
+    assert [batch.names for batch in batches] == [["T5"],["T0","T1","T2"],["T3","T4"]]
+    assert batches[1].start == day+timedelta(hours=13,minutes=30)
+    assert batches[1].minimal_dates["T0"] == day+timedelta(hours=19,minutes=55)
+    #daily intervals use wider buckets
+    assert len(workflow.plan_batches(last_dates,"1d")) <= 2
+    assert workflow.plan_batches({},"5m") == []
+
+class SlowDataProvider(object):
+    def __init__(self,tickers:list[str],delay:float,failing_slices:list[int]=[]) -> None:
+        self.tickers = tickers
+        self.delay = delay
+        self.failing_slices = failing_slices
+        self.calls = 0
+
+    def get_data(self,tickers:list[str],start_date:datetime,end_date:datetime,interval:str):
+        self.calls += 1
+        if self.calls-1 in self.failing_slices:
+            raise ConnectionError("Yahoo is down")
+        time.sleep(self.delay)
+        data = build_frame(self.tickers,20,seed=self.calls)
+        #the bars of the requested slice
+        data.index = pd.date_range(start_date,periods=len(data),freq="5min")
+        yield data,{}
+
+class SlowQuestClient(FakeQuestClient):
+    def __init__(self,delay:float) -> None:
+        super().__init__()
+        self.delay = delay
+        self.stored_slices = 0
+
+    def submit_points(self,buffer,rows:int=0)->None:
+        super().submit_points(buffer,rows)
+        self.stored_slices += 1
+        time.sleep(self.delay)
+
+class OverlapDataProvider(SlowDataProvider):
+    """
+    The download of the second slice waits until the first slice is being stored
+    """
+    def __init__(self,tickers:list[str],downloading:threading.Event,storing:threading.Event) -> None:
+        super().__init__(tickers,0)
+        self.downloading = downloading
+        self.storing = storing
+        self.overlapped = False
+
+    def get_data(self,tickers:list[str],start_date:datetime,end_date:datetime,interval:str):
+        if self.calls == 1:
+            self.downloading.set()
+            self.overlapped = self.storing.wait(timeout=5)
+        yield from super().get_data(tickers,start_date,end_date,interval)
+
+class OverlapQuestClient(SlowQuestClient):
+    """
+    Storing the first slice waits until the second slice is being downloaded
+    """
+    def __init__(self,downloading:threading.Event,storing:threading.Event) -> None:
+        super().__init__(0)
+        self.downloading = downloading
+        self.storing = storing
+        self.overlapped = False
+
+    def submit_points(self,buffer,rows:int=0)->None:
+        if self.stored_slices == 0:
+            self.storing.set()
+            self.overlapped = self.downloading.wait(timeout=5)
+        super().submit_points(buffer,rows)
+
+def test_download_in_slices_overlaps_download_and_ingestion():
+    tickers = [Ticker(name,"NASDAQ") for name in ["A","B"]]
+    downloading,storing = threading.Event(),threading.Event()
+    provider = OverlapDataProvider(["A","B"],downloading,storing)
+    questClient = OverlapQuestClient(downloading,storing)
+    executionContext = ExecutionContext(None,provider,questClient)
+    now = datetime(2022,8,30,tzinfo=pytz.UTC)
+    workflow.download_in_slices(tickers,"5m","NASDAQ",now-timedelta(days=24),now,executionContext)
+    assert provider.calls == 4
+    assert questClient.stored_slices == 4
+    #sequential slices would wait for each other until the timeout
+    assert provider.overlapped and questClient.overlapped
+
+def test_download_in_slices_continues_after_failed_slice():
+    tickers = [Ticker(name,"NASDAQ") for name in ["A","B"]]
+    provider = SlowDataProvider(["A","B"],0,failing_slices=[1])
+    questClient = SlowQuestClient(0)
+    executionContext = ExecutionContext(None,provider,questClient)
+    now = datetime(2022,8,30,tzinfo=pytz.UTC)
+    workflow.download_in_slices(tickers,"5m","NASDAQ",now-timedelta(days=24),now,executionContext)
+    assert provider.calls == 4
+    assert questClient.stored_slices == 3
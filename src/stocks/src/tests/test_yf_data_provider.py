@@ -0,0 +1,58 @@
+from finance_stock_scraper import YFDataProvider as provider_module
+from finance_stock_scraper.YFDataProvider import YFDataProvider, NO_DATA_ERROR
+from datetime import datetime
+import logging
+import pandas as pd
+import numpy as np
+
+FIELDS = ["Open","High","Low","Close","Adj Close","Volume"]
+
+def fake_download(calls:list,failing:dict[str,str]={}):
+    """
+    Mimics yf.download: the frames of all tickers are concatenated, failed tickers are reindexed to NaN columns
+    and the reasons are only logged (grouped by error)
+    """
+    def download(tickers:str,**kwargs):
+        names = tickers.split(" ")
+        calls.append(names)
+        index = pd.date_range("2022-08-01",periods=3,freq="D")
+        frames = {name:pd.DataFrame(np.nan if name in failing or name.startswith("X") else 1.0,index=index,columns=FIELDS) for name in names}
+        reasons = {}
+        for name in names:
+            if name in failing:
+                reasons.setdefault(failing[name],[]).append(name)
+        for reason,symbols in reasons.items():
+            logging.getLogger("yfinance").error(f"{symbols}: {reason}")
+        return pd.concat(frames.values(),axis=1,keys=frames.keys(),names=["Ticker","Price"])
+    return download
+
+def test_provider_downloads_in_batches(monkeypatch):
+    calls = []
+    monkeypatch.setattr(provider_module.yf,"download",fake_download(calls,{"XC":"YFTzMissingError('possibly delisted; no timezone found')"}))
+    provider = YFDataProvider(batch_size=2)
+    batches = provider.get_data(["A","B","XC","D","E"],datetime(2022,8,1),datetime(2022,8,4),"1d")
+    assert len(calls) == 0
+    results = list(batches)
+    assert calls == [["A","B"],["XC","D"],["E"]]
+    assert [list(data.columns.get_level_values(0).unique()) for data,_ in results] == [["A","B"],["XC","D"],["E"]]
+    assert [errors for _,errors in results] == [{},{"XC":"YFTzMissingError('possibly delisted; no timezone found')"},{}]
+
+def test_provider_reads_failures_from_the_frame(monkeypatch):
+    monkeypatch.setattr(provider_module.yf,"download",fake_download([],{"B":"YFRateLimitError('Too Many Requests. Rate limited. Try after a while.')"}))
+    (data,errors), = YFDataProvider().get_data(["A","B","XD"],datetime(2022,8,1),datetime(2022,8,4),"1d")
+    #XD failed without a logged reason
+    assert errors == {"B":"YFRateLimitError('Too Many Requests. Rate limited. Try after a while.')","XD":NO_DATA_ERROR}
+    #the collector is removed after the download
+    assert not any(isinstance(handler,provider_module.ErrorCollector) for handler in logging.getLogger("yfinance").handlers)
+
+def test_provider_groups_single_ticker(monkeypatch):
+    def download(tickers:str,**kwargs):
+        return pd.DataFrame(np.ones((3,len(FIELDS))),index=pd.date_range("2022-08-01",periods=3,freq="D"),columns=FIELDS)
+    monkeypatch.setattr(provider_module.yf,"download",download)
+    (data,errors), = YFDataProvider().get_data_from_period(["A"],"1d")
+    assert isinstance(data.columns,pd.MultiIndex)
+    assert list(data["A"].columns) == FIELDS
+    assert errors == {}
+
+def test_provider_yields_nothing_without_tickers():
+    assert list(YFDataProvider().get_data([],datetime(2022,8,1),datetime(2022,8,4),"1d")) == []